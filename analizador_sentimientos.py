@@ -1,12 +1,51 @@
 import os
-import requests
-import json
-from dotenv import load_dotenv
+import glob
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import configuracion
+import cliente_ollama
+import manifiesto_analisis
+import deduplicador_resenas
+import gestor_modelos
+import sesion_prompt
+import metricas
 
-load_dotenv()
+OLLAMA_MODEL = configuracion.obtener("OLLAMA_MODEL", "llama3:instruct")  # Mejor para análisis
 
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3:instruct")  # Mejor para análisis
+PROMPT_SISTEMA = """Eres un analizador experto de sentimientos en reseñas de productos. 
+    Analiza las reseñas y proporciona:
+    1. Un resumen conciso (50 palabras máximo)
+    2. Sentimiento general [Positivo/Negativo/Neutro]
+    3. 3 puntos fuertes
+    4. 3 áreas de mejora
+    
+    Formato de salida:
+    Nombre del Producto: [nombre]
+    Resumen: [texto]
+    Sentimiento: [Positivo/Negativo/Neutro]
+    Puntos fuertes:
+    - [punto 1]
+    - [punto 2]
+    - [punto 3]
+    Áreas de mejora:
+    - [área 1]
+    - [área 2]
+    - [área 3]"""
+
+PROMPT_ACTUALIZACION = """Análisis previo del producto:
+{analisis_previo}
+
+Nuevas reseñas recibidas desde ese análisis:
+{nuevas_resenas}
+
+Actualiza el análisis previo incorporando las nuevas reseñas. Mantén el mismo formato de salida."""
+
+# Cambia automáticamente cuando se edita el prompt, forzando un re-análisis completo
+VERSION_PROMPT = manifiesto_analisis.hash_texto(
+    PROMPT_SISTEMA + PROMPT_ACTUALIZACION + deduplicador_resenas.ENCABEZADO
+)[:12]
+NOMBRE_MANIFIESTO = ".manifiesto_analisis.json"
 
 def carga(nombre_archivo):
     try:
@@ -24,104 +63,205 @@ def guardar(nombre_archivo, contenido):
         print(f"Error al guardar el archivo: {e}")
 
 def procesar_respuesta_stream(response):
-    full_response = ""
+    """
+    Concatena el texto de una respuesta streaming ya abierta
+    """
     try:
-        for line in response.iter_lines():
-            if line:
-                decoded_line = line.decode('utf-8')
-                json_data = json.loads(decoded_line)
-                if 'message' in json_data and 'content' in json_data['message']:
-                    full_response += json_data['message']['content']
-        return full_response
+        chunks = cliente_ollama.iterar_stream(response)
+        return "".join(cliente_ollama.fragmento(chunk) for chunk in chunks)
     except Exception as e:
         print(f"Error procesando streaming: {e}")
         return None
 
-def analizador_sentimientos(producto):
-    prompt_sistema = """Eres un analizador experto de sentimientos en reseñas de productos. 
-    Analiza las reseñas y proporciona:
-    1. Un resumen conciso (50 palabras máximo)
-    2. Sentimiento general [Positivo/Negativo/Neutro]
-    3. 3 puntos fuertes
-    4. 3 áreas de mejora
-    
-    Formato de salida:
-    Nombre del Producto: [nombre]
-    Resumen: [texto]
-    Sentimiento: [Positivo/Negativo/Neutro]
-    Puntos fuertes:
-    - [punto 1]
-    - [punto 2]
-    - [punto 3]
-    Áreas de mejora:
-    - [área 1]
-    - [área 2]
-    - [área 3]"""
+def analizar_streaming(contenido_usuario, ruta_salida, mostrar=False):
+    """
+    Envía las reseñas con el prompt de sistema fijo (cuyo prefijo reutiliza el servidor),
+    consume la respuesta en streaming y escribe cada fragmento en disco según llega.
+    El archivo final solo se reemplaza si el stream termina correctamente.
+    Devuelve (texto, medidas_stream); texto es None si falló.
+    """
+    ruta_parcial = ruta_salida + ".parcial"
+    partes = []
+    final = None
+    medidas_stream = {"ttft_s": None, "total_s": None, "tokens_por_s": None}
+    inicio = time.perf_counter()
+
+    try:
+        with open(ruta_parcial, "w", encoding="utf-8") as archivo:
+            sesion = sesion_prompt.obtener(PROMPT_SISTEMA, OLLAMA_MODEL)
+            chunks = sesion.chat_stream(contenido_usuario, opciones={"temperature": 0.5}, timeout=120)
+            for chunk in chunks:
+                if "error" in chunk:
+                    raise RuntimeError(chunk["error"])
+
+                texto = cliente_ollama.fragmento(chunk)
+                if texto:
+                    if medidas_stream["ttft_s"] is None:
+                        medidas_stream["ttft_s"] = time.perf_counter() - inicio
+                    partes.append(texto)
+                    archivo.write(texto)
+                    archivo.flush()
+                    if mostrar:
+                        print(texto, end="", flush=True)
+
+                if chunk.get("done"):
+                    final = chunk
+    except Exception as e:
+        # No se reenvía el prompt: un fallo a mitad del stream no duplica la evaluación
+        print(f"Error procesando streaming: {e}")
+        final = None
+
+    medidas_stream["total_s"] = time.perf_counter() - inicio
+    if mostrar and partes:
+        print()
+
+    if final is None or not partes:
+        if os.path.exists(ruta_parcial):
+            os.remove(ruta_parcial)
+        return None, medidas_stream
+
+    os.replace(ruta_parcial, ruta_salida)
 
-    datos_producto = carga(f"datos/{producto}.txt")
+    # Preferimos la velocidad medida por el servidor; si no viene, la estimamos por fragmentos
+    if final.get("eval_count") and final.get("eval_duration"):
+        medidas_stream["tokens_por_s"] = final["eval_count"] / (final["eval_duration"] / 1e9)
+    elif medidas_stream["total_s"] > medidas_stream["ttft_s"]:
+        medidas_stream["tokens_por_s"] = len(partes) / (medidas_stream["total_s"] - medidas_stream["ttft_s"])
+
+    return "".join(partes), medidas_stream
+
+def compactar_resenas(producto, texto):
+    """
+    Agrupa las reseñas casi idénticas y limita la entrada al presupuesto de tokens,
+    así el costo del análisis no crece con la cantidad de reseñas
+    """
+    compacto, estadisticas = deduplicador_resenas.compactar(texto, OLLAMA_MODEL)
+    if compacto is not texto:
+        print(f"  {producto}: {estadisticas['resenas']} reseñas en {estadisticas['grupos']} grupos "
+              f"({estadisticas['incluidos']} enviados), ~{estadisticas['tokens']} tokens "
+              f"de ~{estadisticas['tokens_original']}")
+    return compacto
+
+@metricas.etiquetado("analizador_sentimientos", "sentimientos")
+def analizador_sentimientos(producto, directorio="datos", mostrar=True, manifiesto=None):
+    """
+    Analiza las reseñas de un producto y guarda el resultado en analisis_<producto>.txt.
+    Con un manifiesto, omite los archivos sin cambios y, si solo se agregaron reseñas,
+    analiza únicamente las nuevas y las combina con el análisis previo.
+    Las reseñas casi duplicadas se agrupan con su conteo antes de enviarlas.
+    Devuelve el texto del análisis o None si falló.
+    """
+    datos_producto = carga(os.path.join(directorio, f"{producto}.txt"))
     if not datos_producto:
         print(f"No se encontraron datos para {producto}")
-        return
+        return None
 
-    print(f"Analizando: {producto}...")
+    ruta_salida = os.path.join(directorio, f"analisis_{producto}.txt")
+    nombre_salida = os.path.basename(ruta_salida)
 
-    messages = [
-        {"role": "system", "content": prompt_sistema},
-        {"role": "user", "content": datos_producto}
-    ]
+    estado, previo = manifiesto_analisis.COMPLETO, None
+    if manifiesto is not None:
+        estado, previo = manifiesto.estado(nombre_salida, datos_producto, VERSION_PROMPT, OLLAMA_MODEL, ruta_salida)
 
-    try:
-        # Primero intentamos sin streaming
-        response = requests.post(
-            f"{OLLAMA_BASE_URL}/api/chat",
-            json={
-                "model": OLLAMA_MODEL,
-                "messages": messages,
-                "stream": False,  # Forzamos modo no-streaming primero
-                "options": {"temperature": 0.5}
-            },
-            timeout=120
+    if estado == manifiesto_analisis.SIN_CAMBIOS:
+        print(f"⏭️  Sin cambios: {producto}")
+        return carga(ruta_salida)
+
+    if estado == manifiesto_analisis.AMPLIADO:
+        print(f"Actualizando: {producto} (solo reseñas nuevas)...")
+        contenido_usuario = PROMPT_ACTUALIZACION.format(
+            analisis_previo=carga(ruta_salida),
+            nuevas_resenas=compactar_resenas(producto, datos_producto[len(previo):].strip())
         )
+    else:
+        print(f"Analizando: {producto}...")
+        contenido_usuario = compactar_resenas(producto, datos_producto)
 
-        if response.status_code == 200:
-            respuesta_json = response.json()
-            texto_respuesta = respuesta_json["message"]["content"]
-        else:
-            # Fallback a streaming si el modo directo falla
-            response = requests.post(
-                f"{OLLAMA_BASE_URL}/api/chat",
-                json={
-                    "model": OLLAMA_MODEL,
-                    "messages": messages,
-                    "stream": True,
-                    "options": {"temperature": 0.5}
-                },
-                timeout=120,
-                stream=True
-            )
-            texto_respuesta = procesar_respuesta_stream(response)
-
-        if texto_respuesta:
-            guardar(f"datos/analisis_{producto}.txt", texto_respuesta)
-            print(f"✅ Análisis completado para {producto}")
-            print("-" * 50)
-            print(texto_respuesta[:500] + "...")  # Muestra parte del resultado
-            print("-" * 50)
-        else:
-            print(f"❌ No se obtuvo respuesta válida para {producto}")
-
-    except requests.exceptions.RequestException as e:
-        print(f"Error de conexión con Ollama: {e}")
-    except Exception as e:
-        print(f"Error inesperado: {e}")
+    if mostrar:
+        print("-" * 50)
+    texto_respuesta, medidas_stream = analizar_streaming(contenido_usuario, ruta_salida, mostrar)
+    if mostrar:
+        print("-" * 50)
 
-if __name__ == "__main__":
-    productos = [
-        "evaluaciones_camisetas_algodon",
-        "evaluaciones_jeans_reciclados",
-        "evaluaciones_maquillaje"
-    ]
+    if texto_respuesta:
+        if manifiesto is not None:
+            manifiesto.registrar(nombre_salida, datos_producto, VERSION_PROMPT, OLLAMA_MODEL)
+        tokens_por_s = medidas_stream["tokens_por_s"] or 0.0
+        print(f"✅ Análisis completado para {producto} "
+              f"(TTFT {medidas_stream['ttft_s']:.2f}s, {tokens_por_s:.1f} tokens/s)")
+        return texto_respuesta
+
+    print(f"❌ No se obtuvo respuesta válida para {producto}")
+    return None
+
+def descubrir_productos(directorio="datos"):
+    """
+    Lista los productos que tienen un archivo evaluaciones_*.txt en el directorio
+    """
+    rutas = sorted(glob.glob(os.path.join(directorio, "evaluaciones_*.txt")))
+    return [os.path.splitext(os.path.basename(ruta))[0] for ruta in rutas]
+
+def _analizar_medido(producto, directorio, manifiesto):
+    inicio = time.perf_counter()
+    texto = analizador_sentimientos(producto, directorio, mostrar=False, manifiesto=manifiesto)
+    return texto is not None, time.perf_counter() - inicio
+
+def analizar_lote(productos=None, directorio="datos", max_concurrencia=4, incremental=True):
+    """
+    Analiza varios productos en paralelo con concurrencia acotada.
+    Cada análisis se guarda en cuanto termina. Devuelve {producto: (exito, latencia_s)}.
+    En modo incremental solo se analizan los archivos nuevos o modificados.
+    """
+    if productos is None:
+        productos = descubrir_productos(directorio)
+    if not productos:
+        print(f"No se encontraron evaluaciones en {directorio}")
+        return {}
+
+    # El pool HTTP debe admitir al menos tantas conexiones como hilos
+    if max_concurrencia > cliente_ollama.OLLAMA_POOL_SIZE:
+        cliente_ollama.configurar(pool_size=max_concurrencia)
+
+    manifiesto = None
+    if incremental:
+        manifiesto = manifiesto_analisis.Manifiesto(os.path.join(directorio, NOMBRE_MANIFIESTO))
+
+    gestor_modelos.asegurar_cargados([OLLAMA_MODEL])
+    resultados = {}
+    inicio = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_concurrencia) as executor:
+        futuros = {
+            executor.submit(_analizar_medido, producto, directorio, manifiesto): producto
+            for producto in productos
+        }
+        for futuro in as_completed(futuros):
+            producto = futuros[futuro]
+            exito, latencia = futuro.result()
+            resultados[producto] = (exito, latencia)
+            print(f"  {producto}: {latencia:.2f}s {'OK' if exito else 'ERROR'}")
+
+    total = time.perf_counter() - inicio
+    completados = sum(1 for exito, _ in resultados.values() if exito)
+    print("-" * 50)
+    print(f"Productos analizados: {completados}/{len(productos)}")
+    print(f"Tiempo total: {total:.2f}s")
+    print(f"Throughput: {completados / total:.2f} productos/s" if total > 0 else "Throughput: -")
+    print(sesion_prompt.obtener(PROMPT_SISTEMA, OLLAMA_MODEL).resumen())
+
+    return resultados
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Análisis de sentimientos de reseñas")
+    parser.add_argument("productos", nargs="*", help="Productos a analizar (por defecto, todos los del directorio)")
+    parser.add_argument("--directorio", default="datos", help="Directorio con evaluaciones_*.txt")
+    parser.add_argument("--concurrencia", type=int, default=4, help="Análisis simultáneos")
+    parser.add_argument("--completo", action="store_true", help="Re-analiza todo, aunque no haya cambios")
+    args = parser.parse_args(argv)
+    metricas.iniciar_si_configurado()
 
     print("=== Análisis de Sentimientos de Productos ===")
-    for producto in productos:
-        analizador_sentimientos(producto)
\ No newline at end of file
+    return analizar_lote(args.productos or None, args.directorio, args.concurrencia, incremental=not args.completo)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
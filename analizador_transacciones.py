@@ -1,12 +1,60 @@
-import os
-import requests
 import json
-from dotenv import load_dotenv
+import argparse
+import configuracion
+import cliente_ollama
+import prefiltro_fraude
+import cola_trabajos
+import historial_transacciones
+import gestor_modelos
+import sesion_prompt
+import json_incremental
+import metricas
 
-load_dotenv()
+OLLAMA_MODEL = configuracion.obtener("OLLAMA_MODEL", "llama3:instruct")  # Modelo recomendado para JSON
 
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3:instruct")  # Modelo recomendado para JSON
+TAMANO_VENTANA = 50  # Transacciones nuevas evaluadas por petición
+SOLAPE_VENTANA = 5  # Transacciones de la ventana anterior que se repiten como contexto
+TOKENS_SALIDA_POR_VEREDICTO = 20
+TOKENS_SALIDA_SOBRE = 32  # {"transacciones": [...]} y el cierre de la respuesta, una vez por petición
+ESTADOS_VALIDOS = ("Aprobado", "Posible Fraude")
+
+PROMPT_TRANSACCIONES = """Eres un analista financiero experto en detección de fraudes. 
+    Analiza estas transacciones y marca como 'Posible Fraude' aquellas que presenten:
+    - Valores atípicamente altos
+    - Localizaciones inconsistentes
+    - Patrones temporales sospechosos
+    
+    Devuelve SOLO un JSON válido con este formato exacto, sin ningún otro texto alrededor:
+    {
+        "transacciones": [
+            {
+                "ID Transacción": "id",
+                "Tipo de Transacción": "Crédito/Débito",
+                "Establecimiento": "nombre",
+                "Horario": "aaaa-mm-dd hh:mm:ss",
+                "Producto": "nombre producto",
+                "Ciudad - Estado": "Ciudad - Departamento (País)",
+                "Valor (USD)": valor,
+                "Estado": "Aprobado/Posible Fraude"
+            }
+        ]
+    }
+    """
+
+PROMPT_VEREDICTOS = """Eres un analista financiero experto en detección de fraudes. 
+    Analiza estas transacciones y marca como 'Posible Fraude' aquellas que presenten:
+    - Valores atípicamente altos
+    - Localizaciones inconsistentes
+    - Patrones temporales sospechosos
+    
+    No repitas los datos de las transacciones: devuelve solo su ID y su estado.
+    Devuelve SOLO un JSON válido con este formato exacto, sin ningún otro texto alrededor:
+    {
+        "transacciones": [
+            {"ID Transacción": "id", "Estado": "Aprobado/Posible Fraude"}
+        ]
+    }
+    """
 
 def carga(nombre_archivo):
     try:
@@ -25,94 +73,56 @@ def guardar(nombre_archivo, contenido):
 
 def extraer_json(respuesta):
     """Intenta extraer un JSON de la respuesta, incluso si viene con texto alrededor"""
-    try:
-        # Primero intentamos parsear directamente
-        return json.loads(respuesta)
-    except json.JSONDecodeError:
-        # Si falla, buscamos el JSON dentro del texto
-        try:
-            start = respuesta.find('{')
-            end = respuesta.rfind('}') + 1
-            if start != -1 and end != -1:
-                return json.loads(respuesta[start:end])
-        except Exception as e:
-            print(f"Error extrayendo JSON: {e}")
-    return None
+    return cliente_ollama.extraer_json(respuesta)
 
 def llamada_ollama(messages, temperature=0.7, formato_json=False):
     """Función mejorada para llamadas a la API de Ollama"""
-    try:
-        payload = {
-            "model": OLLAMA_MODEL,
-            "messages": messages,
-            "stream": False,
-            "options": {"temperature": temperature}
-        }
-        
-        if formato_json:
-            payload["format"] = "json"  # Intenta forzar respuesta en JSON
-            
-        response = requests.post(
-            f"{OLLAMA_BASE_URL}/api/chat",
-            json=payload,
-            timeout=120
-        )
-        
-        if response.status_code == 200:
-            respuesta = response.json()["message"]["content"]
-            
-            if formato_json:
-                json_data = extraer_json(respuesta)
-                if json_data:
-                    return json_data
-                else:
-                    print("No se pudo extraer JSON válido de la respuesta:")
-                    print(respuesta)
-            return respuesta
-            
-        print(f"Error en la API: {response.status_code}")
-        print(response.text)
-        return None
-        
-    except Exception as e:
-        print(f"Error de conexión: {e}")
+    respuesta = cliente_ollama.chat(
+        messages,
+        OLLAMA_MODEL,
+        opciones={"temperature": temperature},
+        formato="json" if formato_json else None  # Intenta forzar respuesta en JSON
+    )
+    texto = cliente_ollama.contenido(respuesta)
+    if texto is None:
         return None
 
-def analizador_transacciones(lista_transacciones):
+    if formato_json:
+        json_data = extraer_json(texto)
+        if json_data:
+            return json_data
+        else:
+            print("No se pudo extraer JSON válido de la respuesta:")
+            print(texto)
+    return texto
+
+@metricas.etiquetado("analizador_transacciones", "fraude")
+def analizador_transacciones(lista_transacciones, ids_a_evaluar=None, historial=None):
     print("1. Analizando transacciones en busca de posibles fraudes")
     
-    prompt_sistema = """Eres un analista financiero experto en detección de fraudes. 
-    Analiza estas transacciones y marca como 'Posible Fraude' aquellas que presenten:
-    - Valores atípicamente altos
-    - Localizaciones inconsistentes
-    - Patrones temporales sospechosos
-    
-    Devuelve SOLO un JSON válido con este formato exacto, sin ningún otro texto alrededor:
-    {
-        "transacciones": [
-            {
-                "ID Transacción": "id",
-                "Tipo de Transacción": "Crédito/Débito",
-                "Establecimiento": "nombre",
-                "Horario": "aaaa-mm-dd hh:mm:ss",
-                "Producto": "nombre producto",
-                "Ciudad - Estado": "Ciudad - Departamento (País)",
-                "Valor (USD)": valor,
-                "Estado": "Aprobado/Posible Fraude"
-            }
-        ]
-    }
-    """
-    
     prompt_usuario = f"Transacciones a analizar (formato CSV):\n{lista_transacciones}"
+    if ids_a_evaluar:
+        prompt_usuario += (
+            f"\nEvalúa solo las transacciones con ID: {', '.join(ids_a_evaluar)}. "
+            "Las demás son historial de la misma cuenta y sirven de contexto."
+        )
+    if historial:
+        # Resumen de las transacciones anteriores de cada cuenta: ubicaciones y tiempos habituales
+        prompt_usuario += f"\nHistorial previo de las cuentas:\n{historial}"
     
-    messages = [
-        {"role": "system", "content": prompt_sistema},
-        {"role": "user", "content": prompt_usuario}
-    ]
-    
-    # Forzamos formato JSON en la llamada
-    respuesta = llamada_ollama(messages, temperature=0, formato_json=True)
+    # Forzamos formato JSON en la llamada; el prompt de sistema fijo se reutiliza entre llamadas
+    sesion = sesion_prompt.obtener(PROMPT_TRANSACCIONES, OLLAMA_MODEL, formato="json")
+    texto = cliente_ollama.contenido(sesion.chat(prompt_usuario, opciones={"temperature": 0}))
+    respuesta = extraer_json(texto)
+    if texto and not respuesta:
+        # Respuesta truncada: rescatamos las transacciones cuyo objeto llegó completo
+        rescatadas = list(json_incremental.iterar_objetos([texto], "transacciones"))
+        if rescatadas:
+            print(f"Respuesta incompleta: se rescataron {len(rescatadas)} transacción(es)")
+            respuesta = {"transacciones": rescatadas}
+        else:
+            print("No se pudo extraer JSON válido de la respuesta:")
+            print(texto)
     
     if respuesta:
         print("Análisis completado exitosamente")
@@ -121,17 +131,220 @@ def analizador_transacciones(lista_transacciones):
         print("No se pudo obtener un análisis válido")
         return None
 
-def main():
+def resumen_historial(filas, sospechosas):
+    """
+    Resumen del historial guardado de cada cuenta con transacciones sospechosas,
+    limitado a lo anterior al lote actual. None si ninguna cuenta tiene historial
+    """
+    historial = historial_transacciones.obtener_historial()
+    desde = min(str(fila[prefiltro_fraude.COLUMNA_HORARIO]) for fila in filas)
+    cuentas = sorted({prefiltro_fraude.cuenta_de(fila[prefiltro_fraude.COLUMNA_ID]) for fila in sospechosas})
+    lineas = [historial.texto_resumen(cuenta, antes_de=desde) for cuenta in cuentas]
+    return "\n".join(linea for linea in lineas if linea) or None
+
+def analizar_con_prefiltro(nombre_archivo, usar_historial=True):
+    """
+    Prefiltro vectorizado + LLM: solo las transacciones con señales de fraude
+    (y sus vecinas de la misma cuenta como contexto) se envían al modelo.
+    Las demás se aprueban automáticamente.
+    Con usar_historial, el prompt incluye el resumen del historial de cada cuenta
+    sospechosa y, si el análisis terminó bien, el lote se agrega después al historial.
+    """
+    filas = prefiltro_fraude.cargar_filas(nombre_archivo)
+    if not filas:
+        return None
+    resultado, completo = _analizar_filas_con_prefiltro(filas, usar_historial)
+    if usar_historial and completo:
+        historial_transacciones.obtener_historial().agregar(filas)
+    return resultado
+
+def _analizar_filas_con_prefiltro(filas, usar_historial):
+    """Devuelve (resultado, completo); completo es False si el modelo no respondió"""
+    senales, enviar = prefiltro_fraude.prefiltrar(filas)
+    sospechosas = senales["sospechosa"].nonzero()[0]
+    print(f"Prefiltro: {len(sospechosas)} sospechosa(s) de {len(filas)}, "
+          f"{int(enviar.sum())} fila(s) enviadas al modelo")
+
+    resultado = [dict(fila, Estado="Aprobado") for fila in filas]
+    if len(sospechosas) == 0:
+        return {"transacciones": resultado}, True
+
+    ids = [str(filas[i][prefiltro_fraude.COLUMNA_ID]) for i in sospechosas]
+    for i in sospechosas:
+        print(f"  {filas[i][prefiltro_fraude.COLUMNA_ID]}: {', '.join(prefiltro_fraude.motivos(senales, i))}")
+
+    contexto = prefiltro_fraude.a_csv([filas[i] for i in enviar.nonzero()[0]])
+    historial = resumen_historial(filas, [filas[i] for i in sospechosas]) if usar_historial else None
+    respuesta = analizador_transacciones(contexto, ids_a_evaluar=ids, historial=historial)
+
+    veredictos = {}
+    if isinstance(respuesta, dict):
+        for transaccion in respuesta.get("transacciones", []):
+            if isinstance(transaccion, dict):
+                veredictos[str(transaccion.get(prefiltro_fraude.COLUMNA_ID))] = transaccion.get("Estado")
+
+    for i, id_transaccion in zip(sospechosas, ids):
+        # Si el modelo no dio veredicto, la transacción marcada queda para revisión
+        estado = veredictos.get(id_transaccion)
+        resultado[i]["Estado"] = estado if estado in ESTADOS_VALIDOS else "Posible Fraude"
+
+    return {"transacciones": resultado}, isinstance(respuesta, dict)
+
+def ventanas(filas, tamano=TAMANO_VENTANA, solape=SOLAPE_VENTANA):
+    """
+    Agrupa un flujo de transacciones en ventanas de tamaño fijo.
+    Genera (contexto, nuevas): las últimas filas de la ventana anterior y las filas a evaluar.
+    """
+    contexto, nuevas = [], []
+    for fila in filas:
+        nuevas.append(fila)
+        if len(nuevas) == tamano:
+            yield contexto, nuevas
+            contexto = nuevas[-solape:] if solape else []
+            nuevas = []
+    if nuevas:
+        yield contexto, nuevas
+
+def validar_veredicto(objeto):
+    """
+    Comprueba un objeto contra el esquema de PROMPT_VEREDICTOS (ID y Estado válido).
+    Devuelve {ID, Estado} o None
+    """
+    if not isinstance(objeto, dict):
+        return None
+    id_transaccion = objeto.get(prefiltro_fraude.COLUMNA_ID)
+    estado = objeto.get("Estado")
+    if id_transaccion in (None, "") or estado not in ESTADOS_VALIDOS:
+        return None
+    return {prefiltro_fraude.COLUMNA_ID: str(id_transaccion), "Estado": estado}
+
+def iterar_veredictos(prompt_usuario, num_predict=None, final=None):
+    """
+    Pide los veredictos en streaming y genera cada uno en cuanto su objeto JSON se cierra,
+    sin esperar al final de la respuesta. Si el stream se corta, los ya generados se conservan.
+    Si se pasa final (dict), recibe el último fragmento de Ollama (done_reason, conteos)
+    """
+    opciones = {"temperature": 0}
+    if num_predict:
+        opciones["num_predict"] = num_predict
+    sesion = sesion_prompt.obtener(PROMPT_VEREDICTOS, OLLAMA_MODEL, formato="json")
+
+    def fragmentos():
+        for chunk in sesion.chat_stream(prompt_usuario, opciones):
+            if chunk.get("done") and final is not None:
+                final.update(chunk)
+            yield cliente_ollama.fragmento(chunk)
+
+    for objeto in json_incremental.iterar_objetos(fragmentos(), "transacciones"):
+        veredicto = validar_veredicto(objeto)
+        if veredicto:
+            yield veredicto
+        else:
+            print(f"Veredicto descartado (no cumple el esquema): {objeto}")
+
+@metricas.etiquetado("analizador_transacciones", "fraude_ventana")
+def analizar_ventana(contexto, nuevas, final=None):
+    """
+    Evalúa las transacciones nuevas de una ventana. Devuelve [{ID, Estado}] en orden.
+    final (dict opcional) recibe el último fragmento de la respuesta
+    """
+    ids = [str(fila[prefiltro_fraude.COLUMNA_ID]) for fila in nuevas]
+    prompt_usuario = f"Transacciones a analizar (formato CSV):\n{prefiltro_fraude.a_csv(contexto + nuevas)}"
+    if contexto:
+        prompt_usuario += (
+            f"\nEvalúa solo las transacciones con ID: {', '.join(ids)}. "
+            "Las demás son las transacciones anteriores y sirven de contexto."
+        )
+
+    veredictos = {}
+    num_predict = TOKENS_SALIDA_SOBRE + len(nuevas) * TOKENS_SALIDA_POR_VEREDICTO
+    for veredicto in iterar_veredictos(prompt_usuario, num_predict, final):
+        veredictos[veredicto[prefiltro_fraude.COLUMNA_ID]] = veredicto["Estado"]
+
+    return [
+        {prefiltro_fraude.COLUMNA_ID: id_transaccion, "Estado": veredictos.get(id_transaccion, "Sin veredicto")}
+        for id_transaccion in ids
+    ]
+
+def _analizar_item_ventana(item):
+    """
+    Ítem de la cola de trabajos. Solo una ventana sin respuesta completa ni veredictos (error de red
+    o del servidor) cuenta como fallo y se reintenta; una respuesta truncada o sin veredictos
+    se repetiría igual con temperatura 0, así que se guarda con "Sin veredicto" en lo que falte
+    """
+    final = {}
+    veredictos = analizar_ventana(item["contexto"], item["nuevas"], final)
+    if not final and all(v["Estado"] == "Sin veredicto" for v in veredictos):
+        return None
+    if final.get("done_reason") == "length":
+        print(f"Respuesta truncada por num_predict: {sum(v['Estado'] == 'Sin veredicto' for v in veredictos)} "
+              f"transacción(es) sin veredicto")
+    return veredictos
+
+def analizar_por_ventanas(nombre_archivo, archivo_salida, tamano=TAMANO_VENTANA,
+                          solape=SOLAPE_VENTANA, max_concurrencia=4):
+    """
+    Lee el archivo (CSV o JSON) por ventanas, las analiza en paralelo y escribe un
+    veredicto JSONL por transacción, en orden. Las ventanas pasan por la cola de trabajos:
+    cada una se guarda en cuanto termina y una ejecución interrumpida se retoma
+    desde la última ventana completada. La memoria no depende del tamaño del archivo.
+    Devuelve un resumen con los conteos por estado.
+    """
+    cola = cola_trabajos.obtener_cola()
+    trabajo = cola_trabajos.id_trabajo(
+        "ventanas", cola_trabajos.hash_archivo(nombre_archivo), tamano, solape, OLLAMA_MODEL, PROMPT_VEREDICTOS
+    )
+    items = (
+        (indice, {"contexto": contexto, "nuevas": nuevas})
+        for indice, (contexto, nuevas) in enumerate(
+            ventanas(prefiltro_fraude.iterar_filas(nombre_archivo), tamano, solape)
+        )
+    )
+    total = cola.agregar(trabajo, items)
+    pendientes = total - cola.estado(trabajo).get(cola_trabajos.HECHO, 0)
+    print(f"{total} ventana(s), {pendientes} pendiente(s)")
+
+    if pendientes:
+        gestor_modelos.asegurar_cargados([OLLAMA_MODEL])
+        cola.ejecutar(trabajo, _analizar_item_ventana, max_concurrencia)
+        print(sesion_prompt.obtener(PROMPT_VEREDICTOS, OLLAMA_MODEL, formato="json").resumen())
+
+    resumen = {}
+    with open(archivo_salida, "w", encoding="utf-8") as salida:
+        for _, item, veredictos in cola.resultados(trabajo):
+            if veredictos is None:
+                veredictos = [
+                    {prefiltro_fraude.COLUMNA_ID: str(fila[prefiltro_fraude.COLUMNA_ID]), "Estado": "Sin veredicto"}
+                    for fila in item["nuevas"]
+                ]
+            for veredicto in veredictos:
+                salida.write(json.dumps(veredicto, ensure_ascii=False) + "\n")
+                resumen[veredicto["Estado"]] = resumen.get(veredicto["Estado"], 0) + 1
+
+    return resumen
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detección de fraudes en transacciones")
+    parser.add_argument("archivo", nargs="?", default="datos/transacciones.csv", help="CSV o JSON de transacciones")
+    parser.add_argument("--ventanas", metavar="SALIDA_JSONL", help="Analiza por ventanas y escribe veredictos JSONL")
+    parser.add_argument("--tamano", type=int, default=TAMANO_VENTANA, help="Transacciones por ventana")
+    parser.add_argument("--solape", type=int, default=SOLAPE_VENTANA, help="Transacciones de contexto entre ventanas")
+    parser.add_argument("--concurrencia", type=int, default=4, help="Ventanas analizadas en paralelo")
+    parser.add_argument("--sin-historial", action="store_true", help="No consulta ni actualiza el historial de cuentas")
+    args = parser.parse_args(argv)
+    metricas.iniciar_si_configurado()
+
     print("=== Sistema de Detección de Fraudes con Ollama ===")
-    
-    # Cargar transacciones
-    transacciones = carga("datos/transacciones.csv")
-    if not transacciones:
-        print("No se pudieron cargar las transacciones")
+
+    if args.ventanas:
+        resumen = analizar_por_ventanas(args.archivo, args.ventanas, args.tamano, args.solape, args.concurrencia)
+        print(f"\nVeredictos escritos en {args.ventanas}")
+        for estado, cantidad in resumen.items():
+            print(f"  {estado}: {cantidad}")
         return
     
-    # Analizar transacciones
-    resultado = analizador_transacciones(transacciones)
+    # Prefiltrar y analizar transacciones
+    resultado = analizar_con_prefiltro(args.archivo, usar_historial=not args.sin_historial)
     
     if resultado:
         print("\nResultado del análisis:")
@@ -0,0 +1,237 @@
+import io
+import os
+import sys
+import csv
+import json
+import time
+import socket
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import subprocess
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+ESCENARIOS = ["clasificacion", "sentimientos", "transacciones", "perfiles"]
+CATEGORIAS = "Ropa Sostenible, Electrónicos Verdes, Cosmética Natural, Hogar Ecológico"
+
+def percentil(valores, p):
+    """Percentil p (0-100) por el método del rango más cercano"""
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def iniciar_servidor(tokens_por_s, latencia_red):
+    """
+    Arranca servidor_simulado.py en un proceso aparte, para que su CPU no
+    se mezcle con la del cliente medido. Devuelve (proceso, url)
+    """
+    puerto = _puerto_libre()
+    proceso = subprocess.Popen([
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "servidor_simulado.py"),
+        "--puerto", str(puerto),
+        "--tokens-por-s", str(tokens_por_s),
+        "--latencia-red", str(latencia_red),
+    ], stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{puerto}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/api/tags", timeout=0.5)
+            return proceso, url
+        except requests.exceptions.RequestException:
+            time.sleep(0.05)
+    proceso.terminate()
+    raise RuntimeError("El servidor simulado no arrancó")
+
+# Cada escenario prepara sus datos y devuelve la lista de tareas a ejecutar
+
+def _tareas_clasificacion(tamano, concurrencia, directorio):
+    import clasificador
+    productos = [f"Producto ecológico {i}" for i in range(tamano)]
+    return [lambda p=p: clasificador.clasifica_productos(p, CATEGORIAS) for p in productos]
+
+def _tareas_sentimientos(tamano, concurrencia, directorio):
+    import analizador_sentimientos
+    with open("datos/evaluaciones_maquillaje.txt", "r", encoding="utf-8") as archivo:
+        resenas = archivo.read()
+    productos = []
+    for i in range(tamano):
+        producto = f"evaluaciones_bench_{i}"
+        with open(os.path.join(directorio, f"{producto}.txt"), "w", encoding="utf-8") as archivo:
+            archivo.write(resenas)
+        productos.append(producto)
+    return [
+        lambda p=p: analizador_sentimientos.analizador_sentimientos(p, directorio, mostrar=False)
+        for p in productos
+    ]
+
+def _tareas_transacciones(tamano, concurrencia, directorio):
+    import analizador_transacciones
+    import prefiltro_fraude
+    filas = prefiltro_fraude.cargar_filas("datos/transacciones.csv")
+    lotes = []
+    for i in range(tamano):
+        lote = [dict(fila, **{prefiltro_fraude.COLUMNA_ID: f"{i}{j}c"}) for j, fila in enumerate(filas)]
+        lotes.append(prefiltro_fraude.a_csv(lote))
+    return [lambda l=l: analizador_transacciones.analizador_transacciones(l) for l in lotes]
+
+def _tareas_perfiles(tamano, concurrencia, directorio):
+    import seleccion_modelo
+    import cola_trabajos
+    # Cola propia de la corrida: un trabajo ya hecho en otra corrida no debe reanudarse
+    cola = cola_trabajos.ColaTrabajos(os.path.join(directorio, "trabajos.sqlite"))
+    productos = [fila.split(",", 1)[1] for _, fila in seleccion_modelo.leer_clientes("datos/lista-compra-300-clientes.csv")]
+    ruta = os.path.join(directorio, "clientes.csv")
+    with open(ruta, "w", encoding="utf-8", newline="") as archivo:
+        writer = csv.writer(archivo)
+        for i in range(tamano):
+            writer.writerow([f"cliente{i}", random.choice(productos).strip('"')])
+    # Una sola tarea: perfilar_clientes reparte los bloques con su propia concurrencia
+    return [lambda: seleccion_modelo.perfilar_clientes(ruta, max_concurrencia=concurrencia, cola=cola) or None]
+
+TAREAS = {
+    "clasificacion": _tareas_clasificacion,
+    "sentimientos": _tareas_sentimientos,
+    "transacciones": _tareas_transacciones,
+    "perfiles": _tareas_perfiles,
+}
+
+def ejecutar_escenario(escenario, tamano, concurrencia):
+    """
+    Ejecuta un escenario y devuelve latencias, throughput y costo de CPU/memoria del cliente
+    """
+    directorio = tempfile.mkdtemp(prefix="bench_")
+    try:
+        tareas = TAREAS[escenario](tamano, concurrencia, directorio)
+        latencias, errores = [], 0
+
+        def medir(tarea):
+            inicio = time.perf_counter()
+            resultado = tarea()
+            return time.perf_counter() - inicio, resultado
+
+        tracemalloc.start()
+        cpu_inicio, inicio = time.process_time(), time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            hilos = 1 if escenario == "perfiles" else concurrencia
+            with ThreadPoolExecutor(max_workers=hilos) as executor:
+                for latencia, resultado in executor.map(medir, tareas):
+                    latencias.append(latencia)
+                    errores += resultado is None
+        total = time.perf_counter() - inicio
+        cpu = time.process_time() - cpu_inicio
+        _, memoria_pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    return {
+        "escenario": escenario,
+        "tamano": tamano,
+        "concurrencia": concurrencia,
+        "operaciones": len(latencias),
+        "errores": errores,
+        "p50_s": percentil(latencias, 50),
+        "p95_s": percentil(latencias, 95),
+        "p99_s": percentil(latencias, 99),
+        "items_por_s": tamano / total if total else 0.0,
+        "cpu_cliente_s": cpu,
+        "cpu_por_item_ms": cpu / tamano * 1000 if tamano else 0.0,
+        "memoria_pico_kb": memoria_pico / 1024,
+    }
+
+def mostrar_tabla(resultados):
+    print(f"{'escenario':<14}{'tamaño':>7}{'conc':>5}{'p50':>8}{'p95':>8}{'p99':>8}"
+          f"{'items/s':>9}{'cpu ms/it':>10}{'mem KB':>9}{'err':>5}")
+    for r in resultados:
+        print(f"{r['escenario']:<14}{r['tamano']:>7}{r['concurrencia']:>5}"
+              f"{r['p50_s']:>8.3f}{r['p95_s']:>8.3f}{r['p99_s']:>8.3f}"
+              f"{r['items_por_s']:>9.1f}{r['cpu_por_item_ms']:>10.2f}{r['memoria_pico_kb']:>9.0f}{r['errores']:>5}")
+
+def comparar(resultados, base, tolerancia):
+    """
+    Compara contra una ejecución previa. Devuelve la lista de regresiones detectadas
+    """
+    previos = {(r["escenario"], r["tamano"], r["concurrencia"]): r for r in base}
+    regresiones = []
+    for r in resultados:
+        previo = previos.get((r["escenario"], r["tamano"], r["concurrencia"]))
+        if not previo:
+            continue
+        nombre = f"{r['escenario']} tamaño={r['tamano']} conc={r['concurrencia']}"
+        if previo["p95_s"] and r["p95_s"] > previo["p95_s"] * (1 + tolerancia):
+            regresiones.append(f"{nombre}: p95 {previo['p95_s']:.3f}s -> {r['p95_s']:.3f}s")
+        if r["items_por_s"] < previo["items_por_s"] * (1 - tolerancia):
+            regresiones.append(f"{nombre}: items/s {previo['items_por_s']:.1f} -> {r['items_por_s']:.1f}")
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los analizadores contra un Ollama simulado")
+    parser.add_argument("--escenarios", nargs="+", default=ESCENARIOS, choices=ESCENARIOS)
+    parser.add_argument("--tamanos", nargs="+", type=int, default=[20, 100])
+    parser.add_argument("--concurrencias", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--tokens-por-s", type=float, default=200.0, help="Velocidad de generación simulada")
+    parser.add_argument("--latencia-red", type=float, default=0.002)
+    parser.add_argument("--url", help="Usar un servidor existente en lugar del simulado")
+    parser.add_argument("--nodos", type=int, default=1, help="Servidores simulados entre los que repartir la carga")
+    parser.add_argument("--con-cache", action="store_true", help="No desactivar el cache de respuestas")
+    parser.add_argument("--guardar", help="Escribe los resultados en este JSON")
+    parser.add_argument("--base", help="JSON de una ejecución previa para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.15)
+    args = parser.parse_args()
+
+    procesos, urls = [], [args.url] if args.url else []
+    if not urls:
+        for _ in range(args.nodos):
+            proceso, url = iniciar_servidor(args.tokens_por_s, args.latencia_red)
+            procesos.append(proceso)
+            urls.append(url)
+    url = ", ".join(urls)
+
+    import cliente_ollama
+    import cache_respuestas
+    cliente_ollama.OLLAMA_BASE_URL = urls[0]
+    cliente_ollama.OLLAMA_BASE_URLS = urls
+    cliente_ollama.configurar(pool_size=max(args.concurrencias))
+    if not args.con_cache:
+        cache_respuestas.OLLAMA_CACHE = False
+
+    print(f"=== Benchmark contra {url} ===")
+    resultados = []
+    try:
+        for escenario in args.escenarios:
+            for tamano in args.tamanos:
+                for concurrencia in args.concurrencias:
+                    resultados.append(ejecutar_escenario(escenario, tamano, concurrencia))
+    finally:
+        for proceso in procesos:
+            proceso.terminate()
+
+    mostrar_tabla(resultados)
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as archivo:
+            json.dump(resultados, archivo, indent=2)
+
+    if args.base:
+        with open(args.base, "r", encoding="utf-8") as archivo:
+            regresiones = comparar(resultados, json.load(archivo), args.tolerancia)
+        if regresiones:
+            print("\nRegresiones detectadas:")
+            for regresion in regresiones:
+                print(f"  {regresion}")
+            sys.exit(1)
+        print("\nSin regresiones respecto a la base")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+import configuracion
+
+OLLAMA_CACHE = configuracion.obtener("OLLAMA_CACHE", "1") != "0"
+OLLAMA_CACHE_RUTA = configuracion.obtener("OLLAMA_CACHE_RUTA", ".cache_ollama/respuestas.sqlite")
+OLLAMA_CACHE_MAX_MB = float(configuracion.obtener("OLLAMA_CACHE_MAX_MB", "256"))
+OLLAMA_CACHE_TTL = float(configuracion.obtener("OLLAMA_CACHE_TTL", "0"))  # segundos, 0 = sin expiración
+
+def es_determinista(payload):
+    """
+    Solo se cachean peticiones sin streaming y con temperatura 0, o embeddings
+    """
+    if payload.get("stream"):
+        return False
+    if "input" in payload:
+        return True  # /api/embed no muestrea: siempre es determinista
+    opciones = payload.get("options") or {}
+    return opciones.get("temperature") == 0
+
+def clave(endpoint, payload):
+    """
+    Hash del contenido de la petición: endpoint, modelo, mensajes/prompt, opciones y formato
+    """
+    contenido = {
+        "endpoint": endpoint,
+        "model": payload.get("model"),
+        "messages": payload.get("messages"),
+        "prompt": payload.get("prompt"),
+        "input": payload.get("input"),
+        "options": payload.get("options"),
+        "format": payload.get("format"),
+    }
+    serializado = json.dumps(contenido, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(serializado.encode("utf-8")).hexdigest()
+
+class CacheRespuestas:
+    """
+    Cache en disco (SQLite) de respuestas de Ollama con expulsión LRU por tamaño y TTL
+    """
+
+    def __init__(self, ruta=OLLAMA_CACHE_RUTA, max_mb=OLLAMA_CACHE_MAX_MB, ttl=OLLAMA_CACHE_TTL):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.ruta = ruta
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("""
+            CREATE TABLE IF NOT EXISTS respuestas (
+                clave TEXT PRIMARY KEY,
+                respuesta TEXT NOT NULL,
+                tamano INTEGER NOT NULL,
+                creado REAL NOT NULL,
+                ultimo_acceso REAL NOT NULL
+            )
+        """)
+        self._conexion.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ultimo_acceso ON respuestas (ultimo_acceso)"
+        )
+        # Aciertos/fallos acumulados entre procesos, para poder consultarlos desde la CLI
+        self._conexion.execute("""
+            CREATE TABLE IF NOT EXISTS contadores (
+                nombre TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL
+            )
+        """)
+        self._conexion.commit()
+        fila = self._conexion.execute("SELECT COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()
+        self._bytes = fila[0]
+        self.aciertos = 0
+        self.fallos = 0
+        self.escrituras = 0
+        self.expulsiones = 0
+        self.expirados = 0
+
+    def obtener(self, clave):
+        """Devuelve la respuesta cacheada o None"""
+        ahora = time.time()
+        with self._lock:
+            fila = self._conexion.execute(
+                "SELECT respuesta, tamano, creado FROM respuestas WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is None:
+                self.fallos += 1
+                self._acumular("fallos")
+                self._conexion.commit()
+                return None
+
+            respuesta, tamano, creado = fila
+            if self.ttl and ahora - creado > self.ttl:
+                self._conexion.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+                self._conexion.commit()
+                self._bytes -= tamano
+                self.expirados += 1
+                self.fallos += 1
+                self._acumular("fallos")
+                self._conexion.commit()
+                return None
+
+            self._conexion.execute(
+                "UPDATE respuestas SET ultimo_acceso = ? WHERE clave = ?", (ahora, clave)
+            )
+            self.aciertos += 1
+            self._acumular("aciertos")
+            self._conexion.commit()
+        return json.loads(respuesta)
+
+    def guardar(self, clave, respuesta):
+        """Guarda una respuesta y expulsa las menos usadas si se supera el tamaño máximo"""
+        serializado = json.dumps(respuesta, ensure_ascii=False)
+        tamano = len(serializado.encode("utf-8"))
+        if tamano > self.max_bytes:
+            return
+
+        ahora = time.time()
+        with self._lock:
+            previo = self._conexion.execute(
+                "SELECT tamano FROM respuestas WHERE clave = ?", (clave,)
+            ).fetchone()
+            if previo:
+                self._bytes -= previo[0]
+            self._conexion.execute(
+                "INSERT OR REPLACE INTO respuestas VALUES (?, ?, ?, ?, ?)",
+                (clave, serializado, tamano, ahora, ahora)
+            )
+            self._bytes += tamano
+            self.escrituras += 1
+            self._expulsar()
+            self._conexion.commit()
+
+    def _acumular(self, nombre):
+        self._conexion.execute(
+            "INSERT INTO contadores VALUES (?, 1) ON CONFLICT(nombre) DO UPDATE SET valor = valor + 1",
+            (nombre,)
+        )
+
+    def _expulsar(self):
+        # LRU: se eliminan las entradas con acceso más antiguo hasta volver al límite
+        while self._bytes > self.max_bytes:
+            fila = self._conexion.execute(
+                "SELECT clave, tamano FROM respuestas ORDER BY ultimo_acceso LIMIT 1"
+            ).fetchone()
+            if fila is None:
+                self._bytes = 0
+                break
+            self._conexion.execute("DELETE FROM respuestas WHERE clave = ?", (fila[0],))
+            self._bytes -= fila[1]
+            self.expulsiones += 1
+
+    def limpiar(self):
+        """Elimina todas las entradas"""
+        with self._lock:
+            self._conexion.execute("DELETE FROM respuestas")
+            self._conexion.execute("DELETE FROM contadores")
+            self._conexion.commit()
+            self._bytes = 0
+
+    def estadisticas(self):
+        """Aciertos/fallos de este proceso y acumulados, y ocupación del cache"""
+        with self._lock:
+            entradas = self._conexion.execute("SELECT COUNT(*) FROM respuestas").fetchone()[0]
+            acumulados = dict(self._conexion.execute("SELECT nombre, valor FROM contadores"))
+        consultas = self.aciertos + self.fallos
+        aciertos_totales = acumulados.get("aciertos", 0)
+        consultas_totales = aciertos_totales + acumulados.get("fallos", 0)
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            "escrituras": self.escrituras,
+            "expulsiones": self.expulsiones,
+            "expirados": self.expirados,
+            "entradas": entradas,
+            "bytes": self._bytes,
+            "aciertos_totales": aciertos_totales,
+            "fallos_totales": acumulados.get("fallos", 0),
+            "tasa_aciertos_total": aciertos_totales / consultas_totales if consultas_totales else 0.0,
+        }
+
+_cache = None
+_lock_cache = threading.Lock()
+
+def obtener_cache():
+    """
+    Cache compartido del proceso, o None si está desactivado con OLLAMA_CACHE=0
+    """
+    global _cache
+    if not OLLAMA_CACHE:
+        return None
+    if _cache is None:
+        with _lock_cache:
+            if _cache is None:
+                _cache = CacheRespuestas()
+    return _cache
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache de respuestas de Ollama")
+    parser.add_argument("--limpiar", action="store_true", help="Elimina todas las entradas")
+    args = parser.parse_args()
+
+    cache = CacheRespuestas()
+    if args.limpiar:
+        cache.limpiar()
+        print("Cache vaciado")
+    estadisticas = cache.estadisticas()
+    print(f"Ruta: {cache.ruta}")
+    print(f"Entradas: {estadisticas['entradas']}")
+    print(f"Tamaño: {estadisticas['bytes'] / 1024:.1f} KB")
+    print(f"Aciertos: {estadisticas['aciertos_totales']}")
+    print(f"Fallos: {estadisticas['fallos_totales']}")
+    print(f"Tasa de aciertos: {estadisticas['tasa_aciertos_total']:.1%}")
@@ -1,47 +1,40 @@
-import os
-import requests
-from dotenv import load_dotenv
+import sys
+import json
+import argparse
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import configuracion
+import cliente_ollama
+import contador_tokens
+import gestor_modelos
+import sesion_prompt
+import enrutador_modelos
+import metricas
 
-load_dotenv()
+OLLAMA_MODEL = configuracion.obtener("OLLAMA_MODEL")
 
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
+TAMANO_LOTE_MAX = 50  # Más productos por petición degradan la fiabilidad de la salida
+TOKENS_SALIDA_POR_PRODUCTO = 12  # {"id": n, "categoria": "..."} sin la categoría
+TOKENS_SALIDA_SOBRE = 16  # {"clasificaciones": [...]} y el cierre de la respuesta, una vez por petición
 
 def generate_completion(messages, temperatura=1, max_tokens=200):
     """
     Genera una respuesta utilizando Ollama API
     """
-    url = f"{OLLAMA_BASE_URL}/api/chat"
-    
-    payload = {
-        "model": OLLAMA_MODEL,
-        "messages": messages,
-        "options": {
-            "temperature": temperatura,
-            "num_predict": max_tokens
-        },
-        "stream": False  # Asegurarnos de que no sea streaming
+    opciones = {
+        "temperature": temperatura,
+        "num_predict": max_tokens
     }
-    
-    response = requests.post(url, json=payload)
-    print("Respuesta cruda del servidor:", response.text)  # Imprimir la respuesta cruda
-    
-    if response.status_code == 200:
-        try:
-            return response.json()
-        except requests.exceptions.JSONDecodeError as e:
-            print("Error al decodificar JSON:", e)
-            return None
-    else:
-        print(f"Error: {response.status_code}")
-        print(response.text)
-        return None
+    return cliente_ollama.chat(messages, OLLAMA_MODEL, opciones=opciones)
 
-def clasifica_productos(nombre_producto, lista_categorias):
-    """
-    Clasifica un producto en una de las categorías especificadas
-    """
-    prompt_sistema = f"""    
+@lru_cache(maxsize=32)
+def _parsear_categorias(lista_categorias):
+    """Categorías válidas de la lista separada por comas"""
+    return tuple(categoria.strip() for categoria in lista_categorias.split(",") if categoria.strip())
+
+@lru_cache(maxsize=32)
+def _prompt_sistema(lista_categorias):
+    return f"""    
     Eres un categorizador de productos.
     Debes asumir las categorías presentes en la lista a continuación.
     # Lista de Categorías Válidas
@@ -53,29 +46,202 @@ def clasifica_productos(nombre_producto, lista_categorias):
         Producto: Cepillo de dientes con carga solar
         Categoría: Electrónicos Verdes
     """
-    
-    messages = [
-        {
-            "role": "system",
-            "content": prompt_sistema
-        },
-        {
-            "role": "user",
-            "content": nombre_producto
-        }
-    ]
-    
-    respuesta = generate_completion(messages, temperatura=1, max_tokens=200)
+
+@lru_cache(maxsize=32)
+def _prompt_sistema_lote(lista_categorias):
+    categorias = json.dumps(list(_parsear_categorias(lista_categorias)), ensure_ascii=False)
+    return f"""Eres un categorizador de productos.
+    Asigna a cada producto numerado exactamente una categoría de la lista a continuación.
+    # Lista de Categorías Válidas
+    {categorias}
+    # Formato de Salida
+    Devuelve SOLO un JSON válido con este formato exacto, sin ningún otro texto alrededor:
+    {{"clasificaciones": [{{"id": 1, "categoria": "una categoría de la lista"}}]}}
+    """
+
+@metricas.etiquetado("clasificador", "clasificar")
+def clasifica_productos(nombre_producto, lista_categorias):
+    """
+    Clasifica un producto en una de las categorías especificadas
+    """
+    # El prompt de sistema se repite idéntico en cada llamada: el servidor reutiliza su evaluación
+    sesion = sesion_prompt.obtener(_prompt_sistema(lista_categorias), OLLAMA_MODEL)
+
+    # Temperatura 0: la clasificación es determinista y se puede servir desde cache
+    respuesta = sesion.chat(nombre_producto, opciones={"temperature": 0, "num_predict": 200})
     
     if respuesta and "message" in respuesta:
         return respuesta["message"]["content"]
     else:
         return "Error al clasificar el producto."
 
+def _validar_categoria(categoria, lista_categorias):
+    """Devuelve la categoría canónica de la lista, o None si no pertenece a ella"""
+    if not isinstance(categoria, str):
+        return None
+    validas = {valida.lower(): valida for valida in _parsear_categorias(lista_categorias)}
+    return validas.get(categoria.strip().lower())
+
+@lru_cache(maxsize=32)
+def _tokens_salida_producto(lista_categorias):
+    """Tokens de salida por producto: su entrada en la lista JSON con la categoría más larga"""
+    categorias = _parsear_categorias(lista_categorias)
+    tokens_categoria = max(
+        (contador_tokens.estimar_tokens(categoria, OLLAMA_MODEL) for categoria in categorias),
+        default=0
+    )
+    return TOKENS_SALIDA_POR_PRODUCTO + tokens_categoria
+
+def _tokens_salida(cantidad, lista_categorias):
+    """num_predict para un lote de cantidad productos: el mismo cálculo con que se dimensionan los lotes"""
+    return TOKENS_SALIDA_SOBRE + cantidad * _tokens_salida_producto(lista_categorias)
+
+def dividir_en_lotes(productos, lista_categorias, contexto=None):
+    """
+    Agrupa productos en lotes cuya entrada y salida esperada caben en el presupuesto de tokens
+    """
+    if contexto is None:
+        contexto = enrutador_modelos.contexto_modelo(OLLAMA_MODEL)
+    disponible = contexto - contador_tokens.estimar_tokens(_prompt_sistema_lote(lista_categorias), OLLAMA_MODEL)
+    disponible -= _tokens_salida(0, lista_categorias)
+    salida_producto = _tokens_salida_producto(lista_categorias)
+    tokens_productos = contador_tokens.contar_tokens_lote(productos, OLLAMA_MODEL)
+
+    lote, tokens_lote = [], 0
+    for producto, tokens in zip(productos, tokens_productos):
+        tokens_producto = tokens + salida_producto
+        if lote and (tokens_lote + tokens_producto > disponible or len(lote) >= TAMANO_LOTE_MAX):
+            yield lote
+            lote, tokens_lote = [], 0
+        lote.append(producto)
+        tokens_lote += tokens_producto
+
+    if lote:
+        yield lote
+
+@metricas.etiquetado("clasificador", "clasificar_lote")
+def _clasificar_lote(lote, lista_categorias, contexto):
+    prompt_usuario = "\n".join(f"{i}. {producto}" for i, producto in enumerate(lote, start=1))
+    sesion = sesion_prompt.obtener(
+        _prompt_sistema_lote(lista_categorias), OLLAMA_MODEL, opciones={"num_ctx": contexto}, formato="json"
+    )
+    opciones = {
+        "temperature": 0,
+        "num_predict": _tokens_salida(len(lote), lista_categorias),
+    }
+    respuesta = sesion.chat(prompt_usuario, opciones=opciones)
+    datos = cliente_ollama.extraer_json(cliente_ollama.contenido(respuesta)) or {}
+
+    resultado = {}
+    for item in datos.get("clasificaciones", []):
+        if not isinstance(item, dict):
+            continue
+        try:
+            indice = int(item.get("id")) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= indice < len(lote):
+            categoria = _validar_categoria(item.get("categoria"), lista_categorias)
+            if categoria:
+                resultado[lote[indice]] = categoria
+    return resultado
+
+def clasifica_productos_lote(productos, lista_categorias, contexto=None, max_concurrencia=4):
+    """
+    Clasifica muchos productos empaquetando varios por petición.
+    Devuelve {producto: categoría}; la categoría es None si el modelo no dio una válida.
+    """
+    # Deduplicamos manteniendo el orden: cada nombre se envía una sola vez
+    unicos = list(dict.fromkeys(producto.strip() for producto in productos if producto.strip()))
+    # Contexto real del modelo (/api/show); el mismo num_ctx en todas las peticiones evita recargas
+    contexto = contexto or enrutador_modelos.contexto_modelo(OLLAMA_MODEL)
+    lotes = list(dividir_en_lotes(unicos, lista_categorias, contexto))
+
+    if lotes:
+        gestor_modelos.asegurar_cargados([OLLAMA_MODEL])
+    clasificados = {}
+    with ThreadPoolExecutor(max_workers=max_concurrencia) as executor:
+        for resultado in executor.map(lambda lote: _clasificar_lote(lote, lista_categorias, contexto), lotes):
+            clasificados.update(resultado)
+
+    # Los productos sin categoría válida se reintentan una vez, en un lote aparte
+    faltantes = [producto for producto in unicos if producto not in clasificados]
+    for lote in dividir_en_lotes(faltantes, lista_categorias, contexto):
+        clasificados.update(_clasificar_lote(lote, lista_categorias, contexto))
+
+    return {producto: clasificados.get(producto.strip()) for producto in productos}
+
+@lru_cache(maxsize=8)
+def obtener_indice(lista_categorias):
+    """Índice de embeddings de las categorías (se construye una vez por lista)"""
+    import indice_categorias
+    return indice_categorias.IndiceCategorias(_parsear_categorias(lista_categorias))
+
+def clasifica_productos_rapido(productos, lista_categorias, contexto=None):
+    """
+    Clasifica por similitud de embeddings y recurre al LLM solo para los productos
+    cuya categoría más cercana no supera el margen de confianza.
+    Devuelve {producto: categoría}.
+    """
+    import indice_categorias
+    gestor_modelos.asegurar_cargados([indice_categorias.OLLAMA_EMBED_MODEL], embeddings=True)
+    try:
+        indice = obtener_indice(lista_categorias)
+    except RuntimeError as e:
+        print(f"Índice de embeddings no disponible, se usa el LLM: {e}")
+        return clasifica_productos_lote(productos, lista_categorias, contexto)
+
+    unicos = list(dict.fromkeys(producto.strip() for producto in productos if producto.strip()))
+    clasificados = {}
+    dudosos = []
+    for producto, (categoria, _) in zip(unicos, indice.buscar(unicos)):
+        if categoria:
+            clasificados[producto] = categoria
+        else:
+            dudosos.append(producto)
+
+    if dudosos:
+        clasificados.update(clasifica_productos_lote(dudosos, lista_categorias, contexto))
+
+    return {producto: clasificados.get(producto.strip()) for producto in productos}
+
 # Ejecución principal
-if __name__ == "__main__":
-    categorias = input("Liste las categorias separadas por una coma: ")
-    
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clasificación de productos en categorías")
+    parser.add_argument("productos", nargs="*", help="Productos a clasificar (sin productos: modo interactivo)")
+    parser.add_argument("--categorias", help="Categorías separadas por comas")
+    parser.add_argument("--archivo", help="Archivo con un producto por línea")
+    parser.add_argument("--modo", choices=["lote", "rapido"], default="lote",
+                        help="lote: varios productos por petición; rapido: embeddings y LLM solo para los dudosos")
+    args = parser.parse_args(argv)
+    metricas.iniciar_si_configurado()
+
+    productos = list(args.productos)
+    if args.archivo:
+        try:
+            with open(args.archivo, "r", encoding="utf-8") as archivo:
+                productos += [linea.strip() for linea in archivo if linea.strip()]
+        except IOError as e:
+            print(f"Error al leer archivo: {e}")
+            return None
+
+    categorias = args.categorias or input("Liste las categorias separadas por una coma: ")
+    if not productos:
+        return interactivo(categorias)
+
+    clasificar = clasifica_productos_rapido if args.modo == "rapido" else clasifica_productos_lote
+    resultado = clasificar(productos, categorias)
+    for producto in productos:
+        print(f"{producto}: {resultado.get(producto) or '(sin categoría)'}")
+    return resultado
+
+def interactivo(categorias):
+    if not sys.stdin.isatty():
+        print("No hay productos para clasificar")
+        return None
+
+    # Entre un producto y el siguiente puede pasar un rato: el modelo se conserva más tiempo
+    gestor_modelos.asegurar_cargados([OLLAMA_MODEL], "interactivo")
     while True:
         producto = input("Ingrese el nombre del producto a clasificar (o 'salir' para terminar): ")
         
@@ -84,4 +250,7 @@ if __name__ == "__main__":
             
         texto_resultado = clasifica_productos(producto, categorias)
         print(texto_resultado)
-        print("-" * 50)
\ No newline at end of file
+        print("-" * 50)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
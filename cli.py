@@ -0,0 +1,38 @@
+import sys
+import argparse
+import importlib
+
+# subcomando -> (módulo, descripción). Cada módulo se importa solo cuando se usa su subcomando,
+# así un trabajo corto no paga el arranque de los demás
+SUBCOMANDOS = {
+    "clasificar": ("clasificador", "Clasifica productos en categorías"),
+    "sentimientos": ("analizador_sentimientos", "Analiza las reseñas de los productos"),
+    "fraude": ("analizador_transacciones", "Detecta posibles fraudes en transacciones"),
+    "perfiles": ("seleccion_modelo", "Perfila clientes según sus compras"),
+    "contar-tokens": ("contador_tokens", "Cuenta los tokens de un texto"),
+}
+
+def main(argv=None):
+    """
+    Punto de entrada único: python -m cli <subcomando> [opciones del subcomando]
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Analítica de e-commerce con Ollama")
+    subcomandos = parser.add_subparsers(dest="subcomando", metavar="subcomando")
+    for nombre, (_, descripcion) in SUBCOMANDOS.items():
+        subcomandos.add_parser(nombre, help=descripcion, add_help=False)
+
+    if not argv or argv[0] not in SUBCOMANDOS:
+        parser.parse_args(argv[:1])  # muestra la ayuda o el error de argparse
+        parser.print_help()
+        return 2
+
+    # Las opciones de cada subcomando las define su propio módulo
+    nombre_modulo, _ = SUBCOMANDOS[argv[0]]
+    modulo = importlib.import_module(nombre_modulo)
+    sys.argv[0] = f"python -m cli {argv[0]}"
+    modulo.main(argv[1:])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,448 @@
+import copy
+import json
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import configuracion
+import cache_respuestas
+import metricas
+import nodos_ollama
+import limitador_concurrencia
+import vuelo_unico
+
+OLLAMA_BASE_URL = configuracion.obtener("OLLAMA_BASE_URL", "http://localhost:11434")
+# Varios nodos separados por comas; si se define, tiene prioridad sobre OLLAMA_BASE_URL
+OLLAMA_BASE_URLS = [url.strip() for url in configuracion.obtener("OLLAMA_BASE_URLS", "").split(",") if url.strip()]
+OLLAMA_POOL_SIZE = int(configuracion.obtener("OLLAMA_POOL_SIZE", "10"))
+OLLAMA_TIMEOUT = float(configuracion.obtener("OLLAMA_TIMEOUT", "120"))
+OLLAMA_REINTENTOS = int(configuracion.obtener("OLLAMA_REINTENTOS", "2"))
+OLLAMA_BACKOFF = float(configuracion.obtener("OLLAMA_BACKOFF", "0.5"))
+
+# Códigos HTTP que indican un fallo transitorio del servidor
+CODIGOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+_sesion = None
+_lock_sesion = threading.Lock()
+_keep_alive = {}  # modelo -> keep_alive que se envía con cada petición (ver gestor_modelos)
+_limitador = None
+_lock_limitador = threading.Lock()
+
+def configurar(pool_size=None):
+    """
+    Reconstruye la sesión compartida con un nuevo tamaño de pool
+    """
+    global _sesion, OLLAMA_POOL_SIZE
+    with _lock_sesion:
+        if pool_size is not None:
+            OLLAMA_POOL_SIZE = pool_size
+        if _sesion is not None:
+            _sesion.close()
+        _sesion = None
+
+def obtener_sesion():
+    """
+    Devuelve la sesión HTTP compartida (conexiones keep-alive reutilizables)
+    """
+    global _sesion
+    if _sesion is None:
+        with _lock_sesion:
+            if _sesion is None:
+                sesion = requests.Session()
+                adaptador = HTTPAdapter(
+                    pool_connections=OLLAMA_POOL_SIZE,
+                    pool_maxsize=OLLAMA_POOL_SIZE,
+                    pool_block=True
+                )
+                sesion.mount("http://", adaptador)
+                sesion.mount("https://", adaptador)
+                _sesion = sesion
+    return _sesion
+
+def nodos():
+    """Urls de los nodos Ollama configurados"""
+    return OLLAMA_BASE_URLS or [OLLAMA_BASE_URL]
+
+def balanceador():
+    """Balanceador de los nodos configurados (con un solo nodo, siempre elige ese)"""
+    return nodos_ollama.obtener_balanceador(nodos())
+
+def limitador():
+    """
+    Limitador adaptativo compartido de peticiones en vuelo, o None si está desactivado.
+    Su máximo sigue a las conexiones disponibles: el pool por nodo por la cantidad de nodos
+    """
+    global _limitador
+    if not limitador_concurrencia.OLLAMA_CONCURRENCIA_ADAPTATIVA:
+        return None
+    if _limitador is None:
+        with _lock_limitador:
+            if _limitador is None:
+                _limitador = limitador_concurrencia.LimitadorAdaptativo()
+                metricas.indicador("concurrencia", _limitador.estado)
+    _limitador.maximo = min(limitador_concurrencia.OLLAMA_CONCURRENCIA_MAX, OLLAMA_POOL_SIZE * len(nodos()))
+    return _limitador
+
+def definir_keep_alive(modelo, valor):
+    """
+    Fija cuánto tiempo mantiene Ollama el modelo en memoria tras cada petición
+    ("5m", segundos, 0 para descargarlo, -1 para siempre). None vuelve al valor del servidor
+    """
+    if valor is None:
+        _keep_alive.pop(modelo, None)
+    else:
+        _keep_alive[modelo] = valor
+
+def consultar(endpoint, timeout=10, url=None):
+    """
+    Petición GET a Ollama (/api/ps, /api/tags), al nodo indicado o al primero.
+    Devuelve el JSON o None
+    """
+    url = url or nodos()[0]
+    try:
+        response = obtener_sesion().get(f"{url}{endpoint}", timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error consultando Ollama ({endpoint}): {e}")
+        return None
+
+def _descontar_tokens(response, respuesta):
+    """Descuenta del límite de tokens/s del nodo los tokens que informó la respuesta"""
+    nodo = getattr(response, "nodo_ollama", None)
+    if nodo is not None and respuesta:
+        nodo.consumir_tokens(respuesta.get("prompt_eval_count", 0) + respuesta.get("eval_count", 0))
+
+def _adquirir_permiso():
+    """Lugar en vuelo del limitador adaptativo (espera si no hay), o None si está desactivado"""
+    limite = limitador()
+    return limite.adquirir() if limite is not None else None
+
+def _devolver_permiso(permiso, respuesta=None, error=False):
+    """
+    Devuelve el lugar al limitador. error (timeouts, conexión, 429, 5xx) reduce el límite;
+    sin respuesta ni error (otros fallos), el lugar se devuelve sin ajustar nada
+    """
+    if permiso is not None:
+        permiso.liberar(respuesta, error)
+
+def _liberar_permiso(response, respuesta):
+    """Devuelve el lugar de una respuesta 200 con su JSON final (None si no llegó)"""
+    _devolver_permiso(getattr(response, "permiso_ollama", None), respuesta, getattr(response, "error_ollama", False))
+
+def _sobrecarga(codigo):
+    """Códigos que indican un servidor saturado o caído; los 4xx restantes son errores del cliente"""
+    return codigo == 429 or codigo >= 500
+
+def _esperar_reintento(intento):
+    time.sleep(OLLAMA_BACKOFF * (2 ** intento))
+
+def _liberar_al_cerrar(response, reserva):
+    """En streaming la petición sigue en vuelo hasta que se cierra la respuesta"""
+    cerrar = response.close
+    def close():
+        try:
+            cerrar()
+        finally:
+            reserva.liberar()
+            _liberar_permiso(response, getattr(response, "final_ollama", None))
+    response.close = close
+
+def _enviar(endpoint, payload, timeout=None, reintentos=None, stream=False, url=None):
+    """
+    Envía la petición con reintentos y backoff exponencial.
+    Con varios nodos, cada intento va al nodo con menos peticiones en vuelo que ya tiene
+    el modelo cargado; si un nodo falla, se reintenta de inmediato en otro.
+    Antes de enviar se respetan los límites de peticiones/s y tokens/s del nodo y, tras esas
+    esperas, cada intento pide su lugar al limitador adaptativo (response.permiso_ollama);
+    el lugar se devuelve con la respuesta final (al cerrar, en streaming).
+    Con url, todos los intentos van a ese nodo.
+    Devuelve el objeto Response si el servidor respondió 200, None en caso contrario.
+    """
+    timeout = OLLAMA_TIMEOUT if timeout is None else timeout
+    reintentos = OLLAMA_REINTENTOS if reintentos is None else reintentos
+    modelo = payload.get("model")
+    balanceo = balanceador()
+    otros = {n.url for n in balanceo.nodos if n.url != url.rstrip("/")} if url else set()
+    fallidos = set()  # nodos que ya fallaron esta petición
+    intento = 0
+
+    while True:
+        reserva = balanceo.adquirir(modelo, excluir=fallidos | otros)
+        if reserva is None:
+            # Todos los nodos fallaron: esperamos y volvemos a probar con todos
+            _esperar_reintento(intento - 1)
+            fallidos.clear()
+            reserva = balanceo.adquirir(modelo, excluir=otros)
+        nodo = reserva.nodo
+        ultimo = intento == reintentos + len(balanceo.nodos) - len(otros) - 1
+        intento += 1
+        nodo.esperar_turno()
+        permiso = _adquirir_permiso()
+
+        try:
+            response = obtener_sesion().post(f"{nodo.url}{endpoint}", json=payload, timeout=timeout, stream=stream)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            reserva.liberar()
+            _devolver_permiso(permiso, error=True)
+            balanceo.fallo(nodo)
+            fallidos.add(nodo.url)
+            if ultimo:
+                print(f"Error de conexión con Ollama ({endpoint}): {e}")
+                return None
+            continue
+        except requests.exceptions.RequestException as e:
+            reserva.liberar()
+            _devolver_permiso(permiso)
+            print(f"Error de conexión con Ollama ({endpoint}): {e}")
+            return None
+        except BaseException:
+            reserva.liberar()
+            _devolver_permiso(permiso)
+            raise
+
+        if response.status_code == 200:
+            balanceo.exito(nodo, modelo)
+            response.nodo_ollama = nodo  # para descontar los tokens del límite del nodo
+            response.permiso_ollama = permiso
+            if stream:
+                _liberar_al_cerrar(response, reserva)
+            else:
+                reserva.liberar()
+            return response
+
+        reserva.liberar()
+        _devolver_permiso(permiso, error=_sobrecarga(response.status_code))
+        if response.status_code in CODIGOS_REINTENTABLES and not ultimo:
+            response.close()
+            fallidos.add(nodo.url)
+            continue
+
+        print(f"Error en la API ({endpoint}): {response.status_code}")
+        print(response.text[:200])
+        response.close()
+        return None
+
+def _consultar_ollama(endpoint, payload, timeout, reintentos, inicio, url=None):
+    """Envía la petición y registra sus métricas. Devuelve el JSON de la respuesta o None"""
+    modelo = payload.get("model")
+    envio = time.perf_counter()
+    response = _enviar(endpoint, payload, timeout, reintentos, url=url)
+    if response is None:
+        metricas.registrar(endpoint, modelo, espera_s=envio - inicio, cliente_s=time.perf_counter() - envio, error=True)
+        return None
+    permiso = getattr(response, "permiso_ollama", None)
+    if permiso is not None:
+        envio = permiso.inicio  # la espera en el limitador cuenta como cola, no como HTTP
+
+    try:
+        respuesta = response.json()
+    except ValueError as e:
+        print(f"Error al decodificar JSON ({endpoint}): {e}")
+        print(f"Respuesta recibida: {response.text[:200]}...")
+        metricas.registrar(endpoint, modelo, espera_s=envio - inicio, cliente_s=time.perf_counter() - envio, error=True)
+        _liberar_permiso(response, None)
+        return None
+
+    metricas.registrar(endpoint, modelo, respuesta, espera_s=envio - inicio, cliente_s=time.perf_counter() - envio)
+    _descontar_tokens(response, respuesta)
+    _liberar_permiso(response, respuesta)
+    return respuesta
+
+def _desde_cache(endpoint, payload, usar_cache, inicio):
+    """Devuelve (cache, clave, respuesta); respuesta no es None si la petición estaba en cache"""
+    if not (usar_cache and cache_respuestas.es_determinista(payload)):
+        return None, None, None
+    cache = cache_respuestas.obtener_cache()
+    if cache is None:
+        return None, None, None
+    clave = cache_respuestas.clave(endpoint, payload)
+    respuesta = cache.obtener(clave)
+    if respuesta is not None:
+        metricas.registrar(endpoint, payload.get("model"), respuesta, cliente_s=time.perf_counter() - inicio, cache=True)
+    return cache, clave, respuesta
+
+def _coalescible(payload):
+    # Solo las peticiones deterministas dan el mismo resultado a todos los que esperan
+    return vuelo_unico.OLLAMA_VUELO_UNICO and cache_respuestas.es_determinista(payload)
+
+def _resultado_vuelo(endpoint, payload, respuesta, compartida, cache, clave, inicio):
+    if compartida:
+        metricas.registrar(endpoint, payload.get("model"), respuesta, cliente_s=time.perf_counter() - inicio,
+                           error=respuesta is None, coalescida=True)
+        # Cada llamada recibe su propia copia
+        return copy.deepcopy(respuesta)
+    if respuesta is not None and cache is not None:
+        cache.guardar(clave, respuesta)
+    return respuesta
+
+def solicitud(endpoint, payload, timeout=None, reintentos=None, usar_cache=True, url=None):
+    """
+    Petición no-streaming a Ollama.
+    Devuelve el JSON de la respuesta como dict, o None si hubo un error.
+    Las peticiones deterministas (temperatura 0) se sirven desde el cache en disco y,
+    si ya hay una idéntica en vuelo, esperan su resultado en lugar de repetirla.
+    Con url la petición va a ese nodo (por ejemplo, para cargar un modelo en todos)
+    y no se comparte con otras.
+    """
+    payload = dict(payload, stream=False)
+    inicio = time.perf_counter()
+    cache, clave, respuesta = _desde_cache(endpoint, payload, usar_cache, inicio)
+    if respuesta is not None:
+        return respuesta
+
+    consultar = lambda: _consultar_ollama(endpoint, payload, timeout, reintentos, inicio, url)
+    if url or not _coalescible(payload):
+        return _resultado_vuelo(endpoint, payload, consultar(), False, cache, clave, inicio)
+    respuesta, compartida = vuelo_unico.obtener().ejecutar(vuelo_unico.clave(endpoint, payload), consultar)
+    return _resultado_vuelo(endpoint, payload, respuesta, compartida, cache, clave, inicio)
+
+async def solicitud_async(endpoint, payload, timeout=None, reintentos=None, usar_cache=True):
+    """
+    solicitud() para corrutinas de asyncio. La petición se hace en el pool de hilos del loop;
+    si ya hay una idéntica en vuelo (de un hilo o de otra corrutina) se espera su resultado.
+    """
+    payload = dict(payload, stream=False)
+    inicio = time.perf_counter()
+    cache, clave, respuesta = _desde_cache(endpoint, payload, usar_cache, inicio)
+    if respuesta is not None:
+        return respuesta
+
+    consultar = lambda: _consultar_ollama(endpoint, payload, timeout, reintentos, inicio)
+    if not _coalescible(payload):
+        import asyncio
+        respuesta = await asyncio.get_running_loop().run_in_executor(None, consultar)
+        return _resultado_vuelo(endpoint, payload, respuesta, False, cache, clave, inicio)
+    respuesta, compartida = await vuelo_unico.obtener().ejecutar_async(vuelo_unico.clave(endpoint, payload), consultar)
+    return _resultado_vuelo(endpoint, payload, respuesta, compartida, cache, clave, inicio)
+
+def abrir_stream(endpoint, payload, timeout=None, reintentos=None):
+    """
+    Petición streaming a Ollama.
+    Devuelve el Response abierto (para iter_lines) o None si hubo un error.
+    """
+    payload = dict(payload, stream=True)
+    return _enviar(endpoint, payload, timeout, reintentos, stream=True)
+
+def iterar_stream(response):
+    """
+    Genera cada fragmento JSON de una respuesta streaming y cierra la conexión al terminar
+    """
+    try:
+        for linea in response.iter_lines():
+            if linea:
+                chunk = json.loads(linea)
+                if chunk.get("done"):
+                    _descontar_tokens(response, chunk)
+                    response.final_ollama = chunk
+                yield chunk
+    except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError):
+        # Un corte o timeout a mitad del stream cuenta como sobrecarga para el limitador
+        response.error_ollama = True
+        raise
+    finally:
+        response.close()
+
+def _payload(modelo, opciones=None, formato=None):
+    payload = {"model": modelo}
+    if modelo in _keep_alive:
+        payload["keep_alive"] = _keep_alive[modelo]
+    if opciones:
+        payload["options"] = opciones
+    if formato:
+        payload["format"] = formato
+    return payload
+
+def chat(messages, modelo, opciones=None, formato=None, timeout=None, reintentos=None):
+    """
+    Llamada a /api/chat. Devuelve el JSON de Ollama o None
+    """
+    payload = _payload(modelo, opciones, formato)
+    payload["messages"] = messages
+    return solicitud("/api/chat", payload, timeout, reintentos)
+
+async def chat_async(messages, modelo, opciones=None, formato=None, timeout=None, reintentos=None):
+    """
+    chat() para corrutinas de asyncio
+    """
+    payload = _payload(modelo, opciones, formato)
+    payload["messages"] = messages
+    return await solicitud_async("/api/chat", payload, timeout, reintentos)
+
+def chat_stream(messages, modelo, opciones=None, formato=None, timeout=None, reintentos=None):
+    """
+    Llamada streaming a /api/chat. Genera los fragmentos JSON a medida que llegan;
+    no genera nada si la petición falló.
+    Los reintentos solo ocurren antes de recibir la respuesta, nunca a mitad del stream.
+    """
+    payload = _payload(modelo, opciones, formato)
+    payload["messages"] = messages
+    envio = time.perf_counter()
+    response = abrir_stream("/api/chat", payload, timeout, reintentos)
+    if response is None:
+        metricas.registrar("/api/chat", modelo, cliente_s=time.perf_counter() - envio, error=True)
+        return
+
+    final = None
+    try:
+        for chunk in iterar_stream(response):
+            if chunk.get("done"):
+                final = chunk
+            yield chunk
+    finally:
+        # El último fragmento trae los tiempos del servidor; sin él, el stream quedó incompleto
+        metricas.registrar("/api/chat", modelo, final, cliente_s=time.perf_counter() - envio, error=final is None)
+
+def generate(prompt, modelo, opciones=None, formato=None, timeout=None, reintentos=None):
+    """
+    Llamada a /api/generate. Devuelve el JSON de Ollama o None
+    """
+    payload = _payload(modelo, opciones, formato)
+    payload["prompt"] = prompt
+    return solicitud("/api/generate", payload, timeout, reintentos)
+
+def embed(entradas, modelo, truncar=True, timeout=None, reintentos=None):
+    """
+    Llamada a /api/embed (texto o lista de textos). No genera tokens de salida.
+    Devuelve el JSON de Ollama (embeddings y prompt_eval_count) o None
+    """
+    payload = {"model": modelo, "input": entradas, "truncate": truncar}
+    if modelo in _keep_alive:
+        payload["keep_alive"] = _keep_alive[modelo]
+    return solicitud("/api/embed", payload, timeout, reintentos)
+
+def fragmento(chunk):
+    """
+    Texto incremental de un fragmento streaming de /api/chat o /api/generate
+    """
+    if "message" in chunk:
+        return chunk["message"].get("content", "")
+    return chunk.get("response", "")
+
+def extraer_json(texto):
+    """
+    Intenta extraer un JSON del texto generado, incluso si viene con texto alrededor
+    """
+    if not texto:
+        return None
+    try:
+        return json.loads(texto)
+    except json.JSONDecodeError:
+        start = texto.find('{')
+        end = texto.rfind('}') + 1
+        if start != -1 and end > start:
+            try:
+                return json.loads(texto[start:end])
+            except json.JSONDecodeError as e:
+                print(f"Error extrayendo JSON: {e}")
+    return None
+
+def contenido(respuesta):
+    """
+    Extrae el texto generado de una respuesta de /api/chat o /api/generate
+    """
+    if not isinstance(respuesta, dict):
+        return None
+    if "message" in respuesta:
+        return respuesta["message"].get("content")
+    return respuesta.get("response")
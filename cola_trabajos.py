@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import configuracion
+
+OLLAMA_TRABAJOS_RUTA = configuracion.obtener("OLLAMA_TRABAJOS_RUTA", ".cache_ollama/trabajos.sqlite")
+OLLAMA_TRABAJOS_REINTENTOS = int(configuracion.obtener("OLLAMA_TRABAJOS_REINTENTOS", "3"))
+OLLAMA_TRABAJOS_BACKOFF = float(configuracion.obtener("OLLAMA_TRABAJOS_BACKOFF", "2"))
+
+PENDIENTE = "pendiente"
+EN_CURSO = "en_curso"
+HECHO = "hecho"
+FALLIDO = "fallido"
+
+def id_trabajo(*partes):
+    """
+    Identificador estable de un trabajo a partir de lo que define su resultado
+    (contenido de entrada, modelo, prompt...). Repetir el trabajo lo reanuda
+    """
+    return hashlib.sha256(json.dumps(partes, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()[:24]
+
+def hash_archivo(ruta, tamano_bloque=1 << 20):
+    """SHA-256 del contenido de un archivo, leído por bloques"""
+    digest = hashlib.sha256()
+    with open(ruta, "rb") as archivo:
+        for bloque in iter(lambda: archivo.read(tamano_bloque), b""):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+class ColaTrabajos:
+    """
+    Cola persistente (SQLite) de trabajos por lotes. Cada ítem guarda su estado y su resultado
+    en cuanto termina, así que un trabajo interrumpido se reanuda desde el último ítem completado.
+    Los fallos se reintentan con backoff exponencial.
+    """
+
+    def __init__(self, ruta=OLLAMA_TRABAJOS_RUTA):
+        directorio = os.path.dirname(ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conexion = sqlite3.connect(ruta, check_same_thread=False)
+        self._conexion.execute("PRAGMA journal_mode=WAL")
+        self._conexion.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                trabajo TEXT NOT NULL,
+                clave TEXT NOT NULL,
+                orden INTEGER NOT NULL,
+                entrada TEXT NOT NULL,
+                estado TEXT NOT NULL,
+                intentos INTEGER NOT NULL DEFAULT 0,
+                resultado TEXT,
+                error TEXT,
+                actualizado REAL NOT NULL,
+                PRIMARY KEY (trabajo, clave)
+            )
+        """)
+        self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_items_estado ON items (trabajo, estado, orden)")
+        self._conexion.execute("CREATE INDEX IF NOT EXISTS idx_items_orden ON items (trabajo, orden)")
+        self._conexion.commit()
+
+    def agregar(self, trabajo, items, tamano_lote=500):
+        """
+        Agrega ítems (clave, entrada) al trabajo, en lotes, sin cargar todos en memoria.
+        Los que ya existen se conservan con su estado, por eso volver a agregar los mismos
+        ítems no repite el trabajo hecho. Devuelve la cantidad de ítems del trabajo
+        """
+        lote = []
+        for orden, (clave, entrada) in enumerate(items):
+            lote.append((trabajo, str(clave), orden, json.dumps(entrada, ensure_ascii=False), PENDIENTE, time.time()))
+            if len(lote) >= tamano_lote:
+                self._insertar(lote)
+                lote = []
+        self._insertar(lote)
+        with self._lock:
+            return self._conexion.execute("SELECT COUNT(*) FROM items WHERE trabajo = ?", (trabajo,)).fetchone()[0]
+
+    def _insertar(self, filas):
+        with self._lock:
+            self._conexion.executemany(
+                "INSERT OR IGNORE INTO items (trabajo, clave, orden, entrada, estado, actualizado) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                filas
+            )
+            self._conexion.commit()
+
+    def _tomar(self, trabajo, cantidad):
+        # Marca en curso el siguiente grupo de ítems pendientes, en orden
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT clave, entrada, intentos FROM items WHERE trabajo = ? AND estado = ? ORDER BY orden LIMIT ?",
+                (trabajo, PENDIENTE, cantidad)
+            ).fetchall()
+            self._conexion.executemany(
+                "UPDATE items SET estado = ?, actualizado = ? WHERE trabajo = ? AND clave = ?",
+                [(EN_CURSO, time.time(), trabajo, clave) for clave, _, _ in filas]
+            )
+            self._conexion.commit()
+        return [(clave, json.loads(entrada), intentos) for clave, entrada, intentos in filas]
+
+    def _terminar(self, trabajo, clave, estado, intentos, resultado=None, error=None):
+        with self._lock:
+            self._conexion.execute(
+                "UPDATE items SET estado = ?, intentos = ?, resultado = ?, error = ?, actualizado = ? "
+                "WHERE trabajo = ? AND clave = ?",
+                (estado, intentos, None if resultado is None else json.dumps(resultado, ensure_ascii=False),
+                 error, time.time(), trabajo, clave)
+            )
+            self._conexion.commit()
+
+    def _procesar(self, trabajo, clave, entrada, intentos_previos, funcion, reintentos, backoff):
+        error = None
+        for intento in range(reintentos + 1):
+            try:
+                resultado = funcion(entrada)
+            except Exception as e:
+                resultado, error = None, str(e)
+            if resultado is not None:
+                self._terminar(trabajo, clave, HECHO, intentos_previos + intento + 1, resultado)
+                return True
+            if intento < reintentos:
+                time.sleep(backoff * (2 ** intento))
+        print(f"Ítem {clave} falló tras {reintentos + 1} intento(s)")
+        self._terminar(trabajo, clave, FALLIDO, intentos_previos + reintentos + 1, error=error or "sin resultado")
+        return False
+
+    def ejecutar(self, trabajo, funcion, max_concurrencia=4, reintentos=OLLAMA_TRABAJOS_REINTENTOS,
+                 backoff=OLLAMA_TRABAJOS_BACKOFF):
+        """
+        Procesa los ítems pendientes con funcion(entrada), que devuelve un resultado serializable
+        en JSON o None si falló. Los ítems que quedaron en curso (ejecución interrumpida) o fallidos
+        en una ejecución anterior vuelven a intentarse; los hechos no se repiten.
+        Devuelve el estado del trabajo
+        """
+        with self._lock:
+            self._conexion.execute(
+                "UPDATE items SET estado = ? WHERE trabajo = ? AND estado IN (?, ?)",
+                (PENDIENTE, trabajo, EN_CURSO, FALLIDO)
+            )
+            self._conexion.commit()
+
+        # Como mucho 2 * max_concurrencia ítems tomados a la vez: la memoria no depende del tamaño
+        # del trabajo. Cada ítem que termina deja lugar a otro, así uno lento no frena a los demás
+        limite = max_concurrencia * 2
+        en_vuelo, agotado = set(), False
+        with ThreadPoolExecutor(max_workers=max_concurrencia) as executor:
+            while True:
+                if not agotado and len(en_vuelo) < limite:
+                    grupo = self._tomar(trabajo, limite - len(en_vuelo))
+                    agotado = not grupo
+                    en_vuelo.update(
+                        executor.submit(self._procesar, trabajo, clave, entrada, intentos, funcion, reintentos, backoff)
+                        for clave, entrada, intentos in grupo
+                    )
+                if not en_vuelo:
+                    break
+                listos, en_vuelo = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    futuro.result()
+
+        return self.estado(trabajo)
+
+    def resultados(self, trabajo, tamano_pagina=500):
+        """
+        Genera (clave, entrada, resultado) en el orden en que se agregaron, por páginas;
+        resultado es None si el ítem no terminó
+        """
+        orden = -1
+        while True:
+            with self._lock:
+                filas = self._conexion.execute(
+                    "SELECT orden, clave, entrada, resultado FROM items WHERE trabajo = ? AND orden > ? "
+                    "ORDER BY orden LIMIT ?",
+                    (trabajo, orden, tamano_pagina)
+                ).fetchall()
+            if not filas:
+                return
+            for orden, clave, entrada, resultado in filas:
+                yield clave, json.loads(entrada), None if resultado is None else json.loads(resultado)
+
+    def estado(self, trabajo):
+        """Cantidad de ítems por estado"""
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT estado, COUNT(*) FROM items WHERE trabajo = ? GROUP BY estado", (trabajo,)
+            ).fetchall()
+        return dict(filas)
+
+    def eliminar(self, trabajo):
+        with self._lock:
+            self._conexion.execute("DELETE FROM items WHERE trabajo = ?", (trabajo,))
+            self._conexion.commit()
+
+    def trabajos(self):
+        """Resumen de todos los trabajos guardados: {trabajo: {estado: cantidad}}"""
+        with self._lock:
+            filas = self._conexion.execute(
+                "SELECT trabajo, estado, COUNT(*) FROM items GROUP BY trabajo, estado"
+            ).fetchall()
+        resumen = {}
+        for trabajo, estado, cantidad in filas:
+            resumen.setdefault(trabajo, {})[estado] = cantidad
+        return resumen
+
+_cola = None
+_lock_cola = threading.Lock()
+
+def obtener_cola():
+    """Cola compartida del proceso"""
+    global _cola
+    if _cola is None:
+        with _lock_cola:
+            if _cola is None:
+                _cola = ColaTrabajos()
+    return _cola
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trabajos por lotes guardados")
+    parser.add_argument("--eliminar", metavar="TRABAJO", help="Elimina un trabajo y sus ítems")
+    args = parser.parse_args()
+
+    cola = obtener_cola()
+    if args.eliminar:
+        cola.eliminar(args.eliminar)
+        print(f"Trabajo {args.eliminar} eliminado")
+    for trabajo, estados in cola.trabajos().items():
+        print(f"{trabajo}: " + ", ".join(f"{estado} {cantidad}" for estado, cantidad in sorted(estados.items())))
@@ -0,0 +1,23 @@
+import os
+import threading
+from dotenv import load_dotenv
+
+_cargada = False
+_lock = threading.Lock()
+
+def cargar():
+    """
+    Lee el archivo .env una sola vez por proceso.
+    Las variables ya definidas en el entorno tienen prioridad sobre el archivo.
+    """
+    global _cargada
+    if not _cargada:
+        with _lock:
+            if not _cargada:
+                load_dotenv()
+                _cargada = True
+
+def obtener(nombre, defecto=None):
+    """Valor de una variable de configuración (entorno o .env)"""
+    cargar()
+    return os.getenv(nombre, defecto)
@@ -1,16 +1,16 @@
-import os
-import requests
-from dotenv import load_dotenv
-try:
-    from transformers import AutoTokenizer
-    HF_AVAILABLE = True
-except ImportError:
-    HF_AVAILABLE = False
-
-load_dotenv()
-
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")
+import argparse
+import threading
+import importlib.util
+from functools import lru_cache
+import configuracion
+import cliente_ollama
+import metricas
+
+# transformers tarda segundos en importarse: solo se comprueba que esté instalado
+# y se importa la primera vez que hace falta un tokenizador local
+HF_AVAILABLE = importlib.util.find_spec("transformers") is not None
+
+OLLAMA_MODEL = configuracion.obtener("OLLAMA_MODEL", "llama3")
 OLLAMA_MODEL_ALT = "llama3:instruct"
 
 # Modelos públicos alternativos que no requieren autenticación
@@ -21,67 +21,136 @@ PUBLIC_MODELS = {
     "llama2": "meta-llama/Llama-2-7b-hf"
 }
 
-def contar_tokens_api(texto, modelo):
-    """Cuenta tokens usando la API de Ollama"""
-    endpoints = ["/api/generate", "/api/chat"]  # Probamos ambos endpoints
-    
-    for endpoint in endpoints:
-        url = f"{OLLAMA_BASE_URL}{endpoint}"
-        payload = {
-            "model": modelo,
-            "prompt": texto,
-            "stream": False,
-            "options": {"temperature": 0}
-        } if endpoint == "/api/generate" else {
-            "model": modelo,
-            "messages": [{"role": "user", "content": texto}],
-            "stream": False,
-            "options": {"temperature": 0}
-        }
-        
-        try:
-            response = requests.post(url, json=payload, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("eval_count", 0) + data.get("prompt_eval_count", 0)
-        except Exception:
-            continue
-    
-    return 0
+# Caracteres por token iniciales (texto en español) por familia de modelo.
+# Se ajustan solos con cada conteo exacto o con calibrar_estimador().
+CARACTERES_POR_TOKEN = {
+    "llama3": 3.6,
+    "llama2": 3.0,
+    "mistral": 3.1,
+}
+CARACTERES_POR_TOKEN_DEFECTO = 3.3
 
-def contar_tokens_local(texto, modelo):
-    """Cuenta tokens localmente usando modelos públicos"""
-    if not HF_AVAILABLE:
+# Acumulados de calibración por familia: [caracteres, tokens]
+_calibracion = {}
+_lock_calibracion = threading.Lock()
+_lock_tokenizador = threading.Lock()
+
+def _familia(modelo):
+    return (modelo or "").split(":")[0]
+
+def _registrar_calibracion(modelo, caracteres, tokens):
+    if caracteres <= 0 or tokens <= 0:
+        return
+    with _lock_calibracion:
+        acumulado = _calibracion.setdefault(_familia(modelo), [0, 0])
+        acumulado[0] += caracteres
+        acumulado[1] += tokens
+
+def caracteres_por_token(modelo):
+    """Relación caracteres/token vigente para el modelo"""
+    acumulado = _calibracion.get(_familia(modelo))
+    if acumulado and acumulado[1]:
+        return acumulado[0] / acumulado[1]
+    return CARACTERES_POR_TOKEN.get(_familia(modelo), CARACTERES_POR_TOKEN_DEFECTO)
+
+def estimar_tokens(texto, modelo):
+    """Estimación offline instantánea, calibrada por modelo"""
+    if not texto:
         return 0
-    
-    model_name = PUBLIC_MODELS.get(modelo, "hf-internal-testing/llama-tokenizer")
-    
+    return int(len(texto) / caracteres_por_token(modelo)) + 1
+
+@lru_cache(maxsize=None)
+def _cargar_tokenizador(model_name):
     try:
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
-        return len(tokenizer.encode(texto))
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(model_name)
     except Exception as e:
         print(f"\nError en tokenizador local ({model_name}): {str(e)}")
+        return None  # Se memoriza también el fallo para no reintentar la descarga
+
+def obtener_tokenizador(modelo):
+    """Tokenizador local del proceso (se carga una sola vez por modelo), o None"""
+    if not HF_AVAILABLE:
+        return None
+    model_name = PUBLIC_MODELS.get(modelo, "hf-internal-testing/llama-tokenizer")
+    with _lock_tokenizador:
+        return _cargar_tokenizador(model_name)
+
+@metricas.etiquetado("contador_tokens", "contar_tokens")
+def contar_tokens_api(texto, modelo):
+    """
+    Cuenta tokens de entrada usando /api/embed, que evalúa el prompt sin generar
+    """
+    respuesta = cliente_ollama.embed(texto, modelo, truncar=False, timeout=10, reintentos=0)
+    if respuesta:
+        tokens = respuesta.get("prompt_eval_count", 0)
+        _registrar_calibracion(modelo, len(texto), tokens)
+        return tokens
+    return 0
+
+def contar_tokens_local(texto, modelo):
+    """Cuenta tokens localmente usando modelos públicos"""
+    tokenizer = obtener_tokenizador(modelo)
+    if tokenizer is None:
         return 0
+    tokens = len(tokenizer.encode(texto))
+    _registrar_calibracion(modelo, len(texto), tokens)
+    return tokens
 
-def contar_tokens(texto, modelo):
-    """Función principal que combina ambos métodos"""
-    # Intento con API primero
+def contar_tokens_lote(textos, modelo):
+    """
+    Cuenta tokens de muchos textos de una vez: una sola llamada al tokenizador local
+    en lote o, si no está disponible, el estimador calibrado
+    """
+    textos = list(textos)
+    tokenizer = obtener_tokenizador(modelo)
+    if tokenizer is None:
+        ratio = caracteres_por_token(modelo)
+        return [int(len(texto) / ratio) + 1 if texto else 0 for texto in textos]
+
+    ids = tokenizer(textos, add_special_tokens=False)["input_ids"]
+    conteos = [len(fila) for fila in ids]
+    _registrar_calibracion(modelo, sum(len(texto) for texto in textos), sum(conteos))
+    return conteos
+
+def calibrar_estimador(modelo, textos):
+    """
+    Ajusta el estimador del modelo con conteos exactos de textos de muestra.
+    Devuelve la relación caracteres/token resultante
+    """
+    for texto in textos:
+        if not contar_tokens_local(texto, modelo):
+            contar_tokens_api(texto, modelo)
+    return caracteres_por_token(modelo)
+
+def contar_tokens_detalle(texto, modelo):
+    """
+    Cuenta tokens sin generar nunca una respuesta. Devuelve (tokens, método)
+    """
+    # La API usa el tokenizador real del modelo servido
     count = contar_tokens_api(texto, modelo)
     if count > 0:
-        return count
-    
+        return count, "API"
+
     # Fallback a tokenizador local
-    return contar_tokens_local(texto, modelo)
+    count = contar_tokens_local(texto, modelo)
+    if count > 0:
+        return count, "Local"
 
-def mostrar_resultados(modelo, texto, num_tokens):
+    return estimar_tokens(texto, modelo), "Estimado"
+
+def contar_tokens(texto, modelo):
+    """Función principal que combina los tres métodos"""
+    return contar_tokens_detalle(texto, modelo)[0]
+
+def mostrar_resultados(modelo, texto, num_tokens, metodo):
     """Muestra resultados formateados"""
     print(f"\nModelo: {modelo}")
     print(f"Número de tokens: {num_tokens}")
-    print(f"Método: {'API' if num_tokens > 0 else 'Local (fallback)'}")
+    print(f"Método: {metodo}")
     print("-" * 50)
 
-if __name__ == "__main__":
-    texto_prompt = """Eres un categorizador de productos.
+TEXTO_EJEMPLO = """Eres un categorizador de productos.
 Debes asumir las categorías presentes en la lista a continuación.
 # Lista de Categorías Válidas
 1. Cat 1
@@ -94,17 +163,34 @@ Categoría: presenta la categoría del producto
 Producto: Cepillo de dientes con carga solar
 Categoría: Electrónicos Verdes"""
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Contador de tokens para Ollama")
+    parser.add_argument("texto", nargs="?", help="Texto a contar (por defecto, un prompt de ejemplo)")
+    parser.add_argument("--archivo", help="Cuenta los tokens del contenido de este archivo")
+    parser.add_argument("--modelos", nargs="+", default=[OLLAMA_MODEL, OLLAMA_MODEL_ALT])
+    args = parser.parse_args(argv)
+
+    texto_prompt = args.texto or TEXTO_EJEMPLO
+    if args.archivo:
+        try:
+            with open(args.archivo, "r", encoding="utf-8") as archivo:
+                texto_prompt = archivo.read()
+        except IOError as e:
+            print(f"Error al leer archivo: {e}")
+            return None
+
     print("\n=== Contador de Tokens para Ollama ===")
     print("Texto a analizar:")
     print(texto_prompt[:200] + "...\n")
 
-    # Contar tokens para ambos modelos
-    modelos = [OLLAMA_MODEL, OLLAMA_MODEL_ALT]
-    
-    for modelo in modelos:
-        num_tokens = contar_tokens(texto_prompt, modelo)
-        mostrar_resultados(modelo, texto_prompt, num_tokens)
+    # Contar tokens para cada modelo
+    for modelo in args.modelos:
+        num_tokens, metodo = contar_tokens_detalle(texto_prompt, modelo)
+        mostrar_resultados(modelo, texto_prompt, num_tokens, metodo)
 
     if not HF_AVAILABLE:
         print("\nNOTA: Para conteo local de tokens, instala transformers:")
-        print("pip install transformers")
\ No newline at end of file
+        print("pip install transformers")
+
+if __name__ == "__main__":
+    main()
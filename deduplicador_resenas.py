@@ -0,0 +1,167 @@
+import re
+import zlib
+import unicodedata
+import configuracion
+import contador_tokens
+
+OLLAMA_RESENAS_MAX_TOKENS = int(configuracion.obtener("OLLAMA_RESENAS_MAX_TOKENS", "3000"))  # presupuesto de entrada
+UMBRAL_SIMILITUD = 0.8  # Jaccard a partir del cual dos reseñas se consideran casi iguales
+TAMANO_SHINGLE = 2  # palabras seguidas
+# Dos reseñas que difieren en alguna de estas palabras pueden decir lo contrario: nunca se agrupan
+NEGACIONES = {"no", "nunca", "jamas", "ni", "tampoco", "sin", "mal"}
+NUM_PERMUTACIONES = 64
+FILAS_POR_BANDA = 4  # LSH: 16 bandas de 4 filas
+MARGEN_ESTIMACION = 0.15  # la estimación con 64 permutaciones se desvía ~0.05 del Jaccard real
+MAX_VERIFICADOS = 8  # candidatos con Jaccard exacto por reseña, los de mayor similitud estimada
+PRIMO = 4294967311  # primo mayor que 2^32
+SEMILLA = 42
+
+ENCABEZADO = (
+    "Reseñas agrupadas: {total} reseñas en {grupos} grupos de reseñas casi idénticas. "
+    "(×N) indica cuántas reseñas representa cada línea; pondera el sentimiento según esos conteos."
+)
+PIE_OMITIDAS = "(Se omitieron {grupos} grupos poco frecuentes con {resenas} reseñas en total.)"
+
+def separar_resenas(texto):
+    """Una reseña por línea, sin viñetas ni líneas vacías"""
+    resenas = []
+    for linea in (texto or "").splitlines():
+        linea = linea.strip().lstrip("-•*").strip()
+        if linea:
+            resenas.append(linea)
+    return resenas
+
+def normalizar(texto):
+    """Minúsculas, sin tildes ni signos: "¡Súper cómoda!" -> "super comoda" """
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"[^\w]+", " ", texto).strip()
+
+def shingles(texto, tamano=TAMANO_SHINGLE):
+    """Hashes de los grupos de tamano palabras seguidas del texto normalizado"""
+    palabras = normalizar(texto).split()
+    if len(palabras) <= tamano:
+        return {zlib.crc32(" ".join(palabras).encode("utf-8"))}
+    return {zlib.crc32(" ".join(palabras[i:i + tamano]).encode("utf-8")) for i in range(len(palabras) - tamano + 1)}
+
+def negaciones(texto):
+    """Palabras de negación de la reseña normalizada"""
+    return NEGACIONES.intersection(normalizar(texto).split())
+
+def firmas_minhash(conjuntos, num_permutaciones=NUM_PERMUTACIONES):
+    """
+    Firma MinHash de cada conjunto de shingles, vectorizada: una matriz (reseñas x permutaciones)
+    """
+    # NumPy solo se importa al deduplicar
+    import numpy as np
+    generador = np.random.default_rng(SEMILLA)
+    # a < 2^31 y hash < 2^32: a * hash + b no desborda 64 bits
+    a = generador.integers(1, 1 << 31, num_permutaciones, dtype=np.uint64)
+    b = generador.integers(0, 1 << 32, num_permutaciones, dtype=np.uint64)
+    conjuntos = [sorted(conjunto) for conjunto in conjuntos]
+    hashes = np.fromiter((h for conjunto in conjuntos for h in conjunto), dtype=np.uint64)
+    inicios = np.cumsum([0] + [len(conjunto) for conjunto in conjuntos[:-1]])
+    valores = (hashes[:, None] * a + b) % PRIMO
+    return np.minimum.reduceat(valores, inicios, axis=0)
+
+def agrupar(resenas, umbral=UMBRAL_SIMILITUD):
+    """
+    Agrupa reseñas casi idénticas: MinHash + LSH por bandas proponen candidatos y se agrupan
+    los que superan el umbral de Jaccard exacto sobre shingles de palabras y tienen las mismas
+    negaciones. Devuelve [(representante, cantidad)] en orden de primera aparición;
+    el representante es la primera reseña del grupo
+    """
+    if not resenas:
+        return []
+    import numpy as np
+    # Las reseñas iguales tras normalizar van directo a su grupo; solo las distintas pasan por MinHash
+    grupo_de_texto, unicas, cantidades_unicas = {}, [], []
+    for resena in resenas:
+        texto = normalizar(resena)
+        if texto not in grupo_de_texto:
+            grupo_de_texto[texto] = len(unicas)
+            unicas.append(resena)
+            cantidades_unicas.append(0)
+        cantidades_unicas[grupo_de_texto[texto]] += 1
+
+    conjuntos = [shingles(resena) for resena in unicas]
+    negadas = [negaciones(resena) for resena in unicas]
+    firmas = firmas_minhash(conjuntos)
+    cubetas = {}  # (banda, valores de la banda) -> índices de grupos
+    representantes, cantidades = [], []
+
+    for i in range(len(unicas)):
+        bandas = [
+            (inicio, firmas[i, inicio:inicio + FILAS_POR_BANDA].tobytes())
+            for inicio in range(0, firmas.shape[1], FILAS_POR_BANDA)
+        ]
+        mejor = None
+        candidatos = list({grupo for banda in bandas for grupo in cubetas.get(banda, ())})
+        if candidatos:
+            # La similitud estimada por las firmas descarta en bloque a los lejanos;
+            # el Jaccard exacto decide entre los más cercanos, de más a menos parecido
+            indices = np.array([representantes[grupo] for grupo in candidatos])
+            estimadas = (firmas[indices] == firmas[i]).mean(axis=1)
+            for k in np.argsort(-estimadas, kind="stable")[:MAX_VERIFICADOS]:
+                if estimadas[k] < umbral - MARGEN_ESTIMACION:
+                    break
+                representante = indices[k]
+                if negadas[i] != negadas[representante]:
+                    continue
+                interseccion = len(conjuntos[i] & conjuntos[representante])
+                if interseccion / (len(conjuntos[i]) + len(conjuntos[representante]) - interseccion) >= umbral:
+                    mejor = candidatos[k]
+                    break
+
+        if mejor is None:
+            mejor = len(representantes)
+            representantes.append(i)
+            cantidades.append(0)
+            for banda in bandas:
+                cubetas.setdefault(banda, []).append(mejor)
+        cantidades[mejor] += cantidades_unicas[i]
+
+    return [(unicas[indice], cantidad) for indice, cantidad in zip(representantes, cantidades)]
+
+def compactar(texto, modelo, max_tokens=OLLAMA_RESENAS_MAX_TOKENS):
+    """
+    Reduce las reseñas a una línea por grupo de casi duplicados, con su conteo, dentro del
+    presupuesto de tokens. Los grupos más numerosos entran primero; los que no caben se resumen
+    en un pie con su conteo, así las proporciones de sentimiento se conservan.
+    Sin duplicados y dentro del presupuesto, devuelve el texto original.
+    Devuelve (texto, estadísticas)
+    """
+    resenas = separar_resenas(texto)
+    tokens_original = contador_tokens.estimar_tokens(texto, modelo)
+    grupos = agrupar(resenas)
+    estadisticas = {
+        "resenas": len(resenas), "grupos": len(grupos), "incluidos": len(grupos),
+        "tokens_original": tokens_original, "tokens": tokens_original,
+    }
+    if len(grupos) == len(resenas) and tokens_original <= max_tokens:
+        return texto, estadisticas
+
+    encabezado = ENCABEZADO.format(total=len(resenas), grupos=len(grupos))
+    # Se reserva lugar para el pie de omitidas
+    tokens = contador_tokens.estimar_tokens(encabezado + PIE_OMITIDAS, modelo)
+    lineas = []
+    orden = sorted(range(len(grupos)), key=lambda g: -grupos[g][1])  # estable: empates por aparición
+    incluidos = set()
+    for g in orden:
+        linea = f"- (×{grupos[g][1]}) {grupos[g][0]}"
+        tokens_linea = contador_tokens.estimar_tokens(linea, modelo)
+        if lineas and tokens + tokens_linea > max_tokens:
+            break
+        incluidos.add(g)
+        lineas.append(linea)
+        tokens += tokens_linea
+
+    # Se envían en el orden original del archivo
+    lineas = [f"- (×{grupos[g][1]}) {grupos[g][0]}" for g in range(len(grupos)) if g in incluidos]
+    omitidos = [grupos[g][1] for g in range(len(grupos)) if g not in incluidos]
+    if omitidos:
+        lineas.append(PIE_OMITIDAS.format(grupos=len(omitidos), resenas=sum(omitidos)))
+
+    compacto = "\n".join([encabezado] + lineas)
+    estadisticas.update(incluidos=len(incluidos), tokens=contador_tokens.estimar_tokens(compacto, modelo))
+    return compacto, estadisticas
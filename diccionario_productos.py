@@ -0,0 +1,77 @@
+import re
+from collections import Counter
+import contador_tokens
+
+PREFIJO_ID = "P"
+
+def separar_productos(texto):
+    """
+    Divide la lista de productos de un cliente. Algunos nombres llevan comas
+    ("Alimentos orgánicos, como frutas, verduras y granos"): un fragmento que empieza
+    en minúscula continúa el producto anterior
+    """
+    productos = []
+    for parte in (texto or "").split(","):
+        parte = parte.strip().strip('"').strip()
+        if not parte:
+            continue
+        if productos and not parte[0].isupper():
+            productos[-1] += f", {parte}"
+        else:
+            productos.append(parte)
+    return productos
+
+class DiccionarioProductos:
+    """
+    Codifica cada producto distinto con un ID corto (P1, P2...): las filas de los clientes viajan
+    como listas de IDs y cada petición lleva la leyenda de los productos que cita.
+    Los más frecuentes reciben los IDs más cortos.
+    """
+
+    def __init__(self, productos):
+        frecuencias = Counter(productos)
+        self.ids = {
+            producto: f"{PREFIJO_ID}{i}"
+            for i, (producto, _) in enumerate(frecuencias.most_common(), start=1)
+        }
+        self.productos = {id_producto: producto for producto, id_producto in self.ids.items()}
+        self._patron_ids = re.compile(rf"\b{PREFIJO_ID}\d+\b")
+
+    @classmethod
+    def desde_textos(cls, textos):
+        """Diccionario a partir de las listas de productos (texto) de todos los clientes"""
+        return cls([producto for texto in textos for producto in separar_productos(texto)])
+
+    def linea_leyenda(self, producto):
+        return f"{self.ids[producto]}={producto}"
+
+    def leyenda(self, productos=None):
+        """Una línea ID=producto por producto, en orden de ID; con productos, solo esos"""
+        if productos is None:
+            productos = self.ids
+        ordenados = sorted(set(productos), key=lambda producto: int(self.ids[producto][len(PREFIJO_ID):]))
+        return "\n".join(self.linea_leyenda(producto) for producto in ordenados)
+
+    def codificar(self, texto):
+        """Lista de productos -> "P3 P1 P7" (los productos desconocidos se dejan tal cual)"""
+        return " ".join(self.ids.get(producto, producto) for producto in separar_productos(texto))
+
+    def decodificar(self, texto):
+        """Reemplaza los IDs que aparezcan en un texto del modelo por el nombre del producto"""
+        return self._patron_ids.sub(lambda m: self.productos.get(m.group(0), m.group(0)), texto or "")
+
+def comparar_tokens(originales, comprimidos, modelo):
+    """
+    Tokens de entrada con y sin compresión, sumados sobre los textos de cada petición.
+    Se cuentan en lote con el tokenizador local o el estimador: nunca se envía el corpus a Ollama.
+    Devuelve {"original", "comprimido", "ahorro", "porcentaje"}
+    """
+    tokens_original = sum(contador_tokens.contar_tokens_lote(originales, modelo))
+    tokens_comprimido = sum(contador_tokens.contar_tokens_lote(comprimidos, modelo))
+    ahorro = tokens_original - tokens_comprimido
+    return {
+        "original": tokens_original,
+        "comprimido": tokens_comprimido,
+        "ahorro": ahorro,
+        "porcentaje": 100 * ahorro / tokens_original if tokens_original else 0.0,
+    }
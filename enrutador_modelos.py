@@ -0,0 +1,166 @@
+import re
+import threading
+from collections import deque
+import configuracion
+import cliente_ollama
+import metricas
+
+# Modelos candidatos; a igual tamaño, el orden de la lista decide cuál es más barato
+OLLAMA_MODELOS = [m.strip() for m in configuracion.obtener("OLLAMA_MODELOS", "llama3,llama3:instruct").split(",") if m.strip()]
+OLLAMA_SLO_S = float(configuracion.obtener("OLLAMA_SLO_S", "60"))  # latencia máxima aceptable por petición
+CONTEXTO_DEFECTO = int(configuracion.obtener("OLLAMA_CONTEXTO_DEFECTO", "8000"))  # si /api/show no responde
+# Techo del num_ctx que se pide: el KV cache crece con él aunque el modelo admita mucho más
+CONTEXTO_MAXIMO = int(configuracion.obtener("OLLAMA_CONTEXTO_MAXIMO", "8192"))
+VENTANA_OBSERVACIONES = 50
+
+_infos = {}  # modelo -> respuesta de /api/show; solo las consultas que salieron bien
+_lock_infos = threading.Lock()
+
+def _info_modelo(modelo):
+    """
+    Respuesta de /api/show para el modelo (una sola consulta por proceso).
+    Un fallo no se guarda: la siguiente llamada vuelve a consultar
+    """
+    with _lock_infos:
+        if modelo in _infos:
+            return _infos[modelo]
+    info = cliente_ollama.solicitud("/api/show", {"model": modelo}, usar_cache=False)
+    if info is None:
+        return {}
+    with _lock_infos:
+        _infos[modelo] = info
+    return info
+
+def contexto_modelo(modelo):
+    """
+    Contexto real del modelo según /api/show (context_length de su arquitectura),
+    limitado por CONTEXTO_MAXIMO
+    """
+    if not modelo:
+        return CONTEXTO_DEFECTO
+    info = _info_modelo(modelo).get("model_info") or {}
+    contextos = [valor for clave, valor in info.items() if clave.endswith(".context_length")]
+    if not contextos:
+        return CONTEXTO_DEFECTO
+    return min(int(contextos[0]), CONTEXTO_MAXIMO)
+
+def tamano_modelo(modelo):
+    """
+    Parámetros del modelo en miles de millones (p. ej. "8.0B" -> 8.0), o None si se desconoce
+    """
+    tamano = (_info_modelo(modelo).get("details") or {}).get("parameter_size", "")
+    coincidencia = re.match(r"([\d.]+)\s*([BM])", tamano, re.IGNORECASE)
+    if not coincidencia:
+        return None
+    valor = float(coincidencia.group(1))
+    return valor / 1000 if coincidencia.group(2).upper() == "M" else valor
+
+class Enrutador:
+    """
+    Elige el modelo más barato que admite la entrada más la salida pedida dentro del SLO de latencia.
+    La latencia se estima con la velocidad de evaluación y de generación observadas
+    en las últimas llamadas a cada modelo.
+    """
+
+    def __init__(self, modelos=None, slo_s=OLLAMA_SLO_S):
+        self.modelos = list(modelos or OLLAMA_MODELOS)
+        self.slo_s = slo_s
+        self._lock = threading.Lock()
+        self._observaciones = {}  # modelo -> deque de (s/token prompt, s/token salida, s fijos)
+
+    def observar(self, modelo, respuesta, cliente_s):
+        """Registra los tiempos de una respuesta de Ollama (se suscribe a metricas)"""
+        if not modelo or not respuesta or not respuesta.get("eval_count"):
+            return
+        prompt_s = respuesta.get("prompt_eval_duration", 0) / 1e9
+        eval_s = respuesta.get("eval_duration", 0) / 1e9
+        por_token_prompt = prompt_s / respuesta["prompt_eval_count"] if respuesta.get("prompt_eval_count") else None
+        por_token_salida = eval_s / respuesta["eval_count"]
+        fijo = max(0.0, cliente_s - prompt_s - eval_s)  # red, cola y carga del modelo
+        with self._lock:
+            ventana = self._observaciones.setdefault(modelo, deque(maxlen=VENTANA_OBSERVACIONES))
+            ventana.append((por_token_prompt, por_token_salida, fijo))
+
+    def rendimiento(self, modelo):
+        """
+        Promedio móvil: {"tokens_por_s", "prompt_tokens_por_s", "fijo_s", "muestras"} o None sin datos
+        """
+        with self._lock:
+            ventana = list(self._observaciones.get(modelo, ()))
+        if not ventana:
+            return None
+        prompt = [p for p, _, _ in ventana if p]
+        salida = sum(s for _, s, _ in ventana) / len(ventana)
+        return {
+            "tokens_por_s": 1 / salida if salida else None,
+            "prompt_tokens_por_s": len(prompt) / sum(prompt) if prompt and sum(prompt) else None,
+            "fijo_s": sum(f for _, _, f in ventana) / len(ventana),
+            "muestras": len(ventana),
+        }
+
+    def latencia_estimada(self, modelo, tokens_entrada, tokens_salida):
+        """Segundos estimados para la petición, o None si aún no hay observaciones del modelo"""
+        datos = self.rendimiento(modelo)
+        if datos is None or not datos["tokens_por_s"]:
+            return None
+        latencia = datos["fijo_s"] + tokens_salida / datos["tokens_por_s"]
+        if datos["prompt_tokens_por_s"]:
+            latencia += tokens_entrada / datos["prompt_tokens_por_s"]
+        return latencia
+
+    def _costo(self, modelo):
+        tamano = tamano_modelo(modelo)
+        return (tamano if tamano is not None else float("inf"), self.modelos.index(modelo))
+
+    def contexto_maximo(self):
+        """Mayor contexto entre los modelos candidatos"""
+        return max(contexto_modelo(m) for m in self.modelos)
+
+    def admisibles(self, tokens_entrada, tokens_salida):
+        """Modelos cuyo contexto admite la petición, del más barato al más caro"""
+        necesario = tokens_entrada + tokens_salida
+        return [m for m in sorted(self.modelos, key=self._costo) if contexto_modelo(m) >= necesario]
+
+    def elegir(self, tokens_entrada, tokens_salida, slo_s=None):
+        """
+        Devuelve (modelo, contexto). Entre los modelos cuyo contexto admite la petición,
+        el más barato que cumple el SLO; un modelo sin observaciones se da por bueno.
+        Si ninguno cumple, el más rápido de los que caben. Si no cabe en ninguno,
+        el de mayor contexto: quien llama debe dividir la entrada.
+        """
+        slo_s = self.slo_s if slo_s is None else slo_s
+        caben = self.admisibles(tokens_entrada, tokens_salida)
+
+        if not caben:
+            modelo = max(self.modelos, key=contexto_modelo)
+            return modelo, contexto_modelo(modelo)
+
+        estimadas = {m: self.latencia_estimada(m, tokens_entrada, tokens_salida) for m in caben}
+        for modelo in caben:
+            if estimadas[modelo] is None or estimadas[modelo] <= slo_s:
+                return modelo, contexto_modelo(modelo)
+
+        modelo = min(caben, key=lambda m: estimadas[m])
+        return modelo, contexto_modelo(modelo)
+
+_enrutador = None
+_lock_enrutador = threading.Lock()
+
+def obtener_enrutador():
+    """
+    Enrutador compartido; observa todas las llamadas a Ollama a través de metricas
+    """
+    global _enrutador
+    if _enrutador is None:
+        with _lock_enrutador:
+            if _enrutador is None:
+                _enrutador = Enrutador()
+                metricas.suscribir(_enrutador.observar)
+    return _enrutador
+
+if __name__ == "__main__":
+    enrutador = obtener_enrutador()
+    for modelo in enrutador.modelos:
+        tamano = tamano_modelo(modelo)
+        print(f"{modelo}: contexto {contexto_modelo(modelo)}, "
+              f"{f'{tamano}B parámetros' if tamano else 'tamaño desconocido'}")
@@ -0,0 +1,101 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import configuracion
+import cliente_ollama
+import metricas
+
+OLLAMA_KEEP_ALIVE = configuracion.obtener("OLLAMA_KEEP_ALIVE", "10m")  # trabajos por lotes
+
+# Cuánto tiempo se mantiene el modelo en memoria según el tipo de trabajo
+KEEP_ALIVE_TRABAJO = {
+    "interactivo": "30m",  # el usuario puede volver en cualquier momento
+    # Más que los 5m por defecto de Ollama: cubre el backoff de la cola, los reintentos
+    # y el paso de una etapa a la siguiente (o la reanudación de un trabajo) sin recargar
+    "lote": OLLAMA_KEEP_ALIVE,
+    "puntual": "1m",  # una sola petición: la memoria se libera enseguida
+}
+
+_lock = threading.Lock()
+_precargados = {}  # modelo -> load_duration (s) de la precarga
+
+def modelos_por_nodo():
+    """
+    {url: modelos en memoria} de los nodos sanos según /api/ps. La consulta también actualiza
+    lo que el balanceador sabe de cada nodo
+    """
+    balanceo = cliente_ollama.balanceador()
+    balanceo.verificar()
+    return {nodo["url"]: set(nodo["modelos"]) for nodo in balanceo.estado() if nodo["sano"]}
+
+def modelos_cargados():
+    """
+    Modelos que Ollama tiene en memoria ahora mismo en algún nodo (/api/ps)
+    """
+    return set().union(*modelos_por_nodo().values())
+
+@metricas.etiquetado("gestor_modelos", "precarga")
+def _precargar_en(url, modelo, keep_alive, embeddings):
+    # Una petición sin prompt (o sin entradas) solo carga el modelo en ese nodo
+    inicio = time.perf_counter()
+    if embeddings:
+        payload = {"model": modelo, "input": [], "keep_alive": keep_alive}
+        respuesta = cliente_ollama.solicitud("/api/embed", payload, usar_cache=False, url=url)
+    else:
+        payload = {"model": modelo, "keep_alive": keep_alive}
+        respuesta = cliente_ollama.solicitud("/api/generate", payload, usar_cache=False, url=url)
+    if respuesta is None:
+        print(f"No se pudo precargar {modelo} en {url}")
+        return None
+    print(f"Modelo {modelo} listo en {url} en {time.perf_counter() - inicio:.2f}s (keep_alive {keep_alive})")
+    return respuesta.get("load_duration", 0) / 1e9
+
+def precargar(modelo, trabajo="lote", embeddings=False, urls=None):
+    """
+    Carga el modelo en memoria en cada nodo (o en los de urls) antes de usarlo, y fija su keep_alive
+    para el tipo de trabajo: así el balanceador puede repartir las peticiones sin arranques en frío.
+    Devuelve el mayor load_duration en segundos, o None si no se cargó en ningún nodo
+    """
+    keep_alive = KEEP_ALIVE_TRABAJO.get(trabajo, OLLAMA_KEEP_ALIVE)
+    cliente_ollama.definir_keep_alive(modelo, keep_alive)
+
+    urls = list(urls or cliente_ollama.nodos())
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        cargas = [c for c in executor.map(lambda url: _precargar_en(url, modelo, keep_alive, embeddings), urls)
+                  if c is not None]
+    if not cargas:
+        return None
+
+    carga = max(cargas)
+    with _lock:
+        _precargados[modelo] = carga
+    return carga
+
+def asegurar_cargados(modelos, trabajo="lote", embeddings=False):
+    """
+    Precarga cada modelo en los nodos sanos que no lo tienen en memoria (con embeddings, por /api/embed)
+    """
+    por_nodo = modelos_por_nodo()
+    for modelo in dict.fromkeys(modelos):
+        faltan = [url for url, cargados in por_nodo.items() if modelo not in cargados]
+        if faltan:
+            precargar(modelo, trabajo, embeddings, urls=faltan)
+        else:
+            cliente_ollama.definir_keep_alive(modelo, KEEP_ALIVE_TRABAJO.get(trabajo, OLLAMA_KEEP_ALIVE))
+
+def liberar(modelo):
+    """Descarga el modelo de memoria (keep_alive 0)"""
+    cliente_ollama.definir_keep_alive(modelo, None)
+    return cliente_ollama.solicitud("/api/generate", {"model": modelo, "keep_alive": 0}, usar_cache=False)
+
+def estadisticas():
+    """
+    Precargas hechas por este proceso y arranques en frío observados en las llamadas
+    """
+    with _lock:
+        precargas = dict(_precargados)
+    return {"precargas": precargas, "arranques_frio": metricas.arranques_frio()}
+
+if __name__ == "__main__":
+    cargados = modelos_cargados()
+    print("Modelos en memoria:", ", ".join(sorted(cargados)) or "(ninguno)")
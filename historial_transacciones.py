@@ -0,0 +1,246 @@
+import os
+import json
+import argparse
+import threading
+import configuracion
+import prefiltro_fraude
+
+OLLAMA_HISTORIAL_RUTA = configuracion.obtener("OLLAMA_HISTORIAL_RUTA", ".cache_ollama/historial")
+MAX_CIUDADES_RESUMEN = 3
+MAX_FILAS_RESUMEN = 1000  # El resumen usa las transacciones más recientes de la cuenta
+
+ARCHIVO_DATOS = "transacciones.bin"
+ARCHIVO_DICCIONARIOS = "diccionarios.json"
+# Columnas con pocos valores distintos: se guardan como código entero y su texto en un diccionario
+CATEGORICAS = ("cuenta", "establecimiento", "ciudad")
+COLUMNA_ESTABLECIMIENTO = "Establecimiento"
+
+def _dtype():
+    import numpy as np
+    return np.dtype([
+        ("id", "S32"), ("cuenta", "<i4"), ("establecimiento", "<i4"), ("ciudad", "<i4"),
+        ("horario", "<M8[s]"), ("valor", "<f8"),
+    ])
+
+class HistorialTransacciones:
+    """
+    Almacén columnar de transacciones pasadas: registros NumPy de tamaño fijo en un archivo
+    que solo crece (los lotes nuevos se agregan al final, nunca se reescribe) y se lee con memmap.
+    Los índices por cuenta, establecimiento y ciudad se construyen vectorizados al abrir
+    o cuando el archivo creció, y cada consulta es una búsqueda binaria.
+    """
+
+    def __init__(self, directorio=OLLAMA_HISTORIAL_RUTA):
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        self._ruta_datos = os.path.join(directorio, ARCHIVO_DATOS)
+        self._ruta_diccionarios = os.path.join(directorio, ARCHIVO_DICCIONARIOS)
+        self._lock = threading.RLock()
+        try:
+            with open(self._ruta_diccionarios, "r", encoding="utf-8") as archivo:
+                guardado = json.load(archivo)
+        except (IOError, json.JSONDecodeError):
+            guardado = {}
+        self._valores = {columna: guardado.get(columna, []) for columna in CATEGORICAS}
+        self._codigos = {columna: {v: i for i, v in enumerate(valores)} for columna, valores in self._valores.items()}
+        self._datos = None
+        self._indices = {}
+        self._ids = None  # IDs guardados, ordenados; se mantienen al agregar sin volver a ordenar
+
+    def _codigo(self, columna, valor):
+        codigos = self._codigos[columna]
+        if valor not in codigos:
+            codigos[valor] = len(self._valores[columna])
+            self._valores[columna].append(valor)
+        return codigos[valor]
+
+    def _guardar_diccionarios(self):
+        temporal = f"{self._ruta_diccionarios}.tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump(self._valores, archivo, ensure_ascii=False)
+        os.replace(temporal, self._ruta_diccionarios)
+
+    def agregar(self, filas):
+        """
+        Agrega un lote de transacciones (dicts como los de prefiltro_fraude) al final del almacén.
+        Las transacciones cuyo ID ya está guardado (o repetido en el lote) se omiten, así los archivos
+        que se solapan no duplican filas. Devuelve la cantidad de filas agregadas
+        """
+        import numpy as np
+        filas = list(filas)
+        if not filas:
+            return 0
+        ids = np.array([str(f[prefiltro_fraude.COLUMNA_ID]).encode("utf-8")[:32] for f in filas], dtype="S32")
+
+        with self._lock:
+            # Primera aparición de cada ID en el lote, en orden, sin los que ya están guardados
+            _, primeras = np.unique(ids, return_index=True)
+            nuevas = np.sort(primeras)
+            guardados = self._ids_guardados()
+            posiciones = np.minimum(np.searchsorted(guardados, ids[nuevas]), max(len(guardados) - 1, 0))
+            if len(guardados):
+                nuevas = nuevas[guardados[posiciones] != ids[nuevas]]
+            filas = [filas[i] for i in nuevas]
+            if not filas:
+                return 0
+
+            registros = np.empty(len(filas), dtype=_dtype())
+            registros["id"] = ids[nuevas]
+            registros["cuenta"] = [
+                self._codigo("cuenta", prefiltro_fraude.cuenta_de(f[prefiltro_fraude.COLUMNA_ID])) for f in filas
+            ]
+            registros["establecimiento"] = [
+                self._codigo("establecimiento", str(f.get(COLUMNA_ESTABLECIMIENTO, ""))) for f in filas
+            ]
+            registros["ciudad"] = [self._codigo("ciudad", str(f[prefiltro_fraude.COLUMNA_CIUDAD])) for f in filas]
+            registros["horario"] = [f[prefiltro_fraude.COLUMNA_HORARIO] for f in filas]
+            registros["valor"] = [float(f[prefiltro_fraude.COLUMNA_VALOR]) for f in filas]
+
+            # Primero los diccionarios: un registro nunca apunta a un código que no se guardó
+            self._guardar_diccionarios()
+            with open(self._ruta_datos, "ab") as archivo:
+                archivo.write(registros.tobytes())
+            self._datos = None
+            nuevos_ids = np.sort(registros["id"])
+            self._ids = np.insert(guardados, np.searchsorted(guardados, nuevos_ids), nuevos_ids)
+        return len(filas)
+
+    def _ids_guardados(self):
+        """IDs guardados, ordenados, para buscar duplicados con búsqueda binaria"""
+        import numpy as np
+        datos = self.datos()
+        with self._lock:
+            if self._ids is None or len(self._ids) != len(datos):
+                self._ids = np.sort(datos["id"])
+            return self._ids
+
+    def datos(self):
+        """Todos los registros (memmap de solo lectura; vacío si no hay historial)"""
+        import numpy as np
+        with self._lock:
+            tamano = os.path.getsize(self._ruta_datos) if os.path.exists(self._ruta_datos) else 0
+            cantidad = tamano // _dtype().itemsize
+            if self._datos is None or len(self._datos) != cantidad:
+                if cantidad == 0:
+                    self._datos = np.empty(0, dtype=_dtype())
+                else:
+                    self._datos = np.memmap(self._ruta_datos, dtype=_dtype(), mode="r", shape=(cantidad,))
+                self._indices = {}
+            return self._datos
+
+    def _indice(self, columna):
+        """
+        (códigos, horarios, posiciones) ordenados por código y, dentro de cada código, por horario:
+        las filas de un código son un tramo contiguo y cronológico
+        """
+        import numpy as np
+        datos = self.datos()
+        with self._lock:
+            if columna not in self._indices:
+                posiciones = np.lexsort((datos["horario"], datos[columna]))
+                self._indices[columna] = (
+                    np.ascontiguousarray(datos[columna][posiciones]),
+                    np.ascontiguousarray(datos["horario"][posiciones]),
+                    posiciones,
+                )
+            return self._indices[columna]
+
+    def _filas(self, columna, valor, antes_de=None, ultimas=None):
+        import numpy as np
+        codigo = self._codigos[columna].get(valor)
+        datos = self.datos()
+        if codigo is None or len(datos) == 0:
+            return datos[:0]
+        codigos, horarios, posiciones = self._indice(columna)
+        # Búsquedas binarias con el mismo dtype del índice (sin copiar el arreglo)
+        inicio, fin = np.searchsorted(codigos, np.array([codigo, codigo + 1], dtype=codigos.dtype))
+        if antes_de is not None:
+            fin = inicio + np.searchsorted(horarios[inicio:fin], np.datetime64(antes_de, "s"))
+        if ultimas is not None:
+            inicio = max(inicio, fin - ultimas)
+        return datos[posiciones[inicio:fin]]
+
+    def por_cuenta(self, cuenta, antes_de=None, ultimas=None):
+        """
+        Transacciones de la cuenta en orden cronológico; opcionalmente solo las anteriores
+        a antes_de y, de ellas, las últimas
+        """
+        return self._filas("cuenta", cuenta, antes_de, ultimas)
+
+    def por_establecimiento(self, establecimiento, antes_de=None, ultimas=None):
+        return self._filas("establecimiento", establecimiento, antes_de, ultimas)
+
+    def por_ciudad(self, ciudad, antes_de=None, ultimas=None):
+        return self._filas("ciudad", ciudad, antes_de, ultimas)
+
+    def resumen_cuenta(self, cuenta, antes_de=None):
+        """
+        Resumen de las últimas MAX_FILAS_RESUMEN transacciones de la cuenta: cantidad, valor medio
+        y máximo, ciudades más frecuentes, última transacción e intervalo mediano.
+        None si no hay historial
+        """
+        import numpy as np
+        filas = self.por_cuenta(cuenta, antes_de, MAX_FILAS_RESUMEN)
+        if len(filas) == 0:
+            return None
+        codigos, conteos = np.unique(filas["ciudad"], return_counts=True)
+        frecuentes = np.argsort(-conteos, kind="stable")[:MAX_CIUDADES_RESUMEN]
+        intervalos = np.diff(filas["horario"]).astype("int64")
+        return {
+            "transacciones": len(filas),
+            "valor_medio": float(filas["valor"].mean()),
+            "valor_max": float(filas["valor"].max()),
+            "ciudades": [(self._valores["ciudad"][codigos[i]], int(conteos[i])) for i in frecuentes],
+            "ultima_horario": str(filas["horario"][-1]).replace("T", " "),
+            "ultima_ciudad": self._valores["ciudad"][filas["ciudad"][-1]],
+            "intervalo_mediano_s": int(np.median(intervalos)) if len(intervalos) else None,
+        }
+
+    def texto_resumen(self, cuenta, antes_de=None):
+        """Una línea compacta para el prompt, o None sin historial"""
+        resumen = self.resumen_cuenta(cuenta, antes_de)
+        if resumen is None:
+            return None
+        total = resumen["transacciones"]
+        ciudades = ", ".join(f"{ciudad} {100 * n // total}%" for ciudad, n in resumen["ciudades"])
+        texto = (
+            f"Cuenta {cuenta}: últimas {total} transacciones, valor medio {resumen['valor_medio']:.2f} USD "
+            f"(máx {resumen['valor_max']:.2f}); ciudades: {ciudades}; "
+            f"última: {resumen['ultima_horario']} en {resumen['ultima_ciudad']}"
+        )
+        if resumen["intervalo_mediano_s"] is not None:
+            texto += f"; intervalo mediano {resumen['intervalo_mediano_s'] // 60} min"
+        return texto
+
+    def estadisticas(self):
+        return {
+            "transacciones": len(self.datos()),
+            "cuentas": len(self._valores["cuenta"]),
+            "establecimientos": len(self._valores["establecimiento"]),
+            "ciudades": len(self._valores["ciudad"]),
+        }
+
+_historial = None
+_lock_historial = threading.Lock()
+
+def obtener_historial():
+    """Almacén compartido del proceso"""
+    global _historial
+    if _historial is None:
+        with _lock_historial:
+            if _historial is None:
+                _historial = HistorialTransacciones()
+    return _historial
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Historial columnar de transacciones")
+    parser.add_argument("archivos", nargs="*", help="CSV o JSON de transacciones a agregar")
+    parser.add_argument("--cuenta", action="append", default=[], help="Muestra el resumen de una cuenta")
+    args = parser.parse_args()
+
+    historial = obtener_historial()
+    for ruta in args.archivos:
+        print(f"{ruta}: {historial.agregar(prefiltro_fraude.iterar_filas(ruta))} transacción(es) agregadas")
+    for cuenta in args.cuenta:
+        print(historial.texto_resumen(cuenta) or f"Cuenta {cuenta}: sin historial")
+    print(historial.estadisticas())
@@ -0,0 +1,84 @@
+import threading
+import numpy as np
+import configuracion
+import cliente_ollama
+import metricas
+
+OLLAMA_EMBED_MODEL = configuracion.obtener("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+
+UMBRAL_MARGEN = 0.05  # Diferencia mínima de similitud entre la 1ª y 2ª categoría
+TAMANO_LOTE_EMBED = 64
+
+def _normalizar(matriz):
+    normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return matriz / normas
+
+class IndiceCategorias:
+    """
+    Índice de categorías en memoria: embeddings normalizados en una matriz NumPy
+    y búsqueda del vecino más cercano por similitud coseno vectorizada
+    """
+
+    def __init__(self, categorias, modelo=OLLAMA_EMBED_MODEL, umbral_margen=UMBRAL_MARGEN):
+        self.categorias = list(categorias)
+        self.modelo = modelo
+        self.umbral_margen = umbral_margen
+        self._productos = {}  # producto -> embedding normalizado
+        self._lock = threading.Lock()
+
+        matriz = self._embeber([f"Categoría de producto: {c}" for c in self.categorias])
+        if matriz is None:
+            raise RuntimeError("No se pudieron obtener los embeddings de las categorías")
+        self._matriz = _normalizar(matriz)
+
+    @metricas.etiquetado("indice_categorias", "embeddings")
+    def _embeber(self, textos):
+        """Embeddings de una lista de textos, en lotes. None si falló alguna llamada"""
+        filas = []
+        for inicio in range(0, len(textos), TAMANO_LOTE_EMBED):
+            lote = textos[inicio:inicio + TAMANO_LOTE_EMBED]
+            respuesta = cliente_ollama.embed(lote, self.modelo)
+            if not respuesta or len(respuesta.get("embeddings", [])) != len(lote):
+                return None
+            filas.extend(respuesta["embeddings"])
+        return np.asarray(filas, dtype=np.float32)
+
+    def _embeddings_productos(self, productos):
+        faltantes = [p for p in dict.fromkeys(productos) if p not in self._productos]
+        if faltantes:
+            matriz = self._embeber([f"Producto: {p}" for p in faltantes])
+            if matriz is not None:
+                with self._lock:
+                    for producto, vector in zip(faltantes, _normalizar(matriz)):
+                        self._productos[producto] = vector
+
+        return [self._productos.get(p) for p in productos]
+
+    def buscar(self, productos):
+        """
+        Devuelve [(categoría, margen)] por producto; categoría es None cuando el margen
+        no supera el umbral de confianza o no hubo embedding.
+        """
+        vectores = self._embeddings_productos(productos)
+        validos = [i for i, vector in enumerate(vectores) if vector is not None]
+        resultados = [(None, 0.0)] * len(productos)
+        if not validos:
+            return resultados
+
+        similitudes = np.stack([vectores[i] for i in validos]) @ self._matriz.T
+        mejor = similitudes.argmax(axis=1)
+        if similitudes.shape[1] > 1:
+            # Margen entre la categoría más similar y la segunda
+            dos_mayores = np.partition(similitudes, -2, axis=1)[:, -2:]
+            margen = dos_mayores[:, 1] - dos_mayores[:, 0]
+        else:
+            margen = np.ones(len(validos))
+
+        for fila, i in enumerate(validos):
+            margen_fila = float(margen[fila])
+            if margen_fila >= self.umbral_margen:
+                resultados[i] = (self.categorias[mejor[fila]], margen_fila)
+            else:
+                resultados[i] = (None, margen_fila)
+        return resultados
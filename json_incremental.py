@@ -0,0 +1,84 @@
+import re
+import json
+
+class ParserArrayJSON:
+    """
+    Extrae los objetos de un array JSON ({"clave": [{...}, {...}]} o un array en la raíz)
+    a medida que llega el texto. Cada objeto se entrega en cuanto se cierra su llave,
+    así que una respuesta truncada conserva todos los objetos completos.
+    """
+
+    def __init__(self, clave):
+        self._patron = re.compile(r'"%s"\s*:\s*\[' % re.escape(clave))
+        self._buffer = ""
+        self._pos = 0
+        self._en_array = False
+        self.terminado = False
+        self._profundidad = 0
+        self._en_cadena = False
+        self._escape = False
+        self._inicio = None  # posición de la llave que abre el objeto actual
+
+    def _buscar_array(self):
+        coincidencia = self._patron.search(self._buffer)
+        if coincidencia:
+            self._pos = coincidencia.end()
+        elif self._buffer.lstrip().startswith("["):
+            self._pos = self._buffer.index("[") + 1
+        else:
+            return False
+        self._en_array = True
+        return True
+
+    def alimentar(self, texto):
+        """
+        Agrega un fragmento de texto. Devuelve la lista de objetos que se completaron con él
+        """
+        self._buffer += texto
+        objetos = []
+        if self.terminado or (not self._en_array and not self._buscar_array()):
+            return objetos
+
+        buffer = self._buffer
+        while self._pos < len(buffer) and not self.terminado:
+            caracter = buffer[self._pos]
+            if self._en_cadena:
+                if self._escape:
+                    self._escape = False
+                elif caracter == "\\":
+                    self._escape = True
+                elif caracter == '"':
+                    self._en_cadena = False
+            elif caracter == '"':
+                self._en_cadena = True
+            elif caracter == "{":
+                if self._profundidad == 0:
+                    self._inicio = self._pos
+                self._profundidad += 1
+            elif caracter == "}" and self._profundidad > 0:
+                self._profundidad -= 1
+                if self._profundidad == 0:
+                    try:
+                        objetos.append(json.loads(buffer[self._inicio:self._pos + 1]))
+                    except json.JSONDecodeError as e:
+                        print(f"Objeto JSON inválido en el stream: {e}")
+                    self._inicio = None
+            elif caracter == "]" and self._profundidad == 0:
+                self.terminado = True
+            self._pos += 1
+
+        # Solo se conserva el objeto que aún no se cerró
+        corte = self._inicio if self._inicio is not None else self._pos
+        self._buffer = buffer[corte:]
+        self._pos -= corte
+        if self._inicio is not None:
+            self._inicio = 0
+        return objetos
+
+def iterar_objetos(fragmentos, clave):
+    """
+    Genera los objetos del array "clave" a partir de un iterable de fragmentos de texto
+    """
+    parser = ParserArrayJSON(clave)
+    for fragmento in fragmentos:
+        yield from parser.alimentar(fragmento)
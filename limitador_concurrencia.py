@@ -0,0 +1,124 @@
+import math
+import time
+import threading
+import configuracion
+
+OLLAMA_CONCURRENCIA_ADAPTATIVA = configuracion.obtener("OLLAMA_CONCURRENCIA_ADAPTATIVA", "1") != "0"
+OLLAMA_CONCURRENCIA_INICIAL = float(configuracion.obtener("OLLAMA_CONCURRENCIA_INICIAL", "4"))
+OLLAMA_CONCURRENCIA_MAX = float(configuracion.obtener("OLLAMA_CONCURRENCIA_MAX", "32"))
+CONCURRENCIA_MIN = 1.0
+
+TOLERANCIA = 1.5  # Latencia corta admitida sobre la larga antes de reducir el límite
+SUAVIZADO = 0.2  # Peso de cada ajuste sobre el límite vigente
+ALFA_CORTA = 0.3  # Promedio móvil de las últimas respuestas
+ALFA_LARGA = 0.02  # Promedio móvil de referencia, lento
+REDUCCION_ERROR = 0.5  # Disminución multiplicativa ante timeouts, errores de conexión, 429 y 5xx
+PESO_TOKEN_PROMPT = 0.1  # Un token de prompt cuesta bastante menos que uno generado
+
+def latencia_normalizada(cliente_s, respuesta):
+    """
+    Segundos por token equivalente: la latencia de una petición depende de cuántos tokens
+    procesa, así que se compara la latencia por token y no la latencia cruda.
+    La carga del modelo no cuenta (un arranque en frío no es congestión)
+    """
+    respuesta = respuesta or {}
+    segundos = max(0.0, cliente_s - respuesta.get("load_duration", 0) / 1e9)
+    tokens = respuesta.get("eval_count", 0) + PESO_TOKEN_PROMPT * respuesta.get("prompt_eval_count", 0)
+    return segundos / max(1.0, tokens)
+
+class Permiso:
+    """Lugar en vuelo concedido por el limitador; liberar() lo devuelve una sola vez"""
+
+    def __init__(self, limitador):
+        self.limitador = limitador
+        self.inicio = time.perf_counter()
+        self._liberado = False
+
+    def liberar(self, respuesta=None, error=False):
+        if self._liberado:
+            return
+        self._liberado = True
+        self.limitador._liberar(self, respuesta, error)
+
+class LimitadorAdaptativo:
+    """
+    Limita las peticiones en vuelo a Ollama con un límite que se ajusta solo:
+    - Gradiente: si la latencia reciente (por token) supera a la de referencia, el límite baja
+      en proporción; si se mantiene, sube de a poco (raíz del límite) para explorar más paralelismo
+    - AIMD: cada señal de sobrecarga (timeout, error de conexión, 429 o 5xx) lo reduce a la mitad;
+      los demás errores no lo mueven
+    Quien supera el límite espera en adquirir(): la presión vuelve a los productores.
+    """
+
+    def __init__(self, inicial=OLLAMA_CONCURRENCIA_INICIAL, maximo=OLLAMA_CONCURRENCIA_MAX, minimo=CONCURRENCIA_MIN):
+        self.minimo = minimo
+        self.maximo = maximo
+        self.limite = min(max(inicial, minimo), maximo)
+        self.en_vuelo = 0
+        self.en_cola = 0
+        self._corta = None
+        self._larga = None
+        self._condicion = threading.Condition()
+        self._ajustes = {"aumentos": 0, "reducciones": 0, "errores": 0}
+
+    def adquirir(self):
+        """Espera un lugar en vuelo y devuelve su Permiso"""
+        with self._condicion:
+            self.en_cola += 1
+            try:
+                while self.en_vuelo >= int(self.limite):
+                    self._condicion.wait()
+            finally:
+                self.en_cola -= 1
+            self.en_vuelo += 1
+        return Permiso(self)
+
+    def _liberar(self, permiso, respuesta, error):
+        cliente_s = time.perf_counter() - permiso.inicio
+        with self._condicion:
+            en_vuelo = self.en_vuelo
+            self.en_vuelo -= 1
+            if error:
+                self._ajustes["errores"] += 1
+                self._fijar(self.limite * REDUCCION_ERROR)
+            elif respuesta:
+                self._observar(latencia_normalizada(cliente_s, respuesta), en_vuelo)
+            self._condicion.notify_all()
+
+    def _observar(self, latencia, en_vuelo):
+        self._corta = latencia if self._corta is None else (1 - ALFA_CORTA) * self._corta + ALFA_CORTA * latencia
+        # La referencia solo aprende de respuestas sin congestión (o de las que viajaron solas):
+        # si aprendiera de todas, subiría junto con la cola y el límite nunca bajaría
+        if self._larga is None or en_vuelo <= 1 or latencia <= TOLERANCIA * self._larga:
+            self._larga = latencia if self._larga is None else (1 - ALFA_LARGA) * self._larga + ALFA_LARGA * latencia
+        # Si la carga bajó, la referencia se acerca rápido a la latencia actual
+        if self._larga > 2 * self._corta:
+            self._larga = 2 * self._corta
+        # Sin usar al menos la mitad del límite no hay evidencia para subirlo
+        if en_vuelo < self.limite / 2:
+            return
+
+        gradiente = max(0.5, min(1.0, TOLERANCIA * self._larga / self._corta)) if self._corta else 1.0
+        # Con la latencia dentro de la tolerancia se explora (sube la raíz del límite); si no, se baja en proporción
+        nuevo = self.limite + math.sqrt(self.limite) if gradiente >= 1.0 else self.limite * gradiente
+        self._fijar((1 - SUAVIZADO) * self.limite + SUAVIZADO * nuevo)
+
+    def _fijar(self, limite):
+        limite = min(max(limite, self.minimo), self.maximo)
+        if limite > self.limite:
+            self._ajustes["aumentos"] += 1
+        elif limite < self.limite:
+            self._ajustes["reducciones"] += 1
+        self.limite = limite
+
+    def estado(self):
+        """Límite vigente, peticiones en vuelo y en cola, latencias por token y ajustes"""
+        with self._condicion:
+            return {
+                "limite": int(self.limite),
+                "en_vuelo": self.en_vuelo,
+                "en_cola": self.en_cola,
+                "latencia_corta_s": self._corta,
+                "latencia_larga_s": self._larga,
+                **self._ajustes,
+            }
@@ -0,0 +1,62 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+SIN_CAMBIOS = "sin_cambios"
+AMPLIADO = "ampliado"  # Solo se agregaron reseñas al final del archivo
+COMPLETO = "completo"  # Archivo nuevo o modificado: se analiza completo
+
+def hash_texto(texto):
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+class Manifiesto:
+    """
+    Registro en disco de qué versión de cada archivo de entrada ya fue analizada:
+    hash del contenido, tamaño, versión del prompt y modelo
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        try:
+            with open(ruta, "r", encoding="utf-8") as archivo:
+                self._entradas = json.load(archivo)
+        except (IOError, json.JSONDecodeError):
+            self._entradas = {}
+
+    def estado(self, clave, contenido, version_prompt, modelo, ruta_salida):
+        """
+        Compara el contenido actual con el registrado.
+        Devuelve (estado, texto_previo): texto_previo es la parte ya analizada si el estado es AMPLIADO
+        """
+        entrada = self._entradas.get(clave)
+        if (entrada is None or not os.path.exists(ruta_salida)
+                or entrada["version_prompt"] != version_prompt or entrada["modelo"] != modelo):
+            return COMPLETO, None
+
+        datos = contenido.encode("utf-8")
+        if len(datos) == entrada["bytes"] and hash_texto(contenido) == entrada["hash"]:
+            return SIN_CAMBIOS, None
+
+        previo = datos[:entrada["bytes"]]
+        if len(datos) > entrada["bytes"] and hashlib.sha256(previo).hexdigest() == entrada["hash"]:
+            return AMPLIADO, previo.decode("utf-8", errors="ignore")
+
+        return COMPLETO, None
+
+    def registrar(self, clave, contenido, version_prompt, modelo):
+        """Marca el contenido como analizado y persiste el manifiesto"""
+        with self._lock:
+            self._entradas[clave] = {
+                "hash": hash_texto(contenido),
+                "bytes": len(contenido.encode("utf-8")),
+                "version_prompt": version_prompt,
+                "modelo": modelo,
+                "analizado": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            temporal = self.ruta + ".tmp"
+            with open(temporal, "w", encoding="utf-8") as archivo:
+                json.dump(self._entradas, archivo, indent=2, ensure_ascii=False)
+            os.replace(temporal, self.ruta)
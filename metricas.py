@@ -0,0 +1,189 @@
+import json
+import time
+import threading
+import contextvars
+from functools import wraps
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import configuracion
+
+OLLAMA_METRICAS_LOG = configuracion.obtener("OLLAMA_METRICAS_LOG")  # JSONL con una línea por llamada
+# Un load_duration por encima de este umbral significa que el modelo no estaba en memoria
+UMBRAL_ARRANQUE_FRIO_S = float(configuracion.obtener("OLLAMA_UMBRAL_ARRANQUE_FRIO", "0.5"))
+# Puerto del endpoint /metrics que abren los CLIs; vacío = no se sirve
+OLLAMA_METRICAS_PUERTO = configuracion.obtener("OLLAMA_METRICAS_PUERTO")
+
+# Campos de tiempo que Ollama devuelve en nanosegundos
+CAMPOS_DURACION = ["total_duration", "load_duration", "prompt_eval_duration", "eval_duration"]
+CAMPOS_CONTEO = ["prompt_eval_count", "eval_count"]
+
+_etiquetas = contextvars.ContextVar("etiquetas_metricas", default=("-", "-"))
+_agregados = {}
+_suscriptores = []
+_indicadores = {}  # nombre -> función que devuelve un dict con el estado actual
+_servidor = None
+_lock = threading.Lock()
+
+def etiquetado(modulo, tarea):
+    """
+    Decorador: las llamadas a Ollama hechas dentro de la función se etiquetan con módulo y tarea
+    """
+    def decorador(funcion):
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            token = _etiquetas.set((modulo, tarea))
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                _etiquetas.reset(token)
+        return envoltura
+    return decorador
+
+def suscribir(funcion):
+    """
+    funcion(modelo, respuesta, cliente_s) se llama tras cada respuesta real de Ollama
+    (no las servidas desde cache, las coalescidas ni los errores)
+    """
+    _suscriptores.append(funcion)
+
+def indicador(nombre, funcion):
+    """
+    Registra un estado instantáneo (no acumulado) que se expone como gauge:
+    funcion() devuelve un dict y cada campo numérico es ollama_{nombre}_{campo}
+    """
+    _indicadores[nombre] = funcion
+
+def indicadores():
+    """Estado actual de cada indicador registrado"""
+    return {nombre: funcion() for nombre, funcion in list(_indicadores.items())}
+
+def _nuevo_agregado():
+    agregado = {"solicitudes": 0, "errores": 0, "cache": 0, "coalescidas": 0, "arranques_frio": 0, "espera_s": 0.0, "red_s": 0.0, "cliente_s": 0.0}
+    agregado.update({campo: 0 for campo in CAMPOS_DURACION + CAMPOS_CONTEO})
+    return agregado
+
+def registrar(endpoint, modelo, respuesta=None, espera_s=0.0, cliente_s=0.0, error=False, cache=False,
+              coalescida=False):
+    """
+    Registra una llamada. respuesta es el JSON final de Ollama (o el último fragmento del stream).
+    espera_s es el tiempo en cola del cliente antes de enviar; cliente_s la duración HTTP completa.
+    El tiempo de red es cliente_s menos el total_duration que informa el servidor.
+    Con cache o coalescida la respuesta no la generó esta llamada: no suma tiempos del servidor.
+    """
+    modulo, tarea = _etiquetas.get()
+    respuesta = respuesta or {}
+    propia = not (cache or coalescida)
+    total_servidor_s = respuesta.get("total_duration", 0) / 1e9
+    red_s = max(0.0, cliente_s - total_servidor_s) if respuesta and propia else 0.0
+
+    with _lock:
+        agregado = _agregados.setdefault((modulo, tarea, modelo or "-", endpoint), _nuevo_agregado())
+        agregado["solicitudes"] += 1
+        agregado["errores"] += bool(error)
+        agregado["cache"] += bool(cache)
+        agregado["coalescidas"] += bool(coalescida)
+        agregado["espera_s"] += espera_s
+        agregado["red_s"] += red_s
+        agregado["cliente_s"] += cliente_s
+        if propia:
+            agregado["arranques_frio"] += respuesta.get("load_duration", 0) / 1e9 >= UMBRAL_ARRANQUE_FRIO_S
+            for campo in CAMPOS_DURACION + CAMPOS_CONTEO:
+                agregado[campo] += respuesta.get(campo, 0) or 0
+
+    if respuesta and propia and not error:
+        for funcion in _suscriptores:
+            funcion(modelo, respuesta, cliente_s)
+
+    if OLLAMA_METRICAS_LOG:
+        linea = {
+            "ts": time.time(), "modulo": modulo, "tarea": tarea, "modelo": modelo, "endpoint": endpoint,
+            "error": bool(error), "cache": bool(cache), "coalescida": bool(coalescida), "espera_s": espera_s, "red_s": red_s,
+            "cliente_s": cliente_s,
+        }
+        linea.update({campo: respuesta.get(campo) for campo in CAMPOS_DURACION + CAMPOS_CONTEO})
+        with _lock, open(OLLAMA_METRICAS_LOG, "a", encoding="utf-8") as archivo:
+            archivo.write(json.dumps(linea, ensure_ascii=False) + "\n")
+
+def resumen():
+    """
+    Agregados por (módulo, tarea, modelo, endpoint), con duraciones en segundos
+    """
+    filas = []
+    with _lock:
+        for (modulo, tarea, modelo, endpoint), agregado in _agregados.items():
+            fila = {"modulo": modulo, "tarea": tarea, "modelo": modelo, "endpoint": endpoint}
+            for campo, valor in agregado.items():
+                fila[campo.replace("_duration", "_s")] = valor / 1e9 if campo in CAMPOS_DURACION else valor
+            filas.append(fila)
+    return filas
+
+def arranques_frio():
+    """Arranques en frío (cargas del modelo en memoria) por modelo"""
+    conteo = {}
+    for fila in resumen():
+        conteo[fila["modelo"]] = conteo.get(fila["modelo"], 0) + fila["arranques_frio"]
+    return conteo
+
+def reiniciar():
+    with _lock:
+        _agregados.clear()
+
+def formato_prometheus():
+    """Exposición de texto de Prometheus con un contador por campo y los indicadores como gauges"""
+    lineas = []
+    for fila in resumen():
+        etiquetas = ",".join(f'{k}="{fila[k]}"' for k in ("modulo", "tarea", "modelo", "endpoint"))
+        for campo, valor in fila.items():
+            if campo in ("modulo", "tarea", "modelo", "endpoint"):
+                continue
+            lineas.append(f"ollama_{campo}_total{{{etiquetas}}} {valor}")
+    for nombre, estado in indicadores().items():
+        for campo, valor in estado.items():
+            if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                lineas.append(f"ollama_{nombre}_{campo} {valor}")
+    return "\n".join(lineas) + "\n"
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def log_message(self, formato, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            cuerpo, tipo = formato_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            cuerpo, tipo = json.dumps(resumen(), ensure_ascii=False).encode("utf-8"), "application/json"
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+def iniciar_servidor(puerto=9464):
+    """
+    Sirve /metrics (Prometheus) y /metrics.json en un hilo. Devuelve el servidor
+    """
+    servidor = ThreadingHTTPServer(("0.0.0.0", puerto), _ManejadorMetricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+def iniciar_si_configurado():
+    """
+    Arranca el servidor de métricas una sola vez si OLLAMA_METRICAS_PUERTO está definido.
+    Devuelve el servidor, o None si no está configurado o no se pudo abrir el puerto
+    """
+    global _servidor
+    if not OLLAMA_METRICAS_PUERTO:
+        return None
+    with _lock:
+        if _servidor is None:
+            try:
+                _servidor = iniciar_servidor(int(OLLAMA_METRICAS_PUERTO))
+            except (OSError, ValueError) as e:
+                print(f"No se pudo iniciar el servidor de métricas en el puerto {OLLAMA_METRICAS_PUERTO}: {e}")
+                return None
+            print(f"Métricas en http://localhost:{_servidor.server_port}/metrics")
+    return _servidor
@@ -0,0 +1,187 @@
+import time
+import threading
+import requests
+import configuracion
+
+OLLAMA_INTERVALO_SALUD = float(configuracion.obtener("OLLAMA_INTERVALO_SALUD", "15"))  # segundos entre chequeos
+# Límites por nodo; 0 = sin límite
+OLLAMA_MAX_RPS = float(configuracion.obtener("OLLAMA_MAX_RPS", "0"))  # peticiones por segundo
+OLLAMA_MAX_TPS = float(configuracion.obtener("OLLAMA_MAX_TPS", "0"))  # tokens (prompt + salida) por segundo
+TIMEOUT_SALUD = 2.0
+
+class LimitadorTasa:
+    """
+    Cubeta de fichas: admite hasta por_segundo unidades por segundo, con ráfagas de un segundo.
+    esperar() reserva antes de la petición; consumir() descuenta después lo que no se conocía
+    de antemano (los tokens), y la deuda la paga la siguiente petición.
+    """
+
+    def __init__(self, por_segundo):
+        self.por_segundo = por_segundo
+        self._fichas = por_segundo
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reponer(self):
+        ahora = time.monotonic()
+        self._fichas = min(self.por_segundo, self._fichas + (ahora - self._ultimo) * self.por_segundo)
+        self._ultimo = ahora
+
+    def esperar(self, cantidad=1):
+        """Bloquea hasta que haya cantidad fichas (o se salde la deuda, con cantidad=0)"""
+        if self.por_segundo <= 0:
+            return
+        with self._lock:
+            self._reponer()
+            self._fichas -= cantidad
+            deficit = -self._fichas if self._fichas < 0 else 0
+        if deficit:
+            time.sleep(deficit / self.por_segundo)
+
+    def consumir(self, cantidad):
+        if self.por_segundo <= 0 or not cantidad:
+            return
+        with self._lock:
+            self._reponer()
+            self._fichas -= cantidad
+
+class Nodo:
+    """Un servidor Ollama y su estado visto desde el cliente"""
+
+    def __init__(self, url, max_rps=OLLAMA_MAX_RPS, max_tps=OLLAMA_MAX_TPS):
+        self.url = url.rstrip("/")
+        self.sano = True
+        self.en_vuelo = 0
+        self.modelos = set()  # modelos cargados según /api/ps y las últimas respuestas
+        self.solicitudes = 0
+        self.fallos = 0
+        self.tokens = 0
+        self._lock_tokens = threading.Lock()
+        self.limite_peticiones = LimitadorTasa(max_rps)
+        self.limite_tokens = LimitadorTasa(max_tps)
+
+    def esperar_turno(self):
+        """Respeta los límites de peticiones y de tokens por segundo del nodo antes de enviar"""
+        self.limite_peticiones.esperar(1)
+        self.limite_tokens.esperar(0)
+
+    def consumir_tokens(self, cantidad):
+        """Descuenta los tokens (prompt + salida) que informó la respuesta del nodo"""
+        # Muchos hilos terminan a la vez: el contador y la cubeta se actualizan bajo lock
+        with self._lock_tokens:
+            self.tokens += cantidad
+        self.limite_tokens.consumir(cantidad)
+
+class Reserva:
+    """
+    Petición en curso sobre un nodo. liberar() descuenta la petición una sola vez,
+    también cuando la respuesta streaming se cierra más tarde.
+    """
+
+    def __init__(self, balanceador, nodo):
+        self.balanceador = balanceador
+        self.nodo = nodo
+        self._liberada = False
+
+    def liberar(self):
+        with self.balanceador._lock:
+            if not self._liberada:
+                self._liberada = True
+                self.nodo.en_vuelo -= 1
+
+class Balanceador:
+    """
+    Reparte las peticiones entre varios nodos Ollama: elige el que tiene menos peticiones en vuelo
+    y, a igual carga, prefiere uno que ya tiene el modelo cargado. Un chequeo periódico
+    de /api/ps saca de rotación los nodos caídos y los reincorpora cuando vuelven.
+    """
+
+    def __init__(self, urls, intervalo_salud=OLLAMA_INTERVALO_SALUD):
+        self.nodos = [Nodo(url) for url in urls]
+        self.intervalo_salud = intervalo_salud
+        self._lock = threading.Lock()
+        self._vigilante = None
+
+    def adquirir(self, modelo=None, excluir=()):
+        """
+        Reserva el mejor nodo para el modelo, sin usar los de excluir (urls).
+        Si no queda ningún nodo sano se prueba igualmente con los demás.
+        Devuelve una Reserva, o None si todos están excluidos
+        """
+        self._iniciar_vigilancia()
+        with self._lock:
+            disponibles = [n for n in self.nodos if n.url not in excluir]
+            if not disponibles:
+                return None
+            candidatos = [n for n in disponibles if n.sano] or disponibles
+            # Primero el menos cargado; a igual carga, uno que ya tiene el modelo y, entre esos,
+            # el que menos peticiones recibió, para repartir también las peticiones de a una
+            nodo = min(candidatos, key=lambda n: (n.en_vuelo, modelo not in n.modelos, n.solicitudes))
+            nodo.en_vuelo += 1
+            nodo.solicitudes += 1
+            return Reserva(self, nodo)
+
+    def exito(self, nodo, modelo=None):
+        """El nodo respondió: está sano y, si hubo modelo, ya lo tiene cargado"""
+        with self._lock:
+            nodo.sano = True
+            if modelo:
+                nodo.modelos.add(modelo)
+
+    def fallo(self, nodo):
+        """Error de conexión o timeout: el nodo sale de rotación hasta el próximo chequeo"""
+        with self._lock:
+            nodo.fallos += 1
+            nodo.sano = False
+            nodo.modelos.clear()
+
+    def verificar(self):
+        """Consulta /api/ps en todos los nodos y actualiza su salud y sus modelos cargados"""
+        for nodo in self.nodos:
+            try:
+                response = requests.get(f"{nodo.url}/api/ps", timeout=TIMEOUT_SALUD)
+                response.raise_for_status()
+                modelos = {m.get("name") or m.get("model") for m in response.json().get("models", [])}
+            except (requests.exceptions.RequestException, ValueError):
+                with self._lock:
+                    nodo.sano = False
+                    nodo.modelos.clear()
+                continue
+            with self._lock:
+                nodo.sano = True
+                nodo.modelos = modelos
+
+    def _vigilar(self):
+        while True:
+            time.sleep(self.intervalo_salud)
+            self.verificar()
+
+    def _iniciar_vigilancia(self):
+        # Con un único nodo no hay a dónde desviar el tráfico: no hace falta vigilar
+        if self._vigilante is None and len(self.nodos) > 1 and self.intervalo_salud > 0:
+            with self._lock:
+                if self._vigilante is None:
+                    self._vigilante = threading.Thread(target=self._vigilar, daemon=True)
+                    self._vigilante.start()
+
+    def estado(self):
+        """Estado por nodo: salud, peticiones en vuelo y totales, fallos, tokens y modelos cargados"""
+        with self._lock:
+            return [
+                {
+                    "url": n.url, "sano": n.sano, "en_vuelo": n.en_vuelo, "solicitudes": n.solicitudes,
+                    "fallos": n.fallos, "tokens": n.tokens, "modelos": sorted(m for m in n.modelos if m),
+                }
+                for n in self.nodos
+            ]
+
+_balanceadores = {}
+_lock_balanceadores = threading.Lock()
+
+def obtener_balanceador(urls):
+    """Balanceador compartido para una lista de urls"""
+    clave = tuple(url.rstrip("/") for url in urls)
+    with _lock_balanceadores:
+        if clave not in _balanceadores:
+            _balanceadores[clave] = Balanceador(clave)
+        return _balanceadores[clave]
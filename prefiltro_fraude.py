@@ -0,0 +1,206 @@
+import io
+import csv
+import json
+
+Z_UMBRAL = 2.0  # Desviaciones estándar sobre la media de las demás transacciones de la cuenta
+MIN_TRANSACCIONES_CUENTA = 3  # La fila y al menos 2 más: por debajo no hay desvío con qué comparar
+DESVIO_MINIMO = 0.05  # Fracción de la media: una cuenta de montos idénticos no deja el desvío en 0
+INTERVALO_MINIMO_S = 120  # Transacciones más seguidas que esto son sospechosas
+HORAS_NOCTURNAS = (0, 5)  # [desde, hasta)
+FILAS_CONTEXTO = 2  # Transacciones vecinas de la misma cuenta que acompañan a cada sospechosa
+
+COLUMNA_ID = "ID Transacción"
+COLUMNA_HORARIO = "Horario"
+COLUMNA_CIUDAD = "Ciudad - Estado"
+COLUMNA_VALOR = "Valor (USD)"
+
+def cuenta_de(id_transaccion):
+    """
+    El sufijo del ID identifica la tarjeta (c = crédito, d = débito)
+    """
+    id_transaccion = str(id_transaccion)
+    return id_transaccion.lstrip("0123456789") or id_transaccion
+
+def _numero(valor):
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return valor
+    return int(numero) if numero.is_integer() else numero
+
+def _iterar_json_array(archivo, tamano_bloque=65536):
+    """
+    Genera los objetos de un array JSON leyendo el archivo por bloques
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, inicio = "", 0, False
+    fin_archivo = False
+
+    while True:
+        # Saltamos espacios, comas y el corchete de apertura
+        while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] in ",["):
+            inicio = inicio or buffer[pos] == "["
+            pos += 1
+        if pos < len(buffer) and buffer[pos] == "]" and inicio:
+            return
+
+        if pos < len(buffer):
+            try:
+                objeto, pos = decoder.raw_decode(buffer, pos)
+                yield objeto
+                continue
+            except json.JSONDecodeError:
+                if fin_archivo:
+                    raise
+
+        if fin_archivo:
+            return
+        bloque = archivo.read(tamano_bloque)
+        fin_archivo = not bloque
+        buffer, pos = buffer[pos:] + bloque, 0
+
+def iterar_filas(nombre_archivo):
+    """
+    Genera las transacciones de un CSV o de un JSON (lista de objetos) una a una,
+    sin cargar el archivo completo en memoria
+    """
+    try:
+        with open(nombre_archivo, "r", encoding="utf-8", newline="") as archivo:
+            filas = _iterar_json_array(archivo) if nombre_archivo.endswith(".json") else csv.DictReader(archivo)
+            for fila in filas:
+                fila[COLUMNA_VALOR] = _numero(fila.get(COLUMNA_VALOR))
+                yield fila
+    except (IOError, json.JSONDecodeError) as e:
+        print(f"Error al leer archivo: {e}")
+
+def cargar_filas(nombre_archivo):
+    """
+    Carga transacciones de un CSV o de un JSON (lista de objetos) como lista de dicts
+    """
+    return list(iterar_filas(nombre_archivo))
+
+def a_csv(filas):
+    """Serializa filas de transacciones como CSV (con cabecera)"""
+    if not filas:
+        return ""
+    salida = io.StringIO()
+    writer = csv.DictWriter(salida, fieldnames=list(filas[0].keys()), lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(filas)
+    return salida.getvalue()
+
+def a_columnas(filas):
+    """
+    Convierte las filas en columnas NumPy para el cálculo vectorizado
+    """
+    # NumPy solo se importa al prefiltrar: leer y serializar filas no lo necesita
+    import numpy as np
+    return {
+        "cuenta": np.array([cuenta_de(f[COLUMNA_ID]) for f in filas]),
+        "horario": np.array([f[COLUMNA_HORARIO] for f in filas], dtype="datetime64[s]"),
+        "ciudad": np.array([f[COLUMNA_CIUDAD] for f in filas]),
+        "valor": np.array([float(f[COLUMNA_VALOR]) for f in filas]),
+    }
+
+def calcular_senales(columnas):
+    """
+    Señales de fraude por fila, todas vectorizadas:
+    z-score del valor frente a las demás transacciones de la cuenta, cambio de ciudad respecto a la transacción
+    anterior de la cuenta, intervalo muy corto y horario nocturno
+    """
+    import numpy as np
+    cuenta, horario = columnas["cuenta"], columnas["horario"]
+    ciudad, valor = columnas["ciudad"], columnas["valor"]
+    n = len(valor)
+
+    # z-score por cuenta con bincount sobre el índice de cuenta. Cada fila se compara con la media
+    # y el desvío de las demás filas de su cuenta (leave-one-out): si se incluyera a sí misma,
+    # z no podría superar sqrt(n-1) y una cuenta de 3 o 4 transacciones nunca llegaría a Z_UMBRAL
+    _, inverso = np.unique(cuenta, return_inverse=True)
+    conteo = np.bincount(inverso)
+    media = np.bincount(inverso, weights=valor) / conteo
+    diferencia = valor - media[inverso]
+    suma_cuadrados = np.bincount(inverso, weights=diferencia ** 2)
+    resto = conteo[inverso] - 1  # filas de la cuenta sin contar la propia
+    con_historial = conteo[inverso] >= MIN_TRANSACCIONES_CUENTA
+    # Sin la fila i, la media se corre -d_i/(n-1) y la suma de cuadrados pierde d_i^2
+    varianza_resto = np.zeros(n)
+    varianza_resto[con_historial] = (
+        (suma_cuadrados[inverso] - diferencia ** 2)[con_historial] / resto[con_historial]
+        - (diferencia[con_historial] / resto[con_historial]) ** 2
+    )
+    media_resto = media[inverso] - diferencia / np.maximum(resto, 1)
+    desvio_resto = np.maximum(np.sqrt(np.maximum(varianza_resto, 0)), DESVIO_MINIMO * np.abs(media_resto))
+    con_historial &= desvio_resto > 0
+    z_valor = np.zeros(n)
+    z_valor[con_historial] = (
+        diferencia[con_historial] * conteo[inverso][con_historial] / resto[con_historial]
+        / desvio_resto[con_historial]
+    )
+
+    # Orden cronológico dentro de cada cuenta para comparar con la transacción anterior
+    orden = np.lexsort((horario, inverso))
+    misma_cuenta = inverso[orden][1:] == inverso[orden][:-1]
+    delta = np.diff(horario[orden]).astype("int64")
+    cambio = (ciudad[orden][1:] != ciudad[orden][:-1]) & misma_cuenta
+
+    delta_s = np.full(n, -1, dtype="int64")
+    delta_s[orden[1:][misma_cuenta]] = delta[misma_cuenta]
+    cambio_ciudad = np.zeros(n, dtype=bool)
+    cambio_ciudad[orden[1:]] = cambio
+
+    hora = (horario - horario.astype("datetime64[D]")).astype("int64") // 3600
+    horario_nocturno = (hora >= HORAS_NOCTURNAS[0]) & (hora < HORAS_NOCTURNAS[1])
+    intervalo_corto = (delta_s >= 0) & (delta_s < INTERVALO_MINIMO_S)
+    valor_atipico = z_valor >= Z_UMBRAL
+
+    return {
+        "z_valor": z_valor,
+        "valor_atipico": valor_atipico,
+        "cambio_ciudad": cambio_ciudad,
+        "delta_s": delta_s,
+        "intervalo_corto": intervalo_corto,
+        "horario_nocturno": horario_nocturno,
+        "sospechosa": valor_atipico | cambio_ciudad | intervalo_corto | horario_nocturno,
+        "orden": orden,
+        "cuenta": inverso,
+    }
+
+def motivos(senales, i):
+    """Descripción legible de las señales que marcaron la fila i"""
+    resultado = []
+    if senales["valor_atipico"][i]:
+        resultado.append(f"valor atípico (z={senales['z_valor'][i]:.1f})")
+    if senales["cambio_ciudad"][i]:
+        resultado.append("cambio de ciudad")
+    if senales["intervalo_corto"][i]:
+        resultado.append(f"intervalo corto ({senales['delta_s'][i]}s)")
+    if senales["horario_nocturno"][i]:
+        resultado.append("horario nocturno")
+    return resultado
+
+def filas_con_contexto(senales, filas_contexto=FILAS_CONTEXTO):
+    """
+    Máscara de filas a enviar al modelo: las sospechosas más sus vecinas
+    cronológicas de la misma cuenta
+    """
+    import numpy as np
+    orden, cuenta = senales["orden"], senales["cuenta"]
+    sospechosa_ordenada = senales["sospechosa"][orden]
+    enviar = np.zeros(len(orden), dtype=bool)
+    posiciones = np.flatnonzero(sospechosa_ordenada)
+    if len(posiciones) == 0:
+        return enviar
+
+    desplazamientos = np.arange(-filas_contexto, filas_contexto + 1)
+    vecinas = np.clip(posiciones[:, None] + desplazamientos, 0, len(orden) - 1)
+    misma_cuenta = cuenta[orden][vecinas] == cuenta[orden][posiciones][:, None]
+    enviar[orden[vecinas[misma_cuenta]]] = True
+    return enviar
+
+def prefiltrar(filas, filas_contexto=FILAS_CONTEXTO):
+    """
+    Devuelve (senales, enviar): las señales por fila y la máscara de filas para el modelo
+    """
+    senales = calcular_senales(a_columnas(filas))
+    return senales, filas_con_contexto(senales, filas_contexto)
@@ -1,13 +1,32 @@
-import os
-import requests
-import json
-from dotenv import load_dotenv
+import re
+import csv
+import argparse
+import threading
+import configuracion
+import cliente_ollama
+import cola_trabajos
+import contador_tokens
+import diccionario_productos
+import gestor_modelos
+import enrutador_modelos
+import metricas
 
-load_dotenv()
+OLLAMA_MODEL = configuracion.obtener("OLLAMA_MODEL", "llama3")
 
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")
-OLLAMA_MODEL_ALT = "llama3:instruct"  # Modelo alternativo para casos de alta carga
+TOKENS_SALIDA_POR_CLIENTE = 16  # "clienteN - tres palabras" más margen
+
+PROMPT_PERFILES = """Identifique el perfil de compra de cada cliente
+    El formato de salida debe ser:
+    cliente - describa el perfil del cliente en 3 palabras"""
+
+# Con compresión, cada cliente llega como "clienteN,P3 P1 P7" y el prompt de sistema de cada bloque
+# lleva la leyenda de los productos de ese bloque
+PROMPT_LEYENDA = """
+    Los productos de cada cliente se indican con IDs. Productos (ID=producto):
+{leyenda}"""
+
+# Línea de salida esperada: "cliente12 - Ecológico, tecnológico, práctico"
+PATRON_PERFIL = re.compile(r"^\W*(cliente\d+)\W*\s*[-:–]\s*(.+?)\s*$", re.IGNORECASE)
 
 def carga(nombre_archivo):
     """
@@ -22,94 +41,280 @@ def carga(nombre_archivo):
 
 def contar_tokens(texto, modelo):
     """
-    Versión mejorada para contar tokens usando el endpoint de generación
+    Cuenta los tokens de entrada sin ejecutar una generación
     """
-    url = f"{OLLAMA_BASE_URL}/api/generate"
-    payload = {
-        "model": modelo,
-        "prompt": texto,
-        "stream": False,
-        "options": {"temperature": 0}
-    }
-    
-    try:
-        response = requests.post(url, json=payload, timeout=30)
-        if response.status_code == 200:
-            data = response.json()
-            return data.get("eval_count", 0) + data.get("prompt_eval_count", 0)
-    except Exception as e:
-        print(f"Error al contar tokens: {str(e)}")
-    
-    return 0
+    return contador_tokens.contar_tokens(texto, modelo)
 
-def generate_completion(messages, modelo, max_tokens=2048):
+def generate_completion(messages, modelo, max_tokens=2048, num_ctx=None):
     """
     Versión mejorada que maneja streaming de respuesta
     """
-    url = f"{OLLAMA_BASE_URL}/api/chat"
-    payload = {
-        "model": modelo,
-        "messages": messages,
-        "stream": False,  # Desactivamos streaming para simplificar
-        "options": {
-            "num_predict": max_tokens,
-            "temperature": 0.7
-        }
+    opciones = {
+        "num_predict": max_tokens,
+        "temperature": 0.7
     }
-    
+    if num_ctx:
+        opciones["num_ctx"] = num_ctx  # Evita que el servidor trunque con su contexto por defecto
+    return cliente_ollama.chat(messages, modelo, opciones=opciones, timeout=60)
+
+def leer_clientes(nombre_archivo):
+    """
+    Genera (cliente, fila_csv) sin cargar el archivo completo en memoria
+    """
     try:
-        response = requests.post(url, json=payload, timeout=60)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"Error en la API: {response.status_code}")
-            print(response.text)
-    except Exception as e:
-        print(f"Error en generate_completion: {str(e)}")
-    
-    return None
-
-def main():
-    # Definir prompts
-    prompt_sistema = """Identifique el perfil de compra de cada cliente
-    El formato de salida debe ser:
-    cliente - describa el perfil del cliente en 3 palabras"""
+        with open(nombre_archivo, "r", encoding="utf-8", newline="") as archivo:
+            for fila in csv.reader(archivo):
+                if not fila or not fila[0].strip():
+                    continue
+                cliente = fila[0].strip()
+                productos = ",".join(fila[1:])
+                yield cliente, f'{cliente},"{productos}"'
+    except IOError as e:
+        print(f"Error al leer archivo: {e}")
 
-    prompt_usuario = carga("datos/lista-compra-300-clientes.csv")
-    
-    if not prompt_usuario:
-        print("No se pudo cargar el archivo de datos")
-        return
+def dividir_en_bloques(clientes, modelo=OLLAMA_MODEL, contexto=None, prompt_sistema=PROMPT_PERFILES):
+    """
+    Agrupa filas de clientes en bloques cuya entrada más la salida esperada caben en el contexto.
+    Los cortes siempre caen entre clientes, nunca dentro de una fila.
+    """
+    if contexto is None:
+        contexto = enrutador_modelos.contexto_modelo(modelo)
+    disponible = contexto - contador_tokens.estimar_tokens(prompt_sistema, modelo)
+    bloque, tokens_bloque = [], 0
+
+    for cliente, fila in clientes:
+        tokens_fila = contador_tokens.estimar_tokens(fila, modelo) + TOKENS_SALIDA_POR_CLIENTE
+        if bloque and tokens_bloque + tokens_fila > disponible:
+            yield bloque
+            bloque, tokens_bloque = [], 0
+        bloque.append((cliente, fila))
+        tokens_bloque += tokens_fila
+
+    if bloque:
+        yield bloque
 
-    # Contar tokens (versión mejorada)
-    numero_tokens_entrada = contar_tokens(prompt_sistema + prompt_usuario, OLLAMA_MODEL)
-    print(f"\nModelo base: {OLLAMA_MODEL}")
-    print(f"Tokens de entrada estimados: {numero_tokens_entrada}")
-
-    # Definir límites y selección de modelo
-    tokens_salida = 2048
-    limite_tokens_modelo = 8000  # Límite conservador para llama3
-    
-    modelo_seleccionado = OLLAMA_MODEL
-    if numero_tokens_entrada + tokens_salida >= limite_tokens_modelo:
-        modelo_seleccionado = OLLAMA_MODEL_ALT
-        print(f"\nCambiando a modelo alternativo: {modelo_seleccionado}")
-
-    # Generar respuesta
+def extraer_perfiles(texto):
+    """
+    Convierte la salida del modelo en {cliente: perfil}
+    """
+    perfiles = {}
+    for linea in (texto or "").splitlines():
+        coincidencia = PATRON_PERFIL.match(linea)
+        if coincidencia:
+            perfiles[coincidencia.group(1).lower()] = coincidencia.group(2)
+    return perfiles
+
+@metricas.etiquetado("seleccion_modelo", "perfiles")
+def perfilar_bloque(bloque, modelo, contexto=None, reintentar_faltantes=True, prompt_sistema=PROMPT_PERFILES):
+    """
+    Perfila un bloque de clientes con una sola llamada. Devuelve {cliente: perfil}.
+    Los clientes que el modelo omitió se piden una segunda vez, solo ellos.
+    """
+    prompt_usuario = "\n".join(fila for _, fila in bloque)
     messages = [
         {"role": "system", "content": prompt_sistema},
         {"role": "user", "content": prompt_usuario}
     ]
+    max_tokens = len(bloque) * TOKENS_SALIDA_POR_CLIENTE
+    respuesta = generate_completion(messages, modelo, max_tokens, num_ctx=contexto)
+    perfiles = extraer_perfiles(cliente_ollama.contenido(respuesta))
+
+    faltantes = [(cliente, fila) for cliente, fila in bloque if cliente.lower() not in perfiles]
+    if faltantes and respuesta and reintentar_faltantes:
+        perfiles.update(perfilar_bloque(faltantes, modelo, contexto, False, prompt_sistema))
+    return perfiles
+
+def _cerrar_bloque(bloque, productos, diccionario, tokens_original, tokens_comprimido):
+    """(filas, prompt de sistema) del bloque: comprimido solo si ahorra tokens con su leyenda"""
+    if tokens_comprimido >= tokens_original:
+        return [(cliente, fila) for cliente, fila, _ in bloque], PROMPT_PERFILES
+    leyenda = diccionario.leyenda(productos)
+    return [(cliente, codificada) for cliente, _, codificada in bloque], PROMPT_PERFILES + PROMPT_LEYENDA.format(leyenda=leyenda)
+
+def dividir_en_bloques_comprimidos(clientes, diccionario, modelo=OLLAMA_MODEL, contexto=None):
+    """
+    Como dividir_en_bloques, pero cada bloque lleva en su prompt de sistema la leyenda de sus
+    propios productos. Un bloque entra si su versión más corta (filas codificadas más su leyenda,
+    o filas originales) cabe en el contexto; si la leyenda no compensa, el bloque va sin comprimir.
+    Genera (filas, prompt de sistema)
+    """
+    if contexto is None:
+        contexto = enrutador_modelos.contexto_modelo(modelo)
+    disponible = contexto - contador_tokens.estimar_tokens(PROMPT_PERFILES + PROMPT_LEYENDA, modelo)
+    bloque, productos = [], set()
+    tokens_original = tokens_comprimido = 0
+
+    def tokens_leyenda(nuevos):
+        return sum(contador_tokens.estimar_tokens(diccionario.linea_leyenda(p), modelo) for p in nuevos)
+
+    for cliente, fila in clientes:
+        productos_fila = set(diccionario_productos.separar_productos(fila.split(",", 1)[1]))
+        codificada = f"{cliente},{diccionario.codificar(fila.split(',', 1)[1])}"
+        tokens_fila = contador_tokens.estimar_tokens(fila, modelo) + TOKENS_SALIDA_POR_CLIENTE
+        tokens_codificada = contador_tokens.estimar_tokens(codificada, modelo) + TOKENS_SALIDA_POR_CLIENTE
+        # La leyenda crece solo con los productos que el bloque todavía no cita
+        tokens_nuevos = tokens_leyenda(productos_fila - productos)
+        if bloque and min(tokens_original + tokens_fila, tokens_comprimido + tokens_codificada + tokens_nuevos) > disponible:
+            yield _cerrar_bloque(bloque, productos, diccionario, tokens_original, tokens_comprimido)
+            bloque, productos = [], set()
+            tokens_original = tokens_comprimido = 0
+            tokens_nuevos = tokens_leyenda(productos_fila)
+        bloque.append((cliente, fila, codificada))
+        productos |= productos_fila
+        tokens_original += tokens_fila
+        tokens_comprimido += tokens_codificada + tokens_nuevos
+
+    if bloque:
+        yield _cerrar_bloque(bloque, productos, diccionario, tokens_original, tokens_comprimido)
+
+def informar_compresion(clientes, bloques, modelo):
+    """
+    Cuenta los tokens de entrada de cada bloque con y sin diccionario (prompt de sistema
+    y leyenda incluidos) y muestra el ahorro total
+    """
+    originales = dict(clientes)
+    comprimidos = sum(1 for _, prompt_sistema in bloques if prompt_sistema != PROMPT_PERFILES)
+    ahorro = diccionario_productos.comparar_tokens(
+        (PROMPT_PERFILES + "\n" + "\n".join(originales[c] for c, _ in filas) for filas, _ in bloques),
+        (prompt_sistema + "\n" + "\n".join(fila for _, fila in filas) for filas, prompt_sistema in bloques),
+        modelo
+    )
+    print(f"Compresión por diccionario en {comprimidos} de {len(bloques)} bloque(s): "
+          f"{ahorro['original']} -> {ahorro['comprimido']} tokens de entrada ({ahorro['porcentaje']:.0f}% menos)")
+    return ahorro
+
+def _tokens_bloque(bloque, prompt_sistema):
+    # Tokens estimados de la petición de un bloque: (entrada, salida esperada)
+    tokens_entrada = contador_tokens.estimar_tokens(prompt_sistema, OLLAMA_MODEL) + sum(
+        contador_tokens.estimar_tokens(fila, OLLAMA_MODEL) for _, fila in bloque
+    )
+    return tokens_entrada, len(bloque) * TOKENS_SALIDA_POR_CLIENTE
+
+def elegir_modelo(bloque, slo_s=None, prompt_sistema=PROMPT_PERFILES):
+    """
+    El enrutador elige el modelo más barato que admite la petición de un bloque (prompt de sistema,
+    filas y salida esperada) dentro del SLO por petición. Devuelve (modelo, contexto)
+    """
+    return enrutador_modelos.obtener_enrutador().elegir(*_tokens_bloque(bloque, prompt_sistema), slo_s)
+
+def agrupar_por_modelo(bloques, slo_s=None):
+    """
+    Planifica con el enrutador el modelo de cada bloque (filas, prompt_sistema) y los ordena para que
+    los de un mismo modelo queden seguidos en la cola: menos cambios de modelo en memoria.
+    Devuelve ([(índice original, bloque)], modelos que el enrutador puede elegir, los planificados primero)
+    """
+    enrutador = enrutador_modelos.obtener_enrutador()
+    grupos, posibles = {}, {}
+    for indice, (filas, prompt_sistema) in enumerate(bloques):
+        tokens_entrada, tokens_salida = _tokens_bloque(filas, prompt_sistema)
+        modelo, _ = enrutador.elegir(tokens_entrada, tokens_salida, slo_s)
+        grupos.setdefault(modelo, []).append((indice, (filas, prompt_sistema)))
+        posibles.update(dict.fromkeys(enrutador.admisibles(tokens_entrada, tokens_salida)))
+    ordenados = [item for items in grupos.values() for item in items]
+    return ordenados, list(dict.fromkeys([*grupos, *posibles]))
+
+def perfilar_clientes(nombre_archivo, modelo=None, contexto=None, max_concurrencia=4, slo_s=None, comprimir=True,
+                      cola=None):
+    """
+    Map-reduce: divide el CSV en bloques que caben en el contexto, los perfila en paralelo
+    y devuelve [(cliente, perfil)] en el orden original del archivo.
+    Sin modelo, los bloques se dimensionan con el mayor contexto de los candidatos, se encolan agrupados
+    por el modelo que el enrutador planifica para cada uno y se precargan los modelos que puede elegir;
+    al enviar cada bloque el enrutador confirma el modelo, según su tamaño y el SLO por petición.
+    Con comprimir, los productos viajan como IDs de un diccionario y cada bloque lleva la leyenda
+    de sus productos en el prompt de sistema: menos tokens por cliente y más clientes por bloque.
+    Cada bloque es un ítem de la cola de trabajos: si la ejecución se interrumpe,
+    la siguiente con el mismo archivo y modelo retoma los bloques que faltaban.
+    Sin cola se usa la compartida del proceso (cola_trabajos.obtener_cola()).
+    """
+    clientes = list(leer_clientes(nombre_archivo))
+    if not clientes:
+        return []
+
+    if contexto is None:
+        contexto = enrutador_modelos.contexto_modelo(modelo) if modelo else enrutador_modelos.obtener_enrutador().contexto_maximo()
+    modelo_tokens = modelo or OLLAMA_MODEL  # calibra las estimaciones de tokens
+
+    diccionario = None
+    if comprimir:
+        diccionario = diccionario_productos.DiccionarioProductos.desde_textos(
+            fila.split(",", 1)[1] for _, fila in clientes
+        )
+        bloques = list(dividir_en_bloques_comprimidos(clientes, diccionario, modelo_tokens, contexto))
+        informar_compresion(clientes, bloques, modelo_tokens)
+    else:
+        bloques = [(bloque, PROMPT_PERFILES) for bloque in dividir_en_bloques(clientes, modelo_tokens, contexto)]
+
+    if cola is None:
+        cola = cola_trabajos.obtener_cola()
+    trabajo = cola_trabajos.id_trabajo(
+        "perfiles", cola_trabajos.hash_archivo(nombre_archivo), modelo or "enrutador", contexto, PROMPT_PERFILES, comprimir
+    )
+    if modelo:
+        items, modelos = enumerate(bloques), [modelo]
+    else:
+        items, modelos = agrupar_por_modelo(bloques, slo_s)
+    total = cola.agregar(trabajo, items)
+    pendientes = total - cola.estado(trabajo).get(cola_trabajos.HECHO, 0)
+    print(f"Clientes divididos en {total} bloque(s), {pendientes} pendiente(s)")
+
+    if pendientes:
+        elegidos, lock_elegidos = {}, threading.Lock()  # modelo -> bloques enviados
+
+        def perfilar_item(item):
+            filas, prompt_sistema = item
+            # La cola ya viene agrupada por el modelo planificado; al enviar se vuelve a enrutar
+            # con las latencias observadas hasta ahora, por si el planificado dejó de cumplir el SLO
+            modelo_bloque, contexto_bloque = (modelo, contexto) if modelo else elegir_modelo(filas, slo_s, prompt_sistema)
+            with lock_elegidos:
+                elegidos[modelo_bloque] = elegidos.get(modelo_bloque, 0) + 1
+            # Un bloque sin ningún perfil cuenta como fallo y se reintenta
+            return perfilar_bloque(filas, modelo_bloque, contexto_bloque, prompt_sistema=prompt_sistema) or None
+
+        gestor_modelos.asegurar_cargados(modelos)
+        cola.ejecutar(trabajo, perfilar_item, max_concurrencia)
+        if not modelo:
+            print("Modelos elegidos: " + ", ".join(f"{m} ({n} bloque(s))" for m, n in elegidos.items()))
+
+    perfiles_por_cliente = {}
+    for _, _, perfiles_bloque in cola.resultados(trabajo):
+        perfiles_por_cliente.update(perfiles_bloque or {})
+    if diccionario:
+        # Si el modelo citó productos por su ID, se devuelven con su nombre
+        perfiles_por_cliente = {c: diccionario.decodificar(p) for c, p in perfiles_por_cliente.items()}
+    return [(cliente, perfiles_por_cliente.get(cliente.lower())) for cliente, _ in clientes]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perfiles de compra de clientes")
+    parser.add_argument("archivo", nargs="?", default="datos/lista-compra-300-clientes.csv", help="CSV cliente,productos")
+    parser.add_argument("--modelo", help="Modelo a usar (por defecto lo elige el enrutador)")
+    parser.add_argument("--concurrencia", type=int, default=4, help="Bloques perfilados en paralelo")
+    parser.add_argument("--slo", type=float, help="Latencia máxima por petición, en segundos")
+    parser.add_argument("--sin-compresion", action="store_true", help="Envía los nombres completos de los productos")
+    args = parser.parse_args(argv)
+    metricas.iniciar_si_configurado()
+
+    print(f"\nModelos candidatos: {', '.join(enrutador_modelos.OLLAMA_MODELOS)}")
 
     print("\nGenerando respuesta...")
-    respuesta = generate_completion(messages, modelo_seleccionado, tokens_salida)
+    perfiles = perfilar_clientes(
+        args.archivo, args.modelo, max_concurrencia=args.concurrencia, slo_s=args.slo, comprimir=not args.sin_compresion
+    )
+
+    if not perfiles:
+        print("No se pudo cargar el archivo de datos")
+        return
 
     # Procesar respuesta
-    if respuesta and "message" in respuesta:
-        print("\nResultado:")
-        print(respuesta["message"]["content"])
-    else:
-        print("\nNo se obtuvo una respuesta válida.")
+    print("\nResultado:")
+    for cliente, perfil in perfiles:
+        print(f"{cliente} - {perfil or '(sin perfil)'}")
+
+    sin_perfil = sum(1 for _, perfil in perfiles if not perfil)
+    if sin_perfil:
+        print(f"\n{sin_perfil} cliente(s) sin perfil en la respuesta del modelo")
+
+    return perfiles
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
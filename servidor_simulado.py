@@ -0,0 +1,264 @@
+import re
+import json
+import time
+import hashlib
+import argparse
+import threading
+import contextlib
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Configuración por defecto del servidor simulado
+CONFIG_DEFECTO = {
+    "latencia_red": 0.002,  # segundos por petición
+    "tokens_prompt_por_s": 2000.0,  # velocidad de evaluación del prompt
+    "tokens_por_s": 60.0,  # velocidad de generación
+    "latencia_carga": 0.0,  # load_duration de la primera petición a cada modelo
+    "contexto": 8192,
+    "tamano_parametros": "8.0B",
+    "dimension_embedding": 64,
+    "slots": 4,  # prompts recientes por modelo cuyo prefijo evaluado se conserva (KV cache)
+    "paralelo": 0,  # generaciones simultáneas, como OLLAMA_NUM_PARALLEL; el resto espera (0 = sin límite)
+}
+
+def contar_tokens_simulado(texto):
+    """Aproximación de tokens del servidor simulado (~4 caracteres por token)"""
+    return max(1, len(texto) // 4)
+
+def _texto_entrada(payload):
+    if "messages" in payload:
+        return "\n".join(m.get("content", "") for m in payload["messages"])
+    entrada = payload.get("prompt") or payload.get("input") or ""
+    return "\n".join(entrada) if isinstance(entrada, list) else entrada
+
+def _generar_texto(payload):
+    """
+    Respuesta plausible según la tarea que se reconoce en el prompt
+    """
+    mensajes = payload.get("messages") or []
+    sistema = mensajes[0]["content"] if mensajes and mensajes[0].get("role") == "system" else ""
+    usuario = mensajes[-1]["content"] if mensajes else payload.get("prompt", "")
+
+    if "transacciones" in sistema:
+        ids = re.findall(r"^([0-9]+[a-z]+),", usuario, re.MULTILINE)
+        transacciones = [{"ID Transacción": i, "Estado": "Aprobado"} for i in ids]
+        return json.dumps({"transacciones": transacciones}, ensure_ascii=False)
+    if "clasificaciones" in sistema:
+        ids = re.findall(r"^(\d+)\. ", usuario, re.MULTILINE)
+        categorias = re.findall(r'"([^"]+)"', sistema.split("# Formato")[0])
+        categoria = categorias[0] if categorias else "General"
+        return json.dumps({"clasificaciones": [{"id": int(i), "categoria": categoria} for i in ids]})
+    if "perfil de compra" in sistema:
+        clientes = re.findall(r"^(cliente\d+),", usuario, re.MULTILINE)
+        return "\n".join(f"{c} - Ecológico, práctico, consciente" for c in clientes)
+    if "categorizador" in sistema:
+        return f"Producto: {usuario.strip()}\nCategoría: General"
+    if "sentimientos" in sistema:
+        return ("Nombre del Producto: Producto\nResumen: Reseñas mayormente positivas.\n"
+                "Sentimiento: Positivo\nPuntos fuertes:\n- Calidad\n- Precio\n- Diseño\n"
+                "Áreas de mejora:\n- Empaque\n- Tallas\n- Envío")
+    return "Respuesta simulada."
+
+class ManejadorSimulado(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = CONFIG_DEFECTO
+    modelos_cargados = set()
+    prompts_recientes = {}
+    ocupacion = None  # semáforo de generaciones simultáneas si config["paralelo"] > 0
+    _lock = threading.Lock()
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, datos, codigo=200):
+        cuerpo = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _chunk(self, datos):
+        linea = (json.dumps(datos, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(linea):x}\r\n".encode() + linea + b"\r\n")
+        self.wfile.flush()
+
+    def _carga_modelo(self, modelo, keep_alive=None):
+        """
+        Simula el arranque en frío: solo la primera petición a cada modelo paga la carga.
+        keep_alive 0 descarga el modelo al terminar
+        """
+        with self._lock:
+            if keep_alive in (0, "0", "0s"):
+                self.modelos_cargados.discard(modelo)
+                return 0.0
+            if modelo in self.modelos_cargados:
+                return 0.0
+            self.modelos_cargados.add(modelo)
+        return self.config["latencia_carga"]
+
+    def _tokens_reutilizados(self, modelo, texto):
+        """
+        Como el KV cache de Ollama: el prefijo común más largo con un prompt reciente
+        del mismo modelo no se vuelve a evaluar
+        """
+        with self._lock:
+            recientes = self.prompts_recientes.setdefault(modelo, deque(maxlen=self.config["slots"]))
+            comun = 0
+            for previo in recientes:
+                n = 0
+                limite = min(len(previo), len(texto))
+                while n < limite and previo[n] == texto[n]:
+                    n += 1
+                comun = max(comun, n)
+            recientes.append(texto)
+        return contar_tokens_simulado(texto[:comun]) if comun else 0
+
+    def do_GET(self):
+        if self.path in ("/api/tags", "/api/ps"):
+            modelos = [{"name": m, "model": m} for m in sorted(self.modelos_cargados, key=str)]
+            return self._responder({"models": modelos})
+        self._responder({"error": "not found"}, 404)
+
+    def do_POST(self):
+        longitud = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(longitud) or b"{}")
+        except json.JSONDecodeError:
+            return self._responder({"error": "invalid json"}, 400)
+
+        if self.path == "/api/show":
+            contexto = self.config["contexto"]
+            return self._responder({
+                "model_info": {"general.architecture": "llama", "llama.context_length": contexto},
+                "parameters": f"num_ctx {contexto}",
+                "details": {"parameter_size": self.config["tamano_parametros"]},
+            })
+        if self.path == "/api/embed":
+            return self._embed(payload)
+        if self.path in ("/api/chat", "/api/generate"):
+            return self._generar(payload)
+        self._responder({"error": "not found"}, 404)
+
+    def _embed(self, payload):
+        entradas = payload.get("input") or ""
+        entradas = entradas if isinstance(entradas, list) else [entradas]
+        dimension = self.config["dimension_embedding"]
+        embeddings = []
+        for texto in entradas:
+            semilla = hashlib.sha256(texto.encode("utf-8")).digest()
+            valores = (semilla * (dimension // len(semilla) + 1))[:dimension]
+            embeddings.append([(b - 128) / 128 for b in valores])
+        tokens = sum(contar_tokens_simulado(t) for t in entradas)
+        carga = self._carga_modelo(payload.get("model"), payload.get("keep_alive"))
+        duracion_prompt = tokens / self.config["tokens_prompt_por_s"]
+        time.sleep(self.config["latencia_red"] + carga + duracion_prompt)
+        self._responder({
+            "model": payload.get("model"),
+            "embeddings": embeddings,
+            "total_duration": int((carga + duracion_prompt) * 1e9),
+            "load_duration": int(carga * 1e9),
+            "prompt_eval_count": tokens,
+        })
+
+    def _generar(self, payload):
+        es_chat = self.path == "/api/chat"
+        if not payload.get("messages") and not payload.get("prompt"):
+            # Petición vacía: Ollama solo carga (o descarga) el modelo
+            carga = self._carga_modelo(payload.get("model"), payload.get("keep_alive"))
+            time.sleep(self.config["latencia_red"] + carga)
+            return self._responder({
+                "model": payload.get("model"), "done": True, "done_reason": "load",
+                "total_duration": int(carga * 1e9), "load_duration": int(carga * 1e9),
+            })
+        texto = _generar_texto(payload)
+        limite = (payload.get("options") or {}).get("num_predict")
+        truncado = bool(limite and limite > 0 and len(texto) > limite * 4)
+        if truncado:
+            texto = texto[:limite * 4]
+
+        entrada = _texto_entrada(payload)
+        tokens_entrada = contar_tokens_simulado(entrada)
+        carga = self._carga_modelo(payload.get("model"), payload.get("keep_alive"))
+        if carga:
+            self.prompts_recientes.pop(payload.get("model"), None)
+        tokens_prompt = max(1, tokens_entrada - self._tokens_reutilizados(payload.get("model"), entrada))
+        duracion_prompt = tokens_prompt / self.config["tokens_prompt_por_s"]
+        fragmentos = [texto[i:i + 4] for i in range(0, len(texto), 4)] or [""]
+        intervalo = 1.0 / self.config["tokens_por_s"]
+        metricas = {
+            "model": payload.get("model"),
+            "done": True,
+            "done_reason": "length" if truncado else "stop",
+            "total_duration": int((carga + duracion_prompt + len(fragmentos) * intervalo) * 1e9),
+            "load_duration": int(carga * 1e9),
+            "prompt_eval_count": tokens_prompt,
+            "prompt_eval_duration": int(duracion_prompt * 1e9),
+            "eval_count": len(fragmentos),
+            "eval_duration": int(len(fragmentos) * intervalo * 1e9),
+        }
+        if not es_chat:
+            metricas["context"] = list(range(tokens_entrada + len(fragmentos)))
+
+        def mensaje(contenido):
+            return {"message": {"role": "assistant", "content": contenido}} if es_chat else {"response": contenido}
+
+        # Con paralelo lleno, la petición espera su turno en el servidor y su latencia sube
+        with self.ocupacion or contextlib.nullcontext():
+            time.sleep(self.config["latencia_red"] + carga + duracion_prompt)
+            if not payload.get("stream", True):
+                time.sleep(len(fragmentos) * intervalo)
+                return self._responder(dict(metricas, **mensaje(texto)))
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for fragmento in fragmentos:
+                time.sleep(intervalo)
+                self._chunk(dict(model=payload.get("model"), done=False, **mensaje(fragmento)))
+            self._chunk(dict(metricas, **mensaje("")))
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+def iniciar(puerto=0, **config):
+    """
+    Arranca el servidor simulado en un hilo. Devuelve (servidor, url)
+    """
+    manejador = type("Manejador", (ManejadorSimulado,), {
+        "config": dict(CONFIG_DEFECTO, **config),
+        "modelos_cargados": set(),
+        "prompts_recientes": {},
+        "ocupacion": threading.BoundedSemaphore(config["paralelo"]) if config.get("paralelo") else None,
+    })
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor Ollama simulado para benchmarks")
+    parser.add_argument("--puerto", type=int, default=11435)
+    parser.add_argument("--latencia-red", type=float, default=CONFIG_DEFECTO["latencia_red"])
+    parser.add_argument("--tokens-prompt-por-s", type=float, default=CONFIG_DEFECTO["tokens_prompt_por_s"])
+    parser.add_argument("--tokens-por-s", type=float, default=CONFIG_DEFECTO["tokens_por_s"])
+    parser.add_argument("--latencia-carga", type=float, default=CONFIG_DEFECTO["latencia_carga"])
+    parser.add_argument("--contexto", type=int, default=CONFIG_DEFECTO["contexto"])
+    parser.add_argument("--paralelo", type=int, default=CONFIG_DEFECTO["paralelo"])
+    args = parser.parse_args()
+
+    servidor, url = iniciar(
+        args.puerto,
+        latencia_red=args.latencia_red,
+        tokens_prompt_por_s=args.tokens_prompt_por_s,
+        tokens_por_s=args.tokens_por_s,
+        latencia_carga=args.latencia_carga,
+        contexto=args.contexto,
+        paralelo=args.paralelo,
+    )
+    print(f"Servidor simulado escuchando en {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
@@ -0,0 +1,136 @@
+import threading
+import cliente_ollama
+import contador_tokens
+
+class SesionPrompt:
+    """
+    Secuencia de llamadas que comparten el mismo prompt de sistema.
+    Ollama conserva en memoria (KV cache) el prefijo ya evaluado de la petición anterior:
+    si el mensaje de sistema llega idéntico, con el mismo modelo y el mismo num_ctx,
+    solo se evalúa la parte nueva. La sesión fija esas partes y mide el ahorro
+    a partir del prompt_eval_count/prompt_eval_duration de cada respuesta.
+    """
+
+    def __init__(self, prompt_sistema, modelo, opciones=None, formato=None):
+        self.prompt_sistema = prompt_sistema
+        self.modelo = modelo
+        self.opciones = dict(opciones or {})  # Un num_ctx distinto obliga a recargar el modelo
+        self.formato = formato
+        self._lock = threading.Lock()
+        self._tokens_prefijo = None
+        self._segundos_por_token = None  # Velocidad de prompt_eval medida en una llamada sin prefijo
+        self._estadisticas = {
+            "llamadas": 0,
+            "tokens_evaluados": 0,
+            "tokens_reutilizados": 0,
+            "prompt_eval_s": 0.0,
+            "ahorro_estimado_s": 0.0,
+        }
+
+    def contar_prefijo(self):
+        """
+        Cuenta (una sola vez) los tokens del prompt de sistema. Puede hacer una llamada a Ollama:
+        hay que llamarlo antes de ocupar una conexión del pool
+        """
+        if self._tokens_prefijo is None:
+            self._tokens_prefijo = contador_tokens.contar_tokens(self.prompt_sistema, self.modelo)
+        return self._tokens_prefijo
+
+    @property
+    def tokens_prefijo(self):
+        return self.contar_prefijo()
+
+    def mensajes(self, contenido_usuario):
+        """El mensaje de sistema va siempre primero y sin cambios; lo variable, al final"""
+        return [
+            {"role": "system", "content": self.prompt_sistema},
+            {"role": "user", "content": contenido_usuario}
+        ]
+
+    def _opciones(self, opciones):
+        # Las opciones por llamada (num_predict, temperatura) no invalidan el prefijo; num_ctx sí
+        combinadas = dict(self.opciones, **(opciones or {}))
+        if "num_ctx" in self.opciones:
+            combinadas["num_ctx"] = self.opciones["num_ctx"]
+        return combinadas
+
+    def chat(self, contenido_usuario, opciones=None, timeout=None):
+        """
+        Llamada a /api/chat con el prefijo de la sesión. Devuelve el JSON de Ollama o None
+        """
+        respuesta = cliente_ollama.chat(
+            self.mensajes(contenido_usuario), self.modelo,
+            opciones=self._opciones(opciones), formato=self.formato, timeout=timeout
+        )
+        if respuesta is not None:
+            self.registrar(respuesta, contenido_usuario)
+        return respuesta
+
+    def chat_stream(self, contenido_usuario, opciones=None, timeout=None):
+        """
+        Llamada streaming con el prefijo de la sesión; genera los fragmentos de Ollama
+        """
+        # El prefijo se cuenta antes de abrir el stream: contarlo con la conexión del stream
+        # ocupada puede bloquearse si el pool HTTP está lleno
+        self.contar_prefijo()
+        chunks = cliente_ollama.chat_stream(
+            self.mensajes(contenido_usuario), self.modelo,
+            opciones=self._opciones(opciones), formato=self.formato, timeout=timeout
+        )
+        for chunk in chunks:
+            if chunk.get("done"):
+                self.registrar(chunk, contenido_usuario)
+            yield chunk
+
+    def registrar(self, respuesta, contenido_usuario):
+        """
+        Compara los tokens que el servidor evaluó con los que tiene la petición completa.
+        La diferencia es el prefijo reutilizado; se valora con la velocidad de prompt_eval
+        medida en las llamadas que evaluaron el prefijo entero.
+        """
+        if "eval_count" not in respuesta:
+            return
+        # Ollama omite prompt_eval_count cuando todo el prompt venía del cache
+        evaluados = respuesta.get("prompt_eval_count", 0)
+        duracion_s = respuesta.get("prompt_eval_duration", 0) / 1e9
+        esperados = self.tokens_prefijo + contador_tokens.estimar_tokens(contenido_usuario, self.modelo)
+        reutilizados = min(self.tokens_prefijo, max(0, esperados - evaluados))
+
+        with self._lock:
+            if reutilizados < self.tokens_prefijo / 2 and evaluados and duracion_s:
+                self._segundos_por_token = duracion_s / evaluados
+            estadisticas = self._estadisticas
+            estadisticas["llamadas"] += 1
+            estadisticas["tokens_evaluados"] += evaluados
+            estadisticas["tokens_reutilizados"] += reutilizados
+            estadisticas["prompt_eval_s"] += duracion_s
+            # Sin una llamada completa de referencia, usamos la velocidad de esta misma llamada
+            segundos_por_token = self._segundos_por_token or (duracion_s / evaluados if evaluados else 0.0)
+            estadisticas["ahorro_estimado_s"] += reutilizados * segundos_por_token
+
+    def estadisticas(self):
+        with self._lock:
+            return dict(self._estadisticas)
+
+    def resumen(self):
+        """Una línea legible con el ahorro acumulado"""
+        e = self.estadisticas()
+        if not e["llamadas"]:
+            return "Prefijo: sin llamadas"
+        return (f"Prefijo reutilizado: {e['tokens_reutilizados']} token(s) en {e['llamadas']} llamada(s), "
+                f"~{e['ahorro_estimado_s']:.2f}s de prompt_eval ahorrados "
+                f"({e['prompt_eval_s'] / e['llamadas']:.3f}s de prompt_eval por llamada)")
+
+_sesiones = {}
+_lock_sesiones = threading.Lock()
+
+def obtener(prompt_sistema, modelo, opciones=None, formato=None):
+    """
+    Sesión compartida para un prompt de sistema, modelo, opciones y formato.
+    Todos los hilos que usan el mismo prompt reutilizan la misma sesión.
+    """
+    clave = (prompt_sistema, modelo, tuple(sorted((opciones or {}).items())), formato)
+    with _lock_sesiones:
+        if clave not in _sesiones:
+            _sesiones[clave] = SesionPrompt(prompt_sistema, modelo, opciones, formato)
+        return _sesiones[clave]
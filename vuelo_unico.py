@@ -0,0 +1,87 @@
+import json
+import hashlib
+import threading
+from concurrent.futures import Future
+import configuracion
+
+OLLAMA_VUELO_UNICO = configuracion.obtener("OLLAMA_VUELO_UNICO", "1") != "0"
+
+def clave(endpoint, payload):
+    """Hash de la petición completa: solo las idénticas comparten vuelo"""
+    contenido = json.dumps({"endpoint": endpoint, "payload": payload}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+class VueloUnico:
+    """
+    Coalescencia de peticiones idénticas simultáneas: la primera (líder) se envía y las que
+    llegan mientras está en vuelo esperan su resultado en lugar de repetirla.
+    Sirve tanto para hilos como para corrutinas de asyncio.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._en_vuelo = {}  # clave -> Future del líder
+        self.solicitudes = 0
+        self.coalescidas = 0
+
+    def ejecutar(self, clave, funcion):
+        """
+        Ejecuta funcion() o se suma a la ejecución idéntica en curso.
+        Devuelve (resultado, compartido); compartido es True si el resultado vino de otra llamada.
+        Si el líder lanza una excepción, todas las llamadas que lo esperaban la reciben.
+        """
+        with self._lock:
+            self.solicitudes += 1
+            futuro = self._en_vuelo.get(clave)
+            lider = futuro is None
+            if lider:
+                futuro = self._en_vuelo[clave] = Future()
+            else:
+                self.coalescidas += 1
+
+        if not lider:
+            return futuro.result(), True
+
+        try:
+            resultado = funcion()
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        else:
+            futuro.set_result(resultado)
+        finally:
+            with self._lock:
+                self._en_vuelo.pop(clave, None)
+        return resultado, False
+
+    async def ejecutar_async(self, clave, funcion):
+        """
+        Igual que ejecutar() para asyncio: si ya hay una petición idéntica en vuelo se espera
+        sin ocupar un hilo; si no, funcion (bloqueante) se ejecuta en el pool del loop
+        """
+        import asyncio
+        with self._lock:
+            futuro = self._en_vuelo.get(clave)
+            if futuro is not None:
+                self.solicitudes += 1
+                self.coalescidas += 1
+        if futuro is not None:
+            return await asyncio.wrap_future(futuro), True
+        return await asyncio.get_running_loop().run_in_executor(None, self.ejecutar, clave, funcion)
+
+    def estadisticas(self):
+        """{"solicitudes", "coalescidas", "en_vuelo"}"""
+        with self._lock:
+            return {"solicitudes": self.solicitudes, "coalescidas": self.coalescidas, "en_vuelo": len(self._en_vuelo)}
+
+_vuelo = None
+_lock_vuelo = threading.Lock()
+
+def obtener():
+    """Coalescedor compartido del proceso"""
+    global _vuelo
+    if _vuelo is None:
+        with _lock_vuelo:
+            if _vuelo is None:
+                _vuelo = VueloUnico()
+    return _vuelo